@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+適用フェーズの追記型ジャーナル（JSON Lines）
+
+レコード
+    {"t": "meta",  "hash_algo": ...}                # 検証用（expected_hash のアルゴリズム）
+    {"t": "plan",  "i": 0, "action": ..., "local_path": ..., "remote_path": ..., "rel_path": ..., "expected_hash": ...,
+                                                  "local_src": ...}   # ローカル内の移動・コピー元
+    {"t": "plan_end"}                             # 計画を全件書き終えた
+    {"t": "begin", "i": 0}
+    {"t": "done",  "i": 0, "ok": true}            # ok=false の場合は "error" を併記
+    {"t": "end"}                                  # 全件処理済み
+
+- 計画（plan）を書き、1アクションごとに begin → done を追記。計画は走査しながら
+  逐次書いてもよく（open → plan ... → plan_end）、適用はその間に始まっていてよい
+- 中断後は --resume で計画をジャーナルから復元し（再走査なし）、成功済みを飛ばす
+  （ok=false で終わったもの＝共有の切断中に失敗したコピー等はやり直す）
+- begin だけ残っている（実行中に落ちた）アクションは結果を検証し、未完了ならやり直す
+- 並列適用のため書き込みはスレッドセーフ（完了順に追記される）
+- plan レコードのキーは keys で差し替えられる（既定は同期用の PLAN_KEYS）
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Union
+
+PathLike = Union[str, Path]
+
+PLAN_KEYS = ("action", "reason", "local_path", "remote_path", "rel_path", "expected_hash", "local_src")
+
+
+class JournalState(NamedTuple):
+    plan: List[dict]      # 計画（"i" 付き）
+    done: Set[int]        # 成功したもの（--resume で飛ばす）
+    in_flight: Set[int]   # begin のみで done が無い
+    finished: bool        # end まで到達済み
+    meta: dict            # start 時の付帯情報（hash_algo 等）
+    plan_complete: bool   # plan_end まで到達済み（False なら走査途中で中断）
+    failed: Set[int]      # ok=false で終わったもの（--resume でやり直す）
+
+
+class ApplyJournal:
+    def __init__(self, path: PathLike, fsync_every: int = 200, keys: tuple = PLAN_KEYS):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.keys = keys
+        self._f = None
+        self._since_sync = 0
+        self._lock = threading.Lock()
+
+    # --- 書き込み ---
+    def start(self, plan_rows: List[dict], meta: Optional[dict] = None) -> None:
+        """新規ジャーナルを作成し、計画を全件書き込む。"""
+        self.open(meta)
+        for i, r in enumerate(plan_rows):
+            self.plan(i, r)
+        self.plan_end()
+
+    def open(self, meta: Optional[dict] = None) -> None:
+        """新規ジャーナルを作成する（計画は plan() で逐次追記）。"""
+        self._f = self.path.open("w", encoding="utf-8")
+        if meta:
+            self._write({"t": "meta", **meta})
+
+    def plan(self, i: int, r: dict) -> None:
+        with self._lock:
+            self._write({"t": "plan", "i": i, **{k: r.get(k, "") for k in self.keys}})
+
+    def plan_end(self) -> None:
+        with self._lock:
+            self._write({"t": "plan_end"})
+            self._sync()
+
+    def reopen(self) -> None:
+        """--resume 時：既存ジャーナルに追記する。"""
+        self._f = self.path.open("a", encoding="utf-8")
+
+    def begin(self, i: int) -> None:
+        with self._lock:
+            self._write({"t": "begin", "i": i})
+
+    def done(self, i: int, ok: bool = True, error: str = "") -> None:
+        rec = {"t": "done", "i": i, "ok": ok}
+        if not ok:
+            rec["error"] = error
+        with self._lock:
+            self._write(rec)
+            self._since_sync += 1
+            if self._since_sync >= self.fsync_every:
+                self._sync()
+
+    def end(self) -> None:
+        self._write({"t": "end"})
+        self.close()
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._sync()
+            self._f.close()
+            self._f = None
+
+    def _write(self, rec: dict) -> None:
+        self._f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._f.flush()  # プロセス異常終了でも書いた行は残る
+
+    def _sync(self) -> None:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._since_sync = 0
+
+    # --- 読み込み ---
+    @staticmethod
+    def load(path: PathLike) -> Optional[JournalState]:
+        path = Path(path)
+        if not path.exists():
+            return None
+        plan: Dict[int, dict] = {}
+        begun: Set[int] = set()
+        done: Set[int] = set()
+        failed: Set[int] = set()
+        meta: dict = {}
+        plan_complete = False
+        finished = False
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break  # 書きかけの最終行
+                t = rec.get("t")
+                if t == "meta":
+                    meta = {k: v for k, v in rec.items() if k != "t"}
+                elif t == "plan":
+                    plan[rec["i"]] = rec
+                elif t == "plan_end":
+                    plan_complete = True
+                elif t == "begin":
+                    begun.add(rec["i"])
+                elif t == "done":
+                    if rec.get("ok", True):
+                        done.add(rec["i"])
+                        failed.discard(rec["i"])  # --resume でやり直して成功した
+                    else:
+                        failed.add(rec["i"])
+                        done.discard(rec["i"])
+                elif t == "end":
+                    finished = True
+        return JournalState([plan[i] for i in sorted(plan)], done, begun - done - failed, finished, meta, plan_complete,
+                            failed)
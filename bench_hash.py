@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+ハッシュ計算のマイクロベンチマーク（従来 md5sum() と HashEngine の比較）
+
+- 既定：典型的な画像サイズ分布（対数正規、中央値 ~150KB、8KB〜20MB に丸め）の
+  テンポラリファイルを生成して計測
+- --sample-dir 指定時：そのフォルダ配下の実画像を使う
+- 各方式とも事前に1回読んでページキャッシュに載せ、ディスクではなく
+  ハッシュ計算＋コピーのコストを比べる
+
+例:
+    python bench_hash.py --files 2000
+    python bench_hash.py --sample-dir "D:\\datasets\\train" --algos md5,blake2b --repeat 5
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from hash_engine import ALGORITHMS, HashEngine
+
+
+def legacy_md5sum(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """比較用：従来の check_*.py の md5sum()（チャンク毎に bytes を新規確保）"""
+    h = hashlib.md5()
+    try:
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except Exception:
+        return ""
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="ハッシュ計算スループット比較")
+    p.add_argument("--sample-dir", default=None, help="実画像フォルダ（省略時は合成ファイル）")
+    p.add_argument("--files", type=int, default=1000, help="合成ファイル数")
+    p.add_argument("--median-kb", type=float, default=150.0, help="合成サイズ分布の中央値（KB）")
+    p.add_argument("--sigma", type=float, default=1.0, help="対数正規分布の sigma")
+    p.add_argument("--algos", default="md5,blake2b", help="HashEngine で計測するアルゴリズム")
+    p.add_argument("--repeat", type=int, default=3, help="繰り返し回数（最良値を採用）")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+def make_synthetic(root: Path, n: int, median_kb: float, sigma: float, seed: int) -> List[Path]:
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n):
+        size = int(min(max(rng.lognormvariate(0, sigma) * median_kb * 1024, 8 * 1024), 20 * 1024 * 1024))
+        p = root / f"img_{i:06d}.jpg"
+        p.write_bytes(os.urandom(size))
+        paths.append(p)
+    return paths
+
+
+def collect_samples(root: Path) -> List[Path]:
+    exts = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+    return [Path(d, f) for d, _, fs in os.walk(root) for f in fs if os.path.splitext(f)[1].lower() in exts]
+
+
+def measure(fn: Callable[[Path], object], paths: List[Path], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for p in paths:
+            fn(p)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    args = parse_args()
+    algos = [a.strip() for a in args.algos.split(",") if a.strip()]
+    for a in algos:
+        if a not in ALGORITHMS:
+            print(f"[ERROR] 未対応のアルゴリズム: {a}（対応: {', '.join(ALGORITHMS)}）")
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="bench_hash_") as tmp:
+        if args.sample_dir:
+            paths = collect_samples(Path(args.sample_dir))
+        else:
+            paths = make_synthetic(Path(tmp), args.files, args.median_kb, args.sigma, args.seed)
+        if not paths:
+            print("[ERROR] 対象ファイルがありません")
+            sys.exit(1)
+
+        sizes = sorted(p.stat().st_size for p in paths)
+        total = sum(sizes)
+        print(f"[INFO] files={len(paths)} total={total / 1024 / 1024:.1f} MiB "
+              f"p50={sizes[len(sizes) // 2] / 1024:.0f} KiB p95={sizes[int(len(sizes) * 0.95)] / 1024:.0f} KiB "
+              f"max={sizes[-1] / 1024:.0f} KiB")
+
+        for p in paths:  # ページキャッシュに載せる
+            p.read_bytes()
+
+        cases: List[Tuple[str, Callable[[Path], object]]] = [("legacy md5sum()", legacy_md5sum)]
+        for a in algos:
+            eng = HashEngine(a)
+            cases.append((f"HashEngine {a}", eng.hexdigest))
+            cases.append((f"HashEngine {a} +mmap", lambda p, e=eng: e.hexdigest(p, allow_mmap=True)))
+
+        base = None
+        print(f"{'case':<28}{'sec':>9}{'MiB/s':>10}{'files/s':>10}{'speedup':>9}")
+        for name, fn in cases:
+            sec = measure(fn, paths, args.repeat)
+            base = base or sec
+            print(f"{name:<28}{sec:>9.3f}{total / 1024 / 1024 / sec:>10.1f}{len(paths) / sec:>10.0f}{base / sec:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
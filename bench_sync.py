@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+フォルダ比較スクリプトのベンチマーク（合成データセット＋遅延付きの擬似リモート）
+
+- 合成ツリー：<split>/<class_xxx>/img_xxxxx.jpg を local/ と remote/ に生成
+  - 画像サイズは対数正規分布（中央値 --median-kb、--sigma）
+  - --diff-pct の割合で差分を作る（内容違い・ローカル欠け・リモート欠けを 1/3 ずつ。
+    内容違いの半分はサイズ同一＝ハッシュまで読まないと分からないもの）
+  - RemoteOnly / LocalOnly フォルダも --only-folders 個ずつ作る
+- 擬似リモート：各ツールを子プロセスで実行し、remote/ 配下への
+  os.scandir / os.stat / os.lstat / os.listdir / open の呼び出しごとに --latency-ms だけ待つ
+  （SMB の往復を模擬。DirEntry.stat は Windows の SMB 同様に追加往復なしとして扱う）
+- 計測：実行時間、上記呼び出しの回数（側ごと）、/proc/self/io の read 系 syscall 数と読み込みバイト、
+  CPU 時間、最大 RSS
+- 対象：check_oper_remote.py / check_remote_dry.py / check_remote_local.py（比較のみ、適用なし）
+
+例:
+    python bench_sync.py --classes 20 --images 50 --latency-ms 2
+    python bench_sync.py --tools check_oper_remote --latency-ms 5 --extra-args "--compare-mode quick" --out bench.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import atexit
+import argparse
+import builtins
+import tempfile
+import subprocess
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List
+
+HERE = Path(__file__).resolve().parent
+TOOLS = ("check_oper_remote", "check_remote_dry", "check_remote_local")
+IO_KEYS = ("rchar", "syscr", "read_bytes", "wchar", "syscw")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="フォルダ比較スクリプトのベンチマーク")
+    p.add_argument("--workdir", default=None, help="合成ツリーの作成先（省略時はテンポラリ。指定時は再利用）")
+    p.add_argument("--splits", default="train,val", help="split フォルダ（カンマ区切り）")
+    p.add_argument("--classes", type=int, default=20, help="split ごとのクラスフォルダ数")
+    p.add_argument("--images", type=int, default=30, help="クラスフォルダごとの画像数")
+    p.add_argument("--median-kb", type=float, default=64.0, help="画像サイズ分布の中央値（KB）")
+    p.add_argument("--sigma", type=float, default=1.0, help="対数正規分布の sigma")
+    p.add_argument("--diff-pct", type=float, default=5.0, help="差分にする画像の割合（%%）")
+    p.add_argument("--only-folders", type=int, default=1, help="RemoteOnly / LocalOnly フォルダ数（各）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--latency-ms", type=float, default=2.0, help="擬似リモートの1操作あたりの遅延")
+    p.add_argument("--tools", default=",".join(TOOLS), help="計測するスクリプト（カンマ区切り）")
+    p.add_argument("--extra-args", default="", help="CLI 系スクリプトに追加で渡す引数（例: \"--compare-mode quick\"）")
+    p.add_argument("--repeat", type=int, default=1, help="繰り返し回数（最速の回を採用）")
+    p.add_argument("--out", default=None, help="結果 JSON の出力先")
+    p.add_argument("--verbose", action="store_true", help="各スクリプトの出力を表示")
+    p.add_argument("--shim", default=None, help=argparse.SUPPRESS)  # 子プロセス用
+    return p.parse_args()
+
+
+# ========= 合成ツリー =========
+def write_random(path: Path, size: int, rng: random.Random) -> None:
+    path.write_bytes(rng.randbytes(size))
+
+
+def make_trees(root: Path, args) -> Dict[str, int]:
+    """root/local と root/remote を生成し、差分の内訳を返す。"""
+    rng = random.Random(args.seed)
+    local, remote = root / "local", root / "remote"
+    stats: Counter = Counter()
+
+    def size_of() -> int:
+        return int(min(max(rng.lognormvariate(0, args.sigma) * args.median_kb * 1024, 4 * 1024), 20 * 1024 * 1024))
+
+    splits = [s.strip() for s in args.splits.split(",") if s.strip()]
+    for split in splits:
+        for c in range(args.classes):
+            rel = Path(split, f"class_{c:03d}")
+            (local / rel).mkdir(parents=True, exist_ok=True)
+            (remote / rel).mkdir(parents=True, exist_ok=True)
+            for i in range(args.images):
+                name = f"img_{i:05d}.jpg"
+                lp, rp = local / rel / name, remote / rel / name
+                write_random(rp, size_of(), rng)
+                roll = rng.random() * 100
+                if roll < args.diff_pct:
+                    kind = rng.randrange(3)
+                    if kind == 0:  # 内容違い（半分はサイズ同一）
+                        size = rp.stat().st_size if rng.random() < 0.5 else size_of()
+                        write_random(lp, size, rng)
+                        stats["different"] += 1
+                    elif kind == 1:  # ローカルに無い
+                        stats["missing_on_local"] += 1
+                    else:  # リモートに無い
+                        shutil.copy2(rp, lp)
+                        rp.unlink()
+                        stats["missing_on_remote"] += 1
+                else:
+                    shutil.copy2(rp, lp)
+                    stats["same"] += 1
+
+    for k in range(args.only_folders):
+        for side, label in ((remote, "remote_only"), (local, "local_only")):
+            d = side / splits[0] / f"{label}_{k:02d}"
+            d.mkdir(parents=True, exist_ok=True)
+            for i in range(max(1, args.images // 2)):
+                write_random(d / f"img_{i:05d}.jpg", size_of(), rng)
+                stats[f"{label}_files"] += 1
+
+    stats["bytes_total"] = sum(p.stat().st_size for p in root.rglob("*.jpg"))
+    return dict(stats)
+
+
+# ========= 子プロセス側（擬似リモート） =========
+def install_latency(remote_root: str, latency_s: float, counts: Counter) -> None:
+    """remote_root 配下へのファイルシステム呼び出しに遅延を入れ、側ごとに回数を数える。"""
+    prefix = os.path.abspath(remote_root) + os.sep
+
+    def wrap(name, fn):
+        def wrapper(path=".", *a, **kw):
+            try:
+                s = os.fsdecode(os.fspath(path))
+            except TypeError:  # fd 等
+                return fn(path, *a, **kw)
+            if (os.path.abspath(s) + os.sep).startswith(prefix):
+                counts[f"remote_{name}"] += 1
+                time.sleep(latency_s)
+            else:
+                counts[f"local_{name}"] += 1
+            return fn(path, *a, **kw)
+        return wrapper
+
+    os.scandir = wrap("scandir", os.scandir)
+    os.stat = wrap("stat", os.stat)
+    os.lstat = wrap("lstat", os.lstat)
+    os.listdir = wrap("listdir", os.listdir)
+    builtins.open = io.open = wrap("open", io.open)
+
+
+def read_proc_io() -> Dict[str, int]:
+    try:
+        with open("/proc/self/io", "r") as f:
+            kv = dict(line.split(":", 1) for line in f if ":" in line)
+        return {k: int(kv[k]) for k in IO_KEYS if k in kv}
+    except OSError:
+        return {}  # Linux 以外
+
+
+def run_shim(spec_path: str) -> None:
+    import resource
+    import importlib.util
+
+    spec = json.loads(Path(spec_path).read_text(encoding="utf-8"))
+    counts: Counter = Counter()
+    io0 = read_proc_io()
+    t0 = time.perf_counter()
+
+    def dump():
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        io1 = read_proc_io()
+        Path(spec["result"]).write_text(json.dumps({
+            "wall_sec": round(time.perf_counter() - t0, 4),
+            "cpu_sec": round(ru.ru_utime + ru.ru_stime, 4),
+            "max_rss_mb": round(ru.ru_maxrss / 1024, 1),
+            "io": {k: io1.get(k, 0) - io0.get(k, 0) for k in io1},
+            "ops": dict(counts),
+        }), encoding="utf-8")
+
+    atexit.register(dump)
+    sys.path.insert(0, str(HERE))
+    os.chdir(spec["cwd"])
+    install_latency(spec["remote_root"], spec["latency_ms"] / 1000.0, counts)
+
+    script = HERE / f"{spec['tool']}.py"
+    mod_spec = importlib.util.spec_from_file_location(spec["tool"], script)
+    mod = importlib.util.module_from_spec(mod_spec)
+    sys.argv = [str(script)] + spec["argv"]
+    mod_spec.loader.exec_module(mod)
+    for k, v in spec.get("set", {}).items():  # 定数設定型のスクリプト
+        setattr(mod, k, v)
+    try:
+        mod.main()
+    except SystemExit:
+        pass
+
+
+# ========= 親プロセス側 =========
+def tool_spec(tool: str, local: Path, remote: Path, out_dir: Path, extra: List[str]) -> dict:
+    xlsx = str(out_dir / f"{tool}.xlsx")
+    if tool == "check_oper_remote":
+        return {"argv": ["--local", str(local), "--remote", str(remote), "--excel-out", xlsx,
+                         "--no-hash-cache", "--metrics-out", str(out_dir / f"{tool}.metrics.json")] + extra}
+    if tool == "check_remote_dry":
+        return {"argv": ["--local", str(local), "--remote", str(remote), "--excel-out", xlsx,
+                         "--first-pass-only", "--no-hash-cache"] + extra}
+    if tool == "check_remote_local":
+        return {"argv": [], "set": {"LOCAL_ROOT": str(local), "REMOTE_ROOT": str(remote), "EXCEL_OUT": xlsx,
+                                    "APPLY_DIFFS": False, "HASH_CACHE_DB": None,
+                                    "METRICS_OUT": str(out_dir / f"{tool}.metrics.json")}}
+    raise ValueError(tool)
+
+
+def run_tool(tool: str, root: Path, args, extra: List[str]) -> dict:
+    out_dir = root / "out"
+    out_dir.mkdir(exist_ok=True)
+    spec = tool_spec(tool, root / "local", root / "remote", out_dir, extra)
+    spec.update({"tool": tool, "cwd": str(out_dir), "remote_root": str(root / "remote"),
+                 "latency_ms": args.latency_ms, "result": str(out_dir / f"{tool}.bench.json")})
+    spec_path = out_dir / f"{tool}.spec.json"
+    spec_path.write_text(json.dumps(spec), encoding="utf-8")
+
+    t = time.perf_counter()
+    proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--shim", str(spec_path)],
+                          stdout=None if args.verbose else subprocess.DEVNULL,
+                          stderr=None if args.verbose else subprocess.PIPE)
+    outer = time.perf_counter() - t
+    if proc.returncode != 0:
+        print(f"[ERROR] {tool} が失敗しました（exit={proc.returncode}）")
+        if proc.stderr:
+            print(proc.stderr.decode("utf-8", "replace")[-2000:])
+        return {}
+    res = json.loads(Path(spec["result"]).read_text(encoding="utf-8"))
+    res["process_sec"] = round(outer, 4)
+    return res
+
+
+def main():
+    args = parse_args()
+    if args.shim:
+        run_shim(args.shim)
+        return
+
+    tools = [t.strip() for t in args.tools.split(",") if t.strip()]
+    for t in tools:
+        if t not in TOOLS:
+            print(f"[ERROR] 未対応のスクリプト: {t}（対応: {', '.join(TOOLS)}）")
+            sys.exit(1)
+    extra = args.extra_args.split()
+
+    tmp = None
+    if args.workdir:
+        root = Path(args.workdir)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench_sync_")
+        root = Path(tmp.name)
+    try:
+        if (root / "local").exists() and (root / "remote").exists():
+            print(f"[INFO] 既存の合成ツリーを使用: {root}")
+            tree = {}
+        else:
+            t = time.perf_counter()
+            tree = make_trees(root, args)
+            print(f"[INFO] 合成ツリー作成: {root}（{time.perf_counter() - t:.1f}s）{tree}")
+
+        results = {}
+        print(f"[INFO] latency={args.latency_ms}ms/op repeat={args.repeat}")
+        print(f"{'tool':<20}{'wall':>8}{'cpu':>8}{'rss MB':>8}{'r.scandir':>10}{'r.stat':>8}"
+              f"{'r.open':>8}{'l.open':>8}{'syscr':>9}{'read MiB':>10}")
+        for tool in tools:
+            runs = [run_tool(tool, root, args, extra) for _ in range(args.repeat)]
+            runs = [r for r in runs if r]
+            if not runs:
+                continue
+            best = min(runs, key=lambda r: r["wall_sec"])
+            results[tool] = best
+            ops, pio = best["ops"], best["io"]
+            print(f"{tool:<20}{best['wall_sec']:>8.2f}{best['cpu_sec']:>8.2f}{best['max_rss_mb']:>8.0f}"
+                  f"{ops.get('remote_scandir', 0):>10}{ops.get('remote_stat', 0) + ops.get('remote_lstat', 0):>8}"
+                  f"{ops.get('remote_open', 0):>8}{ops.get('local_open', 0):>8}"
+                  f"{pio.get('syscr', 0):>9}{pio.get('rchar', 0) / 1024 / 1024:>10.1f}")
+
+        if args.out:
+            Path(args.out).write_text(json.dumps({
+                "params": {k: v for k, v in vars(args).items() if k != "shim"},
+                "tree": tree,
+                "results": results,
+            }, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"[DONE] {args.out}")
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@
   - Match（両方にある）/ LocalOnly / RemoteOnly を判定
   - LocalOnly/RemoteOnly はそのフォルダ直下の画像数を計数してExcelに出力
 - Matchフォルダ内は画像ファイルを
-  - ファイル名一致 → 内容（MD5）比較
+  - ファイル名一致 → 内容（ハッシュ：既定 MD5、--hash-algo で変更）比較
   - ローカルのみ／リモートのみ／内容差分 を抽出
 - アクション計画を生成
   - RemoteOnly フォルダの画像 → コピー
@@ -16,9 +16,31 @@
   - Match で MissingOnRemote → 削除（オプション）
   - LocalOnly フォルダの画像 → 削除（オプション）
 - Excel出力：FolderSummary / FileDiffs / PlannedActions / Applied / Errors
+- 適用はコピー/削除を --copy-workers 並列で実行（copy_file_range/sendfile 優先）。
+  --verify-copy で比較フェーズのリモートハッシュとコピー先を照合
+- 転送制限：--max-mbps / --max-files-per-sec（トークンバケット）。--throttle-control の制御ファイルを
+  書き換えると実行中でも上限を変更・一時停止できる。--batch-small-kb 以下のファイルは
+  コピー元フォルダごとにまとめて1ワーカーで処理し、存在確認はフォルダ一覧1回で済ませる
+- レポートは行単位のストリーミング出力（上限超過のシートは自動分割、CSV/Parquet サイドカー可）
+- 走査 → 比較 → 計画 → レポート/適用 はフォルダ単位のジェネレータでつなぐ。
+  ファイル行は溜めず、--apply 時は走査中に届いた計画から適用を始める
+  （FileDiffs / PlannedActions はフォルダの深さ優先順。FolderSummary のみ並べ替え）
+- --merkle：フォルダダイジェスト（直下画像の 名前・size・ハッシュ）をハッシュキャッシュに保存し、
+  両側でサブツリーが一致するフォルダの配下は比較しない（FolderSummary にそのフォルダ1行だけ出し、
+  digest_match 列に tree / folder を記録。一致した画像は FileDiffs に出さない）
+- --detect-moves：コピー予定の画像とローカルにだけある画像を内容ハッシュで突合し、
+  MOVE_LOCAL / COPY_LOCAL / RENAME_LOCAL_FOLDER（ローカル内の移動・コピー・フォルダ改名）に置き換える
+  （リモートのハッシュは計算済み・マニフェスト・キャッシュの旧パスから。リモートを余分に読まない）
+- リモートのフォルダ一覧は asyncio で最大 --crawl-inflight 件を同時に先読み（出力順は逐次と同じ）
+- --watch：初回の全体比較の後も常駐し、変更のあったフォルダだけを比較・計画（--apply なら適用）する。
+  ローカルは inotify（Linux。それ以外はポーリング）、リモートは既知フォルダの mtime を
+  --watch-interval 秒ごとに stat。結果はサイクルごとに <excel-out の stem>.<日付>.<シート名>.csv へ追記。
+  フォルダ mtime に出ない同名上書きは --full-rescan-minutes ごとの全体比較で拾う
+- フェーズ別の時間・カウンタ（stat 数、側ごとのハッシュ読み込み量、キャッシュヒット、
+  コピー速度）を <excel-out>.metrics.json に保存（--metrics-sheet で Metrics シートにも出力）
 
 前提
-    pip install pandas openpyxl
+    pip install openpyxl（Parquet サイドカーは pyarrow も）
 
 注意
 - リモートは UNC（例：\\SERVER\Share）やマップドドライブで Python から参照可能であること
@@ -27,13 +49,35 @@
 
 import os
 import sys
+import time
 import argparse
-import hashlib
-import shutil
+from collections import Counter
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Tuple
-import pandas as pd
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from apply_journal import ApplyJournal
+from copy_engine import CopyExecutor
+from report_writer import SIDECAR_FORMATS, ReportWriter, RollingCsvReport
+from hash_cache import HashCache, open_cache
+from hash_engine import ALGORITHMS, HashEngine
+from file_compare import COMPARE_MODES, compare_pair
+from hash_pool import HashPool
+from merkle import FolderDigests, MerkleCompare
+from move_detect import MoveDetector
+from pipeline import FolderPair, FolderResult, bounded, walk_pairs
+from sync_manifest import remote_snapshot
+from sync_metrics import Metrics
+from throttle import DirListing, TransferThrottle
+from tree_snapshot import FileMeta, TreeSnapshot
+from watch_sync import FULL_RESCAN, RemoteDirPoller, dirty_pairs, local_watcher
+
+FOLDER_COLUMNS = ["rel_folder", "local_path", "remote_path", "folder_status",
+                  "local_img_count", "remote_img_count"]
+FILE_COLUMNS = ["rel_path", "file_name", "folder_rel", "local_path", "remote_path",
+                "compare_result", "compare_tier", "bytes_read", "local_size", "remote_size",
+                "local_mtime", "remote_mtime", "local_hash", "remote_hash", "hash_algo"]
+PLAN_COLUMNS = ["action", "reason", "local_path", "remote_path", "rel_path", "expected_hash", "local_src"]
 
 
 def parse_args():
@@ -43,10 +87,34 @@ def parse_args():
     p.add_argument("--excel-out", default="compare_result.xlsx", help="Excel出力先")
     p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
                    help="対象拡張子（小文字・カンマ区切り）例：.jpg,.png,.webp")
+    p.add_argument("--report-sidecar", choices=SIDECAR_FORMATS, default="none",
+                   help="各シートを CSV/Parquet にも出力（<excel-out名>.<シート名>.csv 等）")
+    p.add_argument("--remote-manifest", default=None,
+                   help="sync_manifest.py で作成したリモートのマニフェスト。指定時はリモートを走査しない")
 
     # 実行系
     p.add_argument("--dry-run", action="store_true", help="DRY-RUN（実ファイル操作なし）")
     p.add_argument("--apply", action="store_true", help="計画を実行（コピー/上書き/削除）")
+    p.add_argument("--journal", default=None,
+                   help="適用ジャーナル（追記型）の保存先。既定は <excel-out>.journal.jsonl")
+    p.add_argument("--copy-workers", type=int, default=4,
+                   help="適用時の同時コピー/削除数")
+    p.add_argument("--verify-copy", action="store_true",
+                   help="コピー後、コピー先を比較フェーズのリモートハッシュと照合（リモートは読み直さない）")
+    p.add_argument("--queue-size", type=int, default=256,
+                   help="走査・比較と適用の間に溜める計画の上限件数（メモリ上限の目安）")
+    p.add_argument("--max-mbps", type=float, default=0.0,
+                   help="コピーの帯域上限（MiB/秒）。0 で無制限")
+    p.add_argument("--max-files-per-sec", type=float, default=0.0,
+                   help="コピーするファイル数の上限（件/秒。メタデータ往復の抑制）。0 で無制限")
+    p.add_argument("--throttle-control", default=None,
+                   help="転送制限の制御ファイル（max_mbps / max_files_per_sec / paused）。"
+                        "実行中に書き換えると数秒で反映。無ければ現在の値で作成")
+    p.add_argument("--batch-small-kb", type=int, default=256,
+                   help="このサイズ以下のコピーはコピー元フォルダごとにまとめて処理（0 でまとめない）")
+    p.add_argument("--batch-max-files", type=int, default=64, help="まとめる最大件数")
+    p.add_argument("--resume", action="store_true",
+                   help="中断した適用をジャーナルから再開（再走査せず、未完了分のみ実行）")
 
     # 振る舞い（既定は“安全寄り”）
     p.add_argument("--overwrite-different", action="store_true", default=True,
@@ -63,46 +131,278 @@ def parse_args():
                    help="LocalOnly フォルダ/ファイルを削除（既定OFF）※危険")
     p.add_argument("--delete-missing-on-remote", action="store_true",
                    help="Matchフォルダ内でリモートに無いローカルファイルを削除（既定OFF）※危険")
+    p.add_argument("--detect-moves", action="store_true",
+                   help="リモート側の移動・改名を内容ハッシュで検出し、ネットワーク越しのコピーを"
+                        "ローカル内の移動/コピー/フォルダ改名に置き換える（コピー・削除計画は走査後にまとめて出力）")
+
+    # ハッシュキャッシュ（未変更ファイルは内容を読まない）
+    p.add_argument("--hash-cache", default="hash_cache.sqlite",
+                   help="ハッシュキャッシュ（SQLite）の保存先。size/mtime/inode 一致時は再計算しない")
+    p.add_argument("--no-hash-cache", dest="hash_cache", action="store_const", const=None,
+                   help="ハッシュキャッシュを使わない（毎回すべて読み込む）")
+    p.add_argument("--hash-algo", choices=sorted(ALGORITHMS), default="md5",
+                   help="内容比較のハッシュ（blake2b 等は md5 より高速。FileDiffs の hash_algo 列に記録）")
+
+    # 計測
+    p.add_argument("--metrics-out", default=None,
+                   help="フェーズ別計測の JSON 出力先。既定は <excel-out>.metrics.json")
+    p.add_argument("--metrics-sheet", action="store_true", help="計測結果を Metrics シートにも出力")
+
+    # 比較方式（安い判定から順に。FileDiffs の compare_tier 列に決着段階を記録）
+    p.add_argument("--compare-mode", choices=COMPARE_MODES, default="full",
+                   help="full: サイズ→全体ハッシュ / quick: サイズ→mtime一致ならSame→全体ハッシュ / "
+                        "sampled: サイズ→先頭・中央・末尾ブロック→全体ハッシュ")
+    p.add_argument("--mtime-window", type=float, default=0.0,
+                   help="quick モードで mtime を一致とみなす許容差（秒）。FAT 系なら 2 など")
+    p.add_argument("--merkle", action="store_true",
+                   help="フォルダダイジェストで未変更のサブツリーを丸ごと飛ばす（ダイジェストは全体ハッシュ。"
+                        "--hash-cache と併用で2回目以降は一覧が変わったフォルダだけ読む）")
+
+    # 並列度（読み込みの同時実行数を側ごとに制限）
+    p.add_argument("--local-workers", type=int, default=4,
+                   help="ローカル側の同時読み込み数（SSD を飽和させない程度に）")
+    p.add_argument("--remote-workers", type=int, default=8,
+                   help="リモート側の同時読み込み数（NAS/SMB の遅延を隠すため多め）")
+    p.add_argument("--crawl-inflight", type=int, default=16,
+                   help="フォルダ一覧（scandir）の同時先読み数。0 で1フォルダずつ逐次（ファイルサーバの負荷に応じて調整）")
+
+    # 常駐（cron で毎回全体を走査する代わり）
+    p.add_argument("--watch", action="store_true",
+                   help="初回比較の後も常駐し、変更のあったフォルダだけ比較・計画・適用する（Ctrl+C で終了）")
+    p.add_argument("--watch-interval", type=float, default=10.0,
+                   help="--watch：リモートのフォルダ mtime を確認する間隔（秒）")
+    p.add_argument("--full-rescan-minutes", type=float, default=60.0,
+                   help="--watch：全体を比較し直す間隔（分）。同名上書きなどフォルダ mtime に出ない変更用。0 で無効")
+    p.add_argument("--watch-keep-days", type=int, default=7,
+                   help="--watch：日付別 CSV レポートの保持日数（0 で削除しない）")
 
     return p.parse_args()
 
 
-def is_image(p: Path, image_exts: set) -> bool:
-    return p.suffix.lower() in image_exts
+def content_hash(meta: FileMeta, engine: HashEngine, cache: Optional[HashCache] = None,
+                 local: bool = False) -> Tuple[str, int, bool]:
+    """
+    ハッシュ値・実際に読んだバイト数・実際に計算したか（キャッシュヒット・既知なら False）を返す。
+    stat は発行しない。
+    """
+    if meta.digest:
+        return meta.digest, 0, False  # マニフェスト等で既知
+    nread = 0
+    hashed = False
+
+    def compute(p: Path) -> str:
+        nonlocal nread, hashed
+        digest, nread = engine.hash_path(p, allow_mmap=local)  # mmap はローカルのみ
+        hashed = True
+        return digest
+
+    if cache is None:
+        digest = compute(Path(meta.path))
+    else:
+        digest = cache.get_or_compute_stat(meta.path, meta.size, meta.mtime_ns, meta.inode, compute)
+    return digest, nread, hashed
+
+
+def ensure_parent(path_str: str):
+    p = Path(path_str)
+    p.parent.mkdir(parents=True, exist_ok=True)
+
+
+def apply_action(r: dict, dry_run: bool, copier: CopyExecutor,
+                 remote_exists: Callable[[Path], bool] = os.path.exists) -> Optional[tuple]:
+    """1アクションを実行し Applied 行を返す（対象外は None）。失敗時は例外。"""
+    act = r["action"]
+    lp = Path(r["local_path"]) if r["local_path"] else None
+    rp = Path(r["remote_path"]) if r["remote_path"] else None
+
+    if act in ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE"):
+        if not rp or not remote_exists(rp):
+            raise FileNotFoundError(f"remote not found: {rp}")
+        ensure_parent(str(lp))
+        verified = None
+        if dry_run:
+            print(f"[DRY] {act}  {rp} -> {lp}")
+        else:
+            verified = copier.copy(rp, lp, r.get("expected_hash", ""))
+        return (act, str(rp), str(lp), verified)
+    elif act in ("MOVE_LOCAL", "COPY_LOCAL", "RENAME_LOCAL_FOLDER"):
+        src = Path(r["local_src"])
+        if not src.exists():
+            raise FileNotFoundError(f"local source not found: {src}")
+        if lp.exists():
+            raise FileExistsError(f"destination exists: {lp}")
+        ensure_parent(str(lp))
+        verified = None
+        if dry_run:
+            print(f"[DRY] {act}  {src} -> {lp}")
+        elif act == "COPY_LOCAL":
+            verified = copier.copy(src, lp, r.get("expected_hash", ""), throttled=False)  # 回線を使わない
+        else:
+            os.rename(src, lp)  # 同一ボリューム内なので内容は読み書きしない
+        return (act, str(src), str(lp), verified)
+    elif act == "DELETE_LOCAL_FILE":
+        if not lp:
+            return None
+        if dry_run:
+            print(f"[DRY] DELETE_LOCAL  {lp}")
+        else:
+            if lp.exists():
+                lp.unlink()
+        return (act, "", str(lp), None)
+    # 想定外のアクションはスキップ
+    return None
+
+
+def is_action_complete(r: dict) -> bool:
+    """中断時に実行中だったアクションが完了しているかを検証する（stat のみ）。"""
+    act = r["action"]
+    lp = Path(r["local_path"]) if r["local_path"] else None
+    if act in ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE"):
+        try:
+            ls, rs = lp.stat(), Path(r["remote_path"]).stat()
+        except OSError:
+            return False
+        # fast_copy は内容 → mtime の順に書くので、サイズと mtime が揃っていれば完了
+        return ls.st_size == rs.st_size and abs(ls.st_mtime - rs.st_mtime) < 1.0
+    if act in ("MOVE_LOCAL", "RENAME_LOCAL_FOLDER"):
+        return lp.exists() and not Path(r["local_src"]).exists()
+    if act == "COPY_LOCAL":
+        try:
+            return lp.stat().st_size == Path(r["local_src"]).stat().st_size
+        except OSError:
+            return False
+    if act == "DELETE_LOCAL_FILE":
+        return lp is None or not lp.exists()
+    return True
+
+
+COPY_ACTIONS = ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE")
+
+
+def batch_small_copies(indexed_plan: Iterable[Tuple[int, dict]], small_bytes: int,
+                       max_files: int) -> Iterator[List[Tuple[int, dict]]]:
+    """
+    small_bytes 以下のコピーを、続けて現れる同じコピー元フォルダの分ごとにまとめる
+    （1ワーカーが順に処理する）。それ以外のアクションは1件ずつ。
+    サイズは計画行の size（比較時のリモートのサイズ。ジャーナルからの再開時は無いのでまとめない）。
+    """
+    batch: List[Tuple[int, dict]] = []
+    key = None
+    for i, r in indexed_plan:
+        size = r.get("size")
+        if small_bytes <= 0 or r["action"] not in COPY_ACTIONS or size is None or size > small_bytes:
+            yield [(i, r)]
+            continue
+        k = os.path.dirname(r["remote_path"])
+        if batch and (k != key or len(batch) >= max_files):
+            yield batch
+            batch = []
+        key = k
+        batch.append((i, r))
+    if batch:
+        yield batch
+
+
+def run_apply(indexed_plan: Iterable[Tuple[int, dict]], dry_run: bool,
+              journal: Optional[ApplyJournal], copier: CopyExecutor,
+              small_bytes: int = 0, batch_max: int = 64) -> Tuple[list, list]:
+    """
+    copier の並列数でアクションを実行する。結果は計画順に並べ直して返す。
+    indexed_plan はジェネレータでもよい（走査中に届いた計画から順に実行）。
+    リモートの存在確認は、数件なら stat、同じフォルダに多く問い合わせるなら一覧をまとめて取って答える（DirListing）。
+    """
+    applied = []
+    errors = []
+    listing = DirListing()
+
+    def run_batch(batch: List[Tuple[int, dict]]) -> List[tuple]:
+        out = []
+        for i, r in batch:
+            if journal is not None:
+                journal.begin(i)
+            try:
+                out.append((i, r, apply_action(r, dry_run, copier, listing.exists), None))
+            except Exception as e:
+                out.append((i, r, None, e))
+        return out
+
+    total = len(indexed_plan) if isinstance(indexed_plan, list) else None
+    for batch, results, exc in copier.run(run_batch, batch_small_copies(indexed_plan, small_bytes, batch_max),
+                                          total=total):
+        for i, r, row, err in (results if exc is None else [(i, r, None, exc) for i, r in batch]):
+            if err is None:
+                if row is not None:
+                    applied.append((i, row))
+                if journal is not None:
+                    journal.done(i)
+            else:
+                errors.append((i, (r["action"], r["local_path"], r["remote_path"], repr(err))))
+                if journal is not None:
+                    journal.done(i, ok=False, error=repr(err))
+    if journal is not None:
+        journal.end()
+    return [row for _, row in sorted(applied)], [row for _, row in sorted(errors)]
 
 
-def md5sum(path: Path, chunk_size: int = 1024 * 1024) -> str:
-    h = hashlib.md5()
-    try:
-        with path.open("rb") as f:
-            for chunk in iter(lambda: f.read(chunk_size), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    except Exception:
-        return ""  # 読み出し不可など
+def write_apply_results(report: ReportWriter, applied: list, errors: list) -> None:
+    if applied:
+        report.write_sheet("Applied", ["action", "src_remote", "dst_local", "verified"], applied)
+    else:
+        report.write_sheet("Applied", ["info"], [["No actions executed (nothing to do or DRY)"]])
+    if errors:
+        report.write_sheet("Errors", ["action", "local_path", "remote_path", "error"], errors)
+
 
+def make_copier(workers: int, verify: bool, algo: str,
+                throttle: Optional[TransferThrottle] = None) -> CopyExecutor:
+    return CopyExecutor(workers, verify_engine=HashEngine(algo) if verify else None, throttle=throttle)
 
-def walk_dirs(root: Path) -> List[Path]:
-    """root配下の全フォルダ（自分含む）"""
-    res = []
-    for dirpath, _, _ in os.walk(root):
-        res.append(Path(dirpath))
-    return res
 
+def make_throttle(args) -> Optional[TransferThrottle]:
+    """制限なし・制御ファイルなしなら None（従来どおり一括コピー）"""
+    if args.max_mbps <= 0 and args.max_files_per_sec <= 0 and not args.throttle_control:
+        return None
+    throttle = TransferThrottle(args.max_mbps, args.max_files_per_sec, args.throttle_control)
+    print(f"[INFO] 転送制限: {throttle.describe()}")
+    return throttle
 
-def list_images(folder: Path, image_exts: set) -> List[Path]:
-    """直下の画像のみ（サブフォルダは別で走査）"""
-    try:
-        return [p for p in folder.iterdir() if p.is_file() and is_image(p, image_exts)]
-    except Exception:
-        return []
 
+def resume_apply(journal_path: str, excel_out: str, workers: int, verify: bool, sidecar: str,
+                 throttle: Optional[TransferThrottle] = None) -> None:
+    """ジャーナルから計画を復元し、未完了のアクションだけを適用する（再走査しない）。"""
+    state = ApplyJournal.load(journal_path)
+    if state is None or not state.plan:
+        print(f"[ERROR] 再開できるジャーナルがありません: {journal_path}")
+        sys.exit(1)
+    if state.finished and not state.failed:
+        print(f"[INFO] ジャーナルは完了済みです（{len(state.plan)} 件）: {journal_path}")
+        return
+    if state.failed:
+        print(f"[INFO] 前回失敗したアクション {len(state.failed)} 件をやり直します")
+    if not state.plan_complete:
+        print("[WARN] 走査の途中で中断したジャーナルです。記録済みの計画だけを再開します"
+              "（残りの差分は通常実行で再検出してください）")
+
+    journal = ApplyJournal(journal_path)
+    journal.reopen()
+    done = set(state.done)
+    for i in sorted(state.in_flight):
+        if is_action_complete(state.plan[i]):
+            journal.done(i)
+            done.add(i)
+        else:
+            print(f"[INFO] 中断時に実行中だったアクションを再実行します: {state.plan[i]['rel_path']}")
+    todo = [(r["i"], r) for r in state.plan if r["i"] not in done]
+    print(f"[INFO] 再開: 計画 {len(state.plan)} 件中 完了 {len(done)} 件 / 残り {len(todo)} 件")
 
-def to_rel(p: Path, root: Path) -> Path:
-    try:
-        return p.relative_to(root)
-    except Exception:
-        return p
+    copier = make_copier(workers, verify, state.meta.get("hash_algo", "md5"), throttle)
+    applied, errors = run_apply(todo, dry_run=False, journal=journal, copier=copier)
+    # 元のブックは読み直さず、再開分の結果は別ファイルに出す
+    resume_out = Path(excel_out).with_name(Path(excel_out).stem + "_resume.xlsx")
+    with ReportWriter(resume_out, sidecar=sidecar) as report:
+        write_apply_results(report, applied, errors)
+    print(f"[INFO] 再開分の結果: {resume_out}")
+    print(f"[INFO] 再開分の適用完了（applied={len(applied)}, errors={len(errors)}）")
 
 
 def main():
@@ -119,267 +419,521 @@ def main():
     if not REMOTE_ROOT.exists():
         print(f"[WARN] REMOTE_ROOT が見つかりません: {REMOTE_ROOT}（資格情報やパスを確認）")
 
-    t0 = datetime.now()
-
-    # --- フォルダ集合 ---
-    local_dirs = walk_dirs(LOCAL_ROOT)
-    remote_dirs = walk_dirs(REMOTE_ROOT) if REMOTE_ROOT.exists() else []
+    mtime_window_ns = int(args.mtime_window * 1e9)
+    journal_path = args.journal or str(Path(EXCEL_OUT).with_suffix(".journal.jsonl"))
 
-    local_rel_set = {to_rel(d, LOCAL_ROOT).as_posix() for d in local_dirs}
-    remote_rel_set = {to_rel(d, REMOTE_ROOT).as_posix() for d in remote_dirs}
-
-    all_rel_folders = sorted(local_rel_set | remote_rel_set)
-
-    folder_rows = []
-    file_rows = []
+    t0 = datetime.now()
 
-    # --- ループ（各相対フォルダ）---
-    for rel in all_rel_folders:
-        lf = (LOCAL_ROOT / rel)
-        rf = (REMOTE_ROOT / rel)
+    if args.resume:
+        resume_apply(journal_path, EXCEL_OUT, args.copy_workers, args.verify_copy, args.report_sidecar,
+                     make_throttle(args))
+        print(f"[DONE] 終了。処理時間: {datetime.now() - t0}")
+        return
 
-        l_exists = lf.exists() and lf.is_dir()
-        r_exists = rf.exists() and rf.is_dir()
+    if args.watch and (args.merkle or args.remote_manifest):
+        print("[ERROR] --watch は --merkle / --remote-manifest と併用できません（リモートをライブで監視するため）")
+        sys.exit(1)
 
-        if l_exists and r_exists:
-            status = "Match"
-        elif l_exists and not r_exists:
-            status = "LocalOnly"
-        else:
-            status = "RemoteOnly"
-
-        l_imgs = list_images(lf, IMAGE_EXTS) if l_exists else []
-        r_imgs = list_images(rf, IMAGE_EXTS) if r_exists else []
-
-        folder_rows.append({
-            "rel_folder": rel,
-            "local_path": str(lf),
-            "remote_path": str(rf),
-            "folder_status": status,
-            "local_img_count": len(l_imgs),
-            "remote_img_count": len(r_imgs),
-        })
-
-        # フォルダが一致する場合のみ、ファイル比較を行う
-        if status == "Match":
-            r_index: Dict[str, Path] = {p.name.lower(): p for p in r_imgs}
-
-            # ローカル基準：ローカルにある画像それぞれを比較
-            for li in l_imgs:
-                name_key = li.name.lower()
-                ri = r_index.get(name_key)
-
-                li_size = li.stat().st_size if li.exists() else None
-                li_mtime = datetime.fromtimestamp(li.stat().st_mtime) if li.exists() else None
-
-                if ri is None:
-                    # リモートに無い（ローカルのみ）
-                    file_rows.append({
-                        "rel_path": f"{rel}/{li.name}",
-                        "file_name": li.name,
-                        "folder_rel": rel,
-                        "local_path": str(li),
-                        "remote_path": "",
-                        "compare_result": "MissingOnRemote",
-                        "local_size": li_size,
-                        "remote_size": None,
-                        "local_mtime": li_mtime,
-                        "remote_mtime": None,
-                        "local_md5": md5sum(li),
-                        "remote_md5": "",
-                    })
-                else:
-                    ri_size = ri.stat().st_size if ri.exists() else None
-                    ri_mtime = datetime.fromtimestamp(ri.stat().st_mtime) if ri.exists() else None
-
-                    l_md5 = md5sum(li)
-                    r_md5 = md5sum(ri)
-                    cmp = "Same" if (l_md5 and r_md5 and l_md5 == r_md5) else "Different"
-
-                    file_rows.append({
-                        "rel_path": f"{rel}/{li.name}",
-                        "file_name": li.name,
-                        "folder_rel": rel,
-                        "local_path": str(li),
-                        "remote_path": str(ri),
-                        "compare_result": cmp,
-                        "local_size": li_size,
-                        "remote_size": ri_size,
-                        "local_mtime": li_mtime,
-                        "remote_mtime": ri_mtime,
-                        "local_md5": l_md5,
-                        "remote_md5": r_md5,
-                    })
-
-            # リモートにしかない画像（ローカルに無い）
-            local_name_set = {p.name.lower() for p in l_imgs}
-            for ri in r_imgs:
-                if ri.name.lower() not in local_name_set:
-                    file_rows.append({
-                        "rel_path": f"{rel}/{ri.name}",
-                        "file_name": ri.name,
-                        "folder_rel": rel,
-                        "local_path": str(lf / ri.name),
-                        "remote_path": str(ri),
-                        "compare_result": "MissingOnLocal",
-                        "local_size": None,
-                        "remote_size": ri.stat().st_size if ri.exists() else None,
-                        "local_mtime": None,
-                        "remote_mtime": datetime.fromtimestamp(ri.stat().st_mtime) if ri.exists() else None,
-                        "local_md5": "",
-                        "remote_md5": md5sum(ri),
-                    })
-
-        # フォルダが一致しない場合（LocalOnly/RemoteOnly）はファイル比較は行わず計数のみ
-        # → 実行計画では個々のファイル単位で扱うため、ここで個別列挙は不要
-
-
-    df_folders = pd.DataFrame(folder_rows)
-    df_files = pd.DataFrame(file_rows)
-
-    # --- 実行計画 ---
-    plan_rows = []
-
-    # 1) RemoteOnly フォルダ → 画像をローカルへコピー（オプション）
-    if args.copy_remote_only:
-        for row in folder_rows:
-            if row["folder_status"] == "RemoteOnly":
-                rf = Path(row["remote_path"])
-                lf = Path(row["local_path"])
-                for rp in list_images(rf, IMAGE_EXTS):
-                    plan_rows.append({
-                        "action": "COPY_REMOTE_TO_LOCAL",
-                        "reason": "RemoteOnly フォルダ取り込み",
-                        "local_path": str(lf / rp.name),
-                        "remote_path": str(rp),
-                        "rel_path": f'{row["rel_folder"]}/{rp.name}',
-                    })
-
-    # 2) Match 内：MissingOnLocal → コピー
-    for r in file_rows:
-        if r["compare_result"] == "MissingOnLocal":
-            plan_rows.append({
-                "action": "COPY_REMOTE_TO_LOCAL",
-                "reason": "ローカルに無いため取り込み",
-                "local_path": r["local_path"],
-                "remote_path": r["remote_path"],
-                "rel_path": r["rel_path"],
-            })
-
-    # 3) Match 内：Different → 上書き（オプション：既定ON）
-    if args.overwrite_different:
-        for r in file_rows:
-            if r["compare_result"] == "Different":
-                plan_rows.append({
+    metrics = Metrics("check_oper_remote")
+    for k in ("compare_mode", "hash_algo", "local_workers", "remote_workers", "copy_workers", "remote_manifest",
+              "merkle", "detect_moves", "crawl_inflight", "watch",
+              "max_mbps", "max_files_per_sec", "batch_small_kb"):
+        metrics.set(k, getattr(args, k))
+    metrics.rate("local_hash_bytes_per_sec", "local_bytes_hashed", "hash_local")
+    metrics.rate("remote_hash_bytes_per_sec", "remote_bytes_hashed", "hash_remote")
+    metrics.rate("copy_bytes_per_sec", "copy_bytes", "apply")
+    metrics.rate("copy_files_per_sec", "copy_files", "apply")
+
+    engine = HashEngine(args.hash_algo)
+    cache = open_cache(args.hash_cache, algo=engine.algo)
+    throttle = make_throttle(args) if args.apply else None
+    small_bytes = args.batch_small_kb * 1024
+
+    pool = HashPool(args.local_workers, args.remote_workers)
+
+    def hash_side(m: FileMeta, side: str) -> Tuple[str, int]:
+        with metrics.phase(f"hash_{side}"):  # ワーカー合計
+            digest, nread, hashed = content_hash(m, engine, cache, local=(side == "local"))
+        if hashed:
+            metrics.add(f"{side}_files_hashed")
+            metrics.add(f"{side}_bytes_hashed", nread)
+        elif not m.digest:
+            metrics.add(f"{side}_hash_cache_hits")
+        return digest, nread
+
+    def gated_hash(side: str, m: FileMeta) -> Tuple[str, int]:
+        with pool.gate(side):
+            return hash_side(m, side)
+
+    def compare_local_image(job: Tuple[str, FileMeta, Optional[FileMeta]]) -> dict:
+        rel, lm, rm = job
+
+        if rm is None:
+            # リモートに無い（ローカルのみ）
+            l_hash, nread = gated_hash("local", lm)
+            return {
+                "rel_path": f"{rel}/{lm.name}",
+                "file_name": lm.name,
+                "folder_rel": rel,
+                "local_path": lm.path,
+                "remote_path": "",
+                "compare_result": "MissingOnRemote",
+                "compare_tier": "",
+                "bytes_read": nread,
+                "local_size": lm.size,
+                "remote_size": None,
+                "local_mtime": lm.mtime,
+                "remote_mtime": None,
+                "local_hash": l_hash,
+                "remote_hash": "",
+                "hash_algo": engine.algo,
+            }
+
+        outcome = compare_pair(lm, rm, args.compare_mode,
+                               hash_side,
+                               mtime_window_ns, gate=pool.gate)
+        return {
+            "rel_path": f"{rel}/{lm.name}",
+            "file_name": lm.name,
+            "folder_rel": rel,
+            "local_path": lm.path,
+            "remote_path": rm.path,
+            "compare_result": outcome.result,
+            "compare_tier": outcome.tier,
+            "bytes_read": outcome.bytes_read,
+            "local_size": lm.size,
+            "remote_size": rm.size,
+            "local_mtime": lm.mtime,
+            "remote_mtime": rm.mtime,
+            "local_hash": outcome.local_hash,
+            "remote_hash": outcome.remote_hash,
+            "hash_algo": engine.algo,
+        }
+
+    def describe_missing_on_local(job: Tuple[str, Path, FileMeta]) -> dict:
+        rel, lf, rm = job
+        r_hash, nread = gated_hash("remote", rm)
+        return {
+            "rel_path": f"{rel}/{rm.name}",
+            "file_name": rm.name,
+            "folder_rel": rel,
+            "local_path": str(lf / rm.name),
+            "remote_path": rm.path,
+            "compare_result": "MissingOnLocal",
+            "compare_tier": "",
+            "bytes_read": nread,
+            "local_size": None,
+            "remote_size": rm.size,
+            "local_mtime": None,
+            "remote_mtime": rm.mtime,
+            "local_hash": "",
+            "remote_hash": r_hash,
+            "hash_algo": engine.algo,
+        }
+
+    # --- 走査 → 比較（ジェネレータ。フォルダ単位で流し、ファイル行は溜めない）---
+    # マニフェスト指定時のみリモートをスナップショットとして読み込む（ライブ走査はフォルダごとに scandir）
+    remote_manifest_snap = (remote_snapshot(REMOTE_ROOT, IMAGE_EXTS, args.remote_manifest, engine.algo)
+                            if args.remote_manifest else None)
+
+    # --merkle：両側のツリーを先に揃え、上から一致判定して一致したサブツリーには降りない
+    merkle: Optional[MerkleCompare] = None
+    local_snap: Optional[TreeSnapshot] = None
+    remote_snap = remote_manifest_snap
+    if args.merkle:
+        if cache is None:
+            print("[WARN] --merkle はハッシュキャッシュ無しだと毎回すべて読み込みます（--hash-cache を推奨）")
+        with metrics.phase("walk"):
+            local_snap = TreeSnapshot.build(LOCAL_ROOT, IMAGE_EXTS)
+            if remote_snap is None:
+                remote_snap = remote_snapshot(REMOTE_ROOT, IMAGE_EXTS, None, engine.algo)
+
+        def hash_files(side: str, images: List[FileMeta]) -> List[str]:
+            with metrics.phase("digest"):  # hash_{side} と重なる
+                return [d for d, _ in pool.map_ordered(lambda m: gated_hash(side, m), images)]
+
+        merkle = MerkleCompare(local_snap, remote_snap, FolderDigests(engine.algo, hash_files, cache))
+
+    def descend(pair) -> bool:
+        return not (pair.local and pair.remote and merkle.tree_equal(pair.rel))
+
+    folder_columns = FOLDER_COLUMNS + (["digest_match"] if merkle is not None else [])
+
+    crawl_stats: dict = {}
+
+    def full_walk() -> Iterator[FolderPair]:
+        # リモートをライブ走査する場合のみ先読み（スナップショット参照は I/O が無い）
+        return walk_pairs(LOCAL_ROOT, REMOTE_ROOT, IMAGE_EXTS, remote_snap,
+                          local_snap=local_snap, descend=descend if merkle is not None else None,
+                          prefetch=args.crawl_inflight if remote_snap is None else 0, stats=crawl_stats)
+
+    def compared_folders(pairs: Iterable[FolderPair]) -> Iterator[FolderResult]:
+        for rel, l_dir, r_dir in metrics.timed("walk", pairs):
+            lf = (LOCAL_ROOT / rel)
+            rf = (REMOTE_ROOT / rel)
+
+            if l_dir and r_dir:
+                status = "Match"
+            elif l_dir and not r_dir:
+                status = "LocalOnly"
+            else:
+                status = "RemoteOnly"
+
+            l_imgs = l_dir.images if l_dir else []
+            r_imgs = r_dir.images if r_dir else []
+            metrics.add("folders")
+            metrics.add("local_files_stat", len(l_imgs))
+            metrics.add("remote_files_manifest" if remote_manifest_snap else "remote_files_stat", len(r_imgs))
+
+            digest_match = ""
+            if merkle is not None and status == "Match":
+                with metrics.phase("digest"):
+                    if merkle.tree_equal(rel):
+                        digest_match = "tree"
+                        n_folders, n_files = merkle.subtree_size(rel)
+                        metrics.add("merkle_tree_skips")
+                        metrics.add("merkle_folders_skipped", n_folders + 1)
+                        metrics.add("merkle_files_skipped", n_files + len(l_imgs))
+                    elif merkle.folder_equal(rel):
+                        digest_match = "folder"
+                        metrics.add("merkle_folders_skipped")
+                        metrics.add("merkle_files_skipped", len(l_imgs))
+
+            folder_row = {
+                "rel_folder": rel,
+                "local_path": str(lf),
+                "remote_path": str(rf),
+                "folder_status": status,
+                "local_img_count": len(l_imgs),
+                "remote_img_count": len(r_imgs),
+            }
+            if merkle is not None:
+                folder_row["digest_match"] = digest_match
+
+            # フォルダが一致する場合のみ、ファイル比較を行う（ダイジェスト一致なら不要）
+            rows: List[dict] = []
+            if status == "Match" and not digest_match:
+                with metrics.phase("compare"):
+                    r_index: Dict[str, FileMeta] = r_dir.index()
+
+                    # ローカル基準：ローカルにある画像それぞれを比較（並列・結果は投入順）
+                    jobs = [(rel, lm, r_index.get(lm.name.lower())) for lm in l_imgs]
+                    rows.extend(pool.map_ordered(compare_local_image, jobs))
+
+                    # リモートにしかない画像（ローカルに無い）
+                    local_name_set = {m.name.lower() for m in l_imgs}
+                    jobs = [(rel, lf, rm) for rm in r_imgs if rm.name.lower() not in local_name_set]
+                    rows.extend(pool.map_ordered(describe_missing_on_local, jobs))
+
+            # フォルダが一致しない場合（LocalOnly/RemoteOnly）はファイル比較は行わず計数のみ
+            # → 実行計画では個々のファイル単位で扱う
+            yield FolderResult(folder_row, l_dir, r_dir, rows)
+
+    # --- 実行計画（フォルダ単位）---
+    def plan_folder(fr: FolderResult) -> Iterator[dict]:
+        rel = fr.folder_row["rel_folder"]
+        status = fr.folder_row["folder_status"]
+
+        # 1) RemoteOnly フォルダ → 画像をローカルへコピー（オプション）
+        if args.copy_remote_only and status == "RemoteOnly":
+            lf = Path(fr.folder_row["local_path"])
+            for rm in fr.remote.images:
+                yield {
+                    "action": "COPY_REMOTE_TO_LOCAL",
+                    "reason": "RemoteOnly フォルダ取り込み",
+                    "local_path": str(lf / rm.name),
+                    "remote_path": rm.path,
+                    "rel_path": f"{rel}/{rm.name}",
+                    "expected_hash": rm.digest,  # マニフェスト使用時のみ既知
+                    "size": rm.size,  # 小さいコピーのまとめ用（レポート・ジャーナルには出さない）
+                }
+
+        for r in fr.file_rows:
+            # 2) Match 内：MissingOnLocal → コピー
+            if r["compare_result"] == "MissingOnLocal":
+                yield {
+                    "action": "COPY_REMOTE_TO_LOCAL",
+                    "reason": "ローカルに無いため取り込み",
+                    "local_path": r["local_path"],
+                    "remote_path": r["remote_path"],
+                    "rel_path": r["rel_path"],
+                    "expected_hash": r["remote_hash"],
+                    "size": r["remote_size"],
+                }
+            # 3) Match 内：Different → 上書き（オプション：既定ON）
+            elif r["compare_result"] == "Different" and args.overwrite_different:
+                yield {
                     "action": "OVERWRITE_LOCAL_WITH_REMOTE",
                     "reason": "同名・内容差分のため上書き",
                     "local_path": r["local_path"],
                     "remote_path": r["remote_path"],
                     "rel_path": r["rel_path"],
-                })
-
-    # 4) Match 内：MissingOnRemote → ローカル削除（オプション）
-    if args.delete_missing_on_remote:
-        for r in file_rows:
-            if r["compare_result"] == "MissingOnRemote":
-                plan_rows.append({
+                    "expected_hash": r["remote_hash"],  # full 段階で決着した場合のみ
+                    "size": r["remote_size"],
+                }
+            # 4) Match 内：MissingOnRemote → ローカル削除（オプション）
+            elif r["compare_result"] == "MissingOnRemote" and args.delete_missing_on_remote:
+                yield {
                     "action": "DELETE_LOCAL_FILE",
                     "reason": "リモートに無い（--delete-missing-on-remote）",
                     "local_path": r["local_path"],
                     "remote_path": "",
                     "rel_path": r["rel_path"],
-                })
-
-    # 5) LocalOnly フォルダ → ローカル削除（オプション）
-    if args.delete_local_only:
-        for row in folder_rows:
-            if row["folder_status"] == "LocalOnly":
-                lf = Path(row["local_path"])
-                for lp in list_images(lf, IMAGE_EXTS):
-                    plan_rows.append({
-                        "action": "DELETE_LOCAL_FILE",
-                        "reason": "LocalOnly フォルダ（--delete-local-only）",
-                        "local_path": str(lp),
-                        "remote_path": "",
-                        "rel_path": f'{row["rel_folder"]}/{lp.name}',
-                    })
-
-    df_plan = pd.DataFrame(plan_rows)
-
-    # --- Excel 出力 ---
-    with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl") as xw:
-        if not df_folders.empty:
-            df_folders.sort_values(["folder_status", "rel_folder"]).to_excel(
-                xw, sheet_name="FolderSummary", index=False
-            )
-        if not df_files.empty:
-            df_files.sort_values("rel_path").to_excel(
-                xw, sheet_name="FileDiffs", index=False
-            )
-        if not df_plan.empty:
-            df_plan.sort_values("rel_path").to_excel(
-                xw, sheet_name="PlannedActions", index=False
-            )
-
-    print(f"[INFO] Excel 出力完了: {EXCEL_OUT}")
-
-    # --- 実行 ---
+                    "expected_hash": "",
+                }
+
+        # 5) LocalOnly フォルダ → ローカル削除（オプション）
+        if args.delete_local_only and status == "LocalOnly":
+            for lm in fr.local.images:
+                yield {
+                    "action": "DELETE_LOCAL_FILE",
+                    "reason": "LocalOnly フォルダ（--delete-local-only）",
+                    "local_path": lm.path,
+                    "remote_path": "",
+                    "rel_path": f"{rel}/{lm.name}",
+                    "expected_hash": "",
+                }
+
+    # --- レポート（行単位で書き出し。FolderSummary はフォルダ数分だけ保持して最後に並べ替え）---
+    report = ReportWriter(EXCEL_OUT, sidecar=args.report_sidecar)
+    s_folders = report.sheet("FolderSummary", folder_columns)
+    s_files = report.sheet("FileDiffs", FILE_COLUMNS, skip_empty=True)   # 従来どおり行が無ければ出さない
+    s_plan = report.sheet("PlannedActions", PLAN_COLUMNS, skip_empty=True)
+    folder_rows: List[dict] = []
+    tiers: Counter = Counter()
+    total_read = 0
+    journal: Optional[ApplyJournal] = None
+
+    # --- 移動・改名の検出（--detect-moves。コピー・削除計画は走査後にまとめて出す）---
+    detector: Optional[MoveDetector] = None
+
+    def known_remote_hash(rm: FileMeta, src_rel: str) -> str:
+        """
+        読まずに分かるリモートのハッシュ：マニフェスト → 現パス/旧パスのキャッシュ（stat 一致時のみ）。
+        旧パスは現パスと違うときだけ引き、同じファイルの引き直しなのでミスには数えない
+        """
+        if rm.digest or cache is None:
+            return rm.digest
+        digest = cache.lookup(rm.path, rm.size, rm.mtime_ns, rm.inode)
+        old_path = os.path.join(str(REMOTE_ROOT), *[x for x in src_rel.split("/") if x != "."])
+        if not digest and os.path.normcase(old_path) != os.path.normcase(rm.path):
+            digest = cache.lookup(old_path, rm.size, rm.mtime_ns, rm.inode, count=False)
+            # 新しいパスでも記録（次回以降の改名・比較で読まずに済む）
+            cache.store(rm.path, rm.size, rm.mtime_ns, rm.inode, digest or "")
+        return digest or ""
+
+    def hold_candidates(fr: FolderResult, plans: Iterable[dict]) -> Iterator[dict]:
+        """コピー計画（取り込み先）と削除計画・ローカルだけの画像（取り込み元）を預け、残りを流す"""
+        detector.note_folder(fr.folder_row)
+        r_by_path = {m.path: m for m in fr.remote.images} if fr.remote else {}
+        deletes: Dict[str, dict] = {}
+        for p in plans:
+            if p["action"] == "COPY_REMOTE_TO_LOCAL":
+                detector.add_target(r_by_path[p["remote_path"]], p)
+            elif p["action"] == "DELETE_LOCAL_FILE":
+                deletes[p["local_path"]] = p
+            else:
+                yield p
+        rel = fr.folder_row["rel_folder"]
+        if fr.folder_row["folder_status"] == "LocalOnly":
+            for lm in fr.local.images:
+                detector.add_source(lm, f"{rel}/{lm.name}", deletes.get(lm.path))
+        else:
+            missing = {r["local_path"]: r["local_hash"] for r in fr.file_rows
+                       if r["compare_result"] == "MissingOnRemote"}
+            for lm in (fr.local.images if missing else []):
+                if lm.path in missing:
+                    detector.add_source(lm, f"{rel}/{lm.name}", deletes.get(lm.path), missing[lm.path])
+
+    def planned(pairs: Iterable[FolderPair], s_files, s_plan, folder_rows: List[dict]) -> Iterator[Tuple[int, dict]]:
+        """比較結果をレポートに流しつつ、計画を (通し番号, 行) で1件ずつ返す。"""
+        nonlocal total_read, detector
+        i = 0
+        # 移動検出は計画の単位（通常は1回、--watch ではサイクルごと）で作り直す
+        detector = MoveDetector(lambda m: gated_hash("local", m)[0], known_remote_hash) if args.detect_moves else None
+
+        def emit(plans: Iterable[dict]) -> Iterator[Tuple[int, dict]]:
+            nonlocal i
+            for p in plans:
+                with metrics.phase("report"):
+                    s_plan.write(p)
+                if journal is not None:
+                    journal.plan(i, p)
+                yield i, p
+                i += 1
+
+        for fr in compared_folders(pairs):
+            folder_rows.append(fr.folder_row)
+            with metrics.phase("report"):
+                for r in fr.file_rows:
+                    s_files.write(r)
+                    if r["compare_tier"]:
+                        tiers[r["compare_tier"]] += 1
+                    total_read += r["bytes_read"]
+            plans = plan_folder(fr)
+            yield from emit(hold_candidates(fr, plans) if detector is not None else plans)
+        if detector is not None:
+            with metrics.phase("detect_moves"):
+                resolved = list(detector.resolve())
+            yield from emit(resolved)
+        if journal is not None:
+            journal.plan_end()
+
+    # --- 実行（--apply 時は走査と並行して先頭の計画から適用を始める）---
     if not args.apply:
+        for _ in planned(full_walk(), s_files, s_plan, folder_rows):
+            pass
         print("[INFO] DRYモード（--apply未指定）。実ファイル操作は行いません。")
     else:
-        applied = []
-        errors = []
-
-        def ensure_parent(path_str: str):
-            p = Path(path_str)
-            p.parent.mkdir(parents=True, exist_ok=True)
-
-        for _, r in df_plan.iterrows():
-            act = r["action"]
-            lp = Path(r["local_path"]) if r["local_path"] else None
-            rp = Path(r["remote_path"]) if r["remote_path"] else None
+        journal = None if args.dry_run else ApplyJournal(journal_path)
+        if journal is not None:
+            journal.open(meta={"hash_algo": engine.algo})
+        copier = make_copier(args.copy_workers, args.verify_copy, engine.algo, throttle)
+        with metrics.phase("apply"):  # 走査と重なる
+            applied, errors = run_apply(bounded(planned(full_walk(), s_files, s_plan, folder_rows), args.queue_size),
+                                        args.dry_run, journal, copier, small_bytes, args.batch_max_files)
+        metrics.add("copy_files", copier.stats.files)
+        metrics.add("copy_bytes", copier.stats.bytes)
+        metrics.add("apply_ok", len(applied))
+        metrics.add("apply_errors", len(errors))
+        write_apply_results(report, applied, errors)
+        print(f"[INFO] 実行完了（apply={args.apply}, dry-run={args.dry_run}）")
 
-            try:
-                if act in ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE"):
-                    if not rp or not rp.exists():
-                        raise FileNotFoundError(f"remote not found: {rp}")
-                    ensure_parent(str(lp))
-                    if args.dry_run:
-                        print(f"[DRY] {act}  {rp} -> {lp}")
-                    else:
-                        shutil.copy2(rp, lp)
-                    applied.append((act, str(rp), str(lp)))
-                elif act == "DELETE_LOCAL_FILE":
-                    if not lp:
-                        continue
-                    if args.dry_run:
-                        print(f"[DRY] DELETE_LOCAL  {lp}")
-                    else:
-                        if lp.exists():
-                            lp.unlink()
-                    applied.append((act, "", str(lp)))
-                else:
-                    # 想定外のアクションはスキップ
+    if s_files.rows:
+        print(f"[INFO] 比較（{args.compare_mode}）: " + " ".join(f"{k}={v}" for k, v in tiers.most_common())
+              + f"  読み込み {total_read / 1024 / 1024:.1f} MiB")
+    if merkle is not None:
+        c = metrics.counters
+        print(f"[INFO] Merkle: 一致サブツリー {int(c.get('merkle_tree_skips', 0))} 件 / "
+              f"スキップ {int(c.get('merkle_folders_skipped', 0))} folders, "
+              f"{int(c.get('merkle_files_skipped', 0))} files "
+              f"（ダイジェスト再利用 {merkle.digests.reused} / 計算 {merkle.digests.computed}）")
+    if detector is not None:
+        print(f"[INFO] 移動検出: フォルダ改名 {detector.folder_renames} 件 / 移動 {detector.moves} 件 / "
+              f"ローカルコピー {detector.local_copies} 件（転送回避 {detector.bytes_saved / 1024 / 1024:.1f} MiB）")
+        metrics.add("folder_renames", detector.folder_renames)
+        metrics.add("moves_detected", detector.moves)
+        metrics.add("local_copies", detector.local_copies)
+        metrics.add("move_bytes_saved", detector.bytes_saved)
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        metrics.add("cache_hits", cache.hits)
+        metrics.add("cache_misses", cache.misses)
+        if merkle is not None:
+            metrics.add("folder_cache_hits", cache.folder_hits)
+            metrics.add("folder_cache_misses", cache.folder_misses)
+    for k, v in crawl_stats.items():
+        metrics.add(k, v)
+    if throttle is not None:
+        metrics.add("throttle_wait_sec", round(throttle.waited, 3))
+    metrics.add("file_rows", s_files.rows)
+    metrics.add("planned_actions", s_plan.rows)
+    metrics.add("compare_bytes_read", total_read)
+    for k, v in tiers.items():
+        metrics.add(f"tier_{k}", v)
+
+    with metrics.phase("report"):
+        s_folders.write_many(sorted(folder_rows, key=lambda r: (r["folder_status"], r["rel_folder"])))
+        if args.metrics_sheet:
+            report.write_sheet("Metrics", ["kind", "name", "value"], metrics.rows())  # 保存時間は含まない
+        report.close()
+    print(f"[INFO] Excel 出力完了: {EXCEL_OUT}（計画 {s_plan.rows} 件）")
+    for p in report.sidecar_paths:
+        print(f"[INFO] サイドカー出力: {p}")
+
+    metrics_out = args.metrics_out or str(Path(EXCEL_OUT).with_suffix(".metrics.json"))
+    metrics.write_json(metrics_out)
+    print(f"[INFO] 計測: {metrics.summary()} → {metrics_out}")
+
+    # --- 常駐（--watch）：変更のあったフォルダだけを比較・計画・適用し続ける ---
+    def watch_loop() -> None:
+        nonlocal journal
+        rolling = RollingCsvReport(EXCEL_OUT, keep_days=args.watch_keep_days)
+        r_files = rolling.sheet("FileDiffs", FILE_COLUMNS)
+        r_plan = rolling.sheet("PlannedActions", PLAN_COLUMNS)
+        known = {r["rel_folder"] for r in folder_rows}
+        local_w = local_watcher(LOCAL_ROOT, [r["rel_folder"] for r in folder_rows
+                                             if r["folder_status"] != "RemoteOnly"], IMAGE_EXTS)
+        remote_w = RemoteDirPoller(REMOTE_ROOT, [r["rel_folder"] for r in folder_rows
+                                                 if r["folder_status"] != "LocalOnly"], args.crawl_inflight)
+        copier = make_copier(args.copy_workers, args.verify_copy, engine.algo, throttle) if args.apply else None
+        full_every = args.full_rescan_minutes * 60
+        last_full = time.monotonic()
+        cycle = 0
+        print(f"[INFO] 監視開始: ローカル {type(local_w).__name__} / リモート {len(remote_w)} folders を "
+              f"{args.watch_interval:g} 秒ごとに確認（Ctrl+C で終了）")
+        try:
+            while True:
+                dirty = local_w.changes(args.watch_interval)
+                with metrics.phase("watch_poll"):
+                    dirty |= remote_w.changes()
+                full = FULL_RESCAN in dirty or (full_every > 0 and time.monotonic() - last_full >= full_every)
+                if not dirty and not full:
                     continue
-            except Exception as e:
-                errors.append((act, str(lp) if lp else "", str(rp) if rp else "", repr(e)))
-
-        # 結果の追記
-        with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl", mode="a", if_sheet_exists="replace") as xw:
-            if applied:
-                pd.DataFrame(applied, columns=["action", "src_remote", "dst_local"]).to_excel(
-                    xw, sheet_name="Applied", index=False
-                )
-            else:
-                pd.DataFrame({"info": ["No actions executed (nothing to do or DRY)"]}).to_excel(
-                    xw, sheet_name="Applied", index=False
-                )
-            if errors:
-                pd.DataFrame(errors, columns=["action", "local_path", "remote_path", "error"]).to_excel(
-                    xw, sheet_name="Errors", index=False
-                )
-
-        print(f"[INFO] 実行完了（apply={args.apply}, dry-run={args.dry_run}）")
+                cycle += 1
+                rolling.begin(cycle)
+                if full:
+                    last_full = time.monotonic()
+                    pairs = full_walk()
+                else:
+                    pairs = dirty_pairs(LOCAL_ROOT, REMOTE_ROOT, IMAGE_EXTS, dirty, known)
+                rows: List[dict] = []
+                n_files, n_plan = r_files.rows, r_plan.rows
+                plans = planned(pairs, r_files, r_plan, rows)
+                applied, errors = [], []
+                if copier is None:
+                    for _ in plans:
+                        pass
+                else:
+                    journal = None if args.dry_run else ApplyJournal(journal_path)  # 直近サイクル分（--resume 用）
+                    if journal is not None:
+                        journal.open(meta={"hash_algo": engine.algo})
+                    with metrics.phase("apply"):
+                        applied, errors = run_apply(bounded(plans, args.queue_size), args.dry_run, journal, copier,
+                                                    small_bytes, args.batch_max_files)
+                    metrics.add("apply_ok", len(applied))
+                    metrics.add("apply_errors", len(errors))
+                    if applied:
+                        rolling.write_sheet("Applied", ["action", "src_remote", "dst_local", "verified"], applied)
+                    if errors:
+                        rolling.write_sheet("Errors", ["action", "local_path", "remote_path", "error"], errors)
+                rolling.sheet("FolderSummary", folder_columns).write_many(
+                    sorted(rows, key=lambda r: (r["folder_status"], r["rel_folder"])))
+                rolling.end()
+                metrics.add("watch_cycles")
+                metrics.add("watch_full_rescans" if full else "watch_dirty_folders", 1 if full else len(dirty))
+
+                # 既知フォルダと監視対象を更新（両側とも無くなったフォルダは配下ごと外す）
+                seen = {r["rel_folder"] for r in rows}
+                gone = (known - seen) if full else (dirty - seen)
+                for rel in gone:
+                    prefix = rel + "/"
+                    known = {k for k in known if k != rel and not k.startswith(prefix)}
+                    remote_w.forget(rel)
+                known |= seen
+                remote_w.update([r["rel_folder"] for r in rows
+                                 if r["folder_status"] != "LocalOnly" and r["rel_folder"] not in remote_w])
+
+                scope = "全体" if full else f"変更 {len(dirty - {FULL_RESCAN})} folders"
+                print(f"[INFO] cycle {cycle}（{scope}）: 比較 {len(rows)} folders / {r_files.rows - n_files} files"
+                      f" / 計画 {r_plan.rows - n_plan} 件"
+                      + (f" / 適用 {len(applied)} 件・エラー {len(errors)} 件" if copier is not None else ""))
+        except KeyboardInterrupt:
+            print("[INFO] 監視を終了します（適用中だった分は --resume で再開できます）")
+        finally:
+            local_w.close()
+            remote_w.close()
+            rolling.close()
+            for p in rolling.paths():
+                print(f"[INFO] 監視レポート: {p}")
+
+    if args.watch:
+        watch_loop()
+        metrics.write_json(metrics_out)
+
+    pool.close()
+    if cache is not None:
+        cache.close()
 
     print(f"[DONE] 終了。処理時間: {datetime.now() - t0}")
 
@@ -388,24 +942,24 @@ if __name__ == "__main__":
     main()
 
 
-:: まずは差分を確認（DRY-RUN：計画だけ。実ファイル操作なし）
-python compare_sync_images.py ^
-  --local "D:\local folder" ^
-  --remote "\\SERVER\Share\remote folder" ^
-  --excel-out "compare_result.xlsx" ^
-  --dry-run
-
-:: 差分を実行（既定動作：リモート→ローカルへコピー/上書き。削除はデフォルト無効）
-python compare_sync_images.py ^
-  --local "D:\local folder" ^
-  --remote "\\SERVER\Share\remote folder" ^
-  --excel-out "compare_result.xlsx" ^
-  --apply
-
-:: ローカルにしか無いフォルダ/画像も削除してミラーしたい場合（慎重に）
-python compare_sync_images.py ^
-  --local "D:\local folder" ^
-  --remote "\\SERVER\Share\remote folder" ^
-  --excel-out "compare_result.xlsx" ^
-  --apply --delete-local-only --delete-missing-on-remote
-
+# 使用例
+# :: まずは差分を確認（DRY-RUN：計画だけ。実ファイル操作なし）
+# python compare_sync_images.py ^
+#   --local "D:\local folder" ^
+#   --remote "\\SERVER\Share\remote folder" ^
+#   --excel-out "compare_result.xlsx" ^
+#   --dry-run
+#
+# :: 差分を実行（既定動作：リモート→ローカルへコピー/上書き。削除はデフォルト無効）
+# python compare_sync_images.py ^
+#   --local "D:\local folder" ^
+#   --remote "\\SERVER\Share\remote folder" ^
+#   --excel-out "compare_result.xlsx" ^
+#   --apply
+#
+# :: ローカルにしか無いフォルダ/画像も削除してミラーしたい場合（慎重に）
+# python compare_sync_images.py ^
+#   --local "D:\local folder" ^
+#   --remote "\\SERVER\Share\remote folder" ^
+#   --excel-out "compare_result.xlsx" ^
+#   --apply --delete-local-only --delete-missing-on-remote
@@ -2,119 +2,240 @@
 """
 フォルダ比較＆差分反映ツール（Windows 共有/UNC 対応）
 - ローカル構成を基準（相対パスで対応付け）
-- 画像の存在/同名/内容（MD5）比較
-- 差分をExcel出力
+- 画像の存在/同名/内容（ハッシュ：既定 MD5）比較
+- 差分をExcel出力（DataFrame を作らず行単位で書き出す。上限超過のシートは自動分割、CSV/Parquet サイドカー可）
+  ※比較結果（ファイル行・計画・指紋）は問題判定と計画ファイルのために全件メモリに持つので、
+    メモリはツリーの大きさに比例する。巨大なツリーはフォルダ単位で流す check_oper_remote.py を使うこと
 - 反映（コピー/上書き/任意で削除）
 - 1回目チェックのみ → 問題なければ自動適用（--apply-if-clean）
+- 比較結果の計画を <excel-out>.plan.jsonl.gz に保存（触るファイルの size/mtime/ハッシュ付き）。
+  後から --apply-plan で、全体を走査・ハッシュし直さずに計画のファイルだけ確かめて適用できる
+  （計画時から変わったファイルのアクションは適用せず Stale シートに出す）。
+  問題ありと判定された計画は、--apply の実行で作られたものか --apply-unclean 指定時だけ適用する
 
 要件:
-    pip install pandas openpyxl
+    pip install openpyxl（Parquet サイドカーは pyarrow も）
 """
 
-import os
 import sys
 import argparse
-import hashlib
 import shutil
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Tuple
-import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+from hash_cache import HashCache, open_cache
+from hash_engine import ALGORITHMS, HashEngine
+from hash_pool import HashPool
+from plan_file import fingerprint, load_plan, revalidate_all, write_plan
+from report_writer import SIDECAR_FORMATS, ReportWriter
+from sync_manifest import remote_snapshot
+from tree_snapshot import FileMeta, TreeSnapshot, join_rel
 
 
 def parse_args():
     p = argparse.ArgumentParser(description="Local/Remote 画像フォルダ比較＆差分反映ツール")
-    p.add_argument("--local", required=True, help="ローカルの基準ルート")
-    p.add_argument("--remote", required=True, help="リモートの基準ルート（UNC可）")
+    p.add_argument("--local", help="ローカルの基準ルート（--apply-plan 以外は必須）")
+    p.add_argument("--remote", help="リモートの基準ルート（UNC可。--apply-plan 以外は必須）")
     p.add_argument("--excel-out", default="compare_result.xlsx", help="Excel出力先ファイル")
     p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
                    help="対象拡張子（小文字・カンマ区切り）例: .jpg,.png")
+    p.add_argument("--report-sidecar", choices=SIDECAR_FORMATS, default="none",
+                   help="各シートを CSV/Parquet にも出力（<excel-out名>.<シート名>.csv 等）")
+    p.add_argument("--remote-manifest", default=None,
+                   help="sync_manifest.py で作成したリモートのマニフェスト。指定時はリモートを走査しない")
     # 反映系
     g = p.add_mutually_exclusive_group()
     g.add_argument("--apply", action="store_true", help="比較後に差分を適用する")
     g.add_argument("--first-pass-only", action="store_true", help="比較のみ（Excel出力まで）")
     g.add_argument("--apply-if-clean", action="store_true",
                    help="比較 → 問題が無ければ自動適用（問題があれば適用しない）")
+    g.add_argument("--apply-plan", default=None, metavar="PLAN",
+                   help="保存済みの計画ファイルを適用する（再走査しない。計画のファイルだけ stat で再検証）")
+    p.add_argument("--apply-unclean", action="store_true",
+                   help="--apply-plan で、計画時に問題ありと判定された計画も適用する（再検証はすべて行う）")
+    p.add_argument("--plan-out", default=None,
+                   help="計画ファイルの保存先（既定：<excel-out>.plan.jsonl.gz）")
+    p.add_argument("--no-plan-out", dest="plan_out", action="store_const", const="",
+                   help="計画ファイルを保存しない")
 
     p.add_argument("--delete-local-extra", action="store_true",
                    help="ローカルにしか無い画像を削除（危険！既定は削除しない）")
     p.add_argument("--dry-run", action="store_true",
                    help="適用内容を表示のみ（コピー/削除は実行しない）")
-    return p.parse_args()
-
-
-def is_image(p: Path, image_exts: set) -> bool:
-    return p.suffix.lower() in image_exts
-
-
-def md5sum(path: Path, chunk_size: int = 1024 * 1024) -> str:
-    h = hashlib.md5()
-    try:
-        with path.open("rb") as f:
-            for chunk in iter(lambda: f.read(chunk_size), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    except Exception:
-        return ""  # 読めないなどの問題
-
-
-def collect_local_tree(local_root: Path) -> List[Path]:
-    folders = []
-    for dirpath, _, _ in os.walk(local_root):
-        folders.append(Path(dirpath))
-    return folders
-
-
-def comparable_images_in(folder: Path, image_exts: set) -> List[Path]:
-    try:
-        return [p for p in folder.iterdir() if p.is_file() and is_image(p, image_exts)]
-    except Exception:
-        return []
-
-
-def to_rel(p: Path, root: Path) -> Path:
-    try:
-        return p.relative_to(root)
-    except Exception:
-        return p
-
 
-def is_clean_plan(df_folders: pd.DataFrame,
-                  df_files: pd.DataFrame,
-                  df_plan: pd.DataFrame,
+    # ハッシュキャッシュ（未変更ファイルは内容を読まない）
+    p.add_argument("--hash-cache", default="hash_cache.sqlite",
+                   help="ハッシュキャッシュ（SQLite）の保存先。size/mtime/inode 一致時は再計算しない")
+    p.add_argument("--no-hash-cache", dest="hash_cache", action="store_const", const=None,
+                   help="ハッシュキャッシュを使わない（毎回すべて読み込む）")
+    p.add_argument("--hash-algo", choices=sorted(ALGORITHMS), default="md5",
+                   help="内容比較のハッシュ（blake2b 等は md5 より高速。Files の hash_algo 列に記録）")
+
+    # 並列度（読み込みの同時実行数を側ごとに制限）
+    p.add_argument("--local-workers", type=int, default=4,
+                   help="ローカル側の同時読み込み数（SSD を飽和させない程度に）")
+    p.add_argument("--remote-workers", type=int, default=8,
+                   help="リモート側の同時読み込み数（NAS/SMB の遅延を隠すため多め）")
+    args = p.parse_args()
+    if not args.apply_plan and not (args.local and args.remote):
+        p.error("--local と --remote を指定してください（--apply-plan 時のみ省略可）")
+    if args.apply_unclean and not args.apply_plan:
+        p.error("--apply-unclean は --apply-plan と一緒に指定してください")
+    return args
+
+
+def content_hash(meta: FileMeta, engine: HashEngine, cache: Optional[HashCache] = None,
+                 local: bool = False) -> str:
+    if meta.digest:
+        return meta.digest  # マニフェスト等で既知
+    if cache is not None:
+        # スナップショットの stat 情報で照合（stat を再発行しない）
+        return cache.get_or_compute_stat(meta.path, meta.size, meta.mtime_ns, meta.inode,
+                                         lambda p: engine.hexdigest(p, allow_mmap=local))
+    return engine.hexdigest(meta.path, allow_mmap=local)
+
+
+def is_clean_plan(folder_rows: List[dict],
+                  file_rows: List[dict],
+                  plan_rows: List[dict],
                   delete_local_extra: bool) -> Tuple[bool, List[str]]:
     """
     "問題なし" の判定。
     - RemoteMissing フォルダがある → 問題
-    - MD5 が空（読み出し不可）なファイルがある → 問題
+    - ハッシュが空（読み出し不可）なファイルがある → 問題
     - delete_local_extra 指定時、DELETE_LOCAL アクションが含まれる → 追加確認が必要とみなし問題
     """
     reasons = []
 
     # 1) リモートに対応フォルダが無い
-    if not df_folders.empty:
-        missing = df_folders[df_folders["folder_status"] == "RemoteMissing"]
-        if not missing.empty:
-            reasons.append(f"リモートに無いフォルダが {len(missing)} 件あります")
+    missing = sum(1 for r in folder_rows if r["folder_status"] == "RemoteMissing")
+    if missing:
+        reasons.append(f"リモートに無いフォルダが {missing} 件あります")
 
     # 2) ハッシュ計算不可
-    if not df_files.empty:
-        unreadable = df_files[(df_files["local_exists"] & (df_files["local_md5"] == "")) |
-                              (df_files["remote_exists"] & (df_files["remote_md5"] == ""))]
-        if not unreadable.empty:
-            reasons.append(f"ハッシュが空（読み出し失敗）のファイルが {len(unreadable)} 件あります")
+    unreadable = sum(1 for r in file_rows
+                     if (r["local_exists"] and r["local_hash"] == "") or
+                        (r["remote_exists"] and r["remote_hash"] == ""))
+    if unreadable:
+        reasons.append(f"ハッシュが空（読み出し失敗）のファイルが {unreadable} 件あります")
 
     # 3) 削除アクション（安全側に抑止）
     if delete_local_extra:
-        if not df_plan.empty and (df_plan["action"] == "DELETE_LOCAL").any():
+        if any(r["action"] == "DELETE_LOCAL" for r in plan_rows):
             reasons.append("ローカル削除アクションが含まれています（--delete-local-extra 指定）")
 
     return (len(reasons) == 0, reasons)
 
 
+def ensure_parent(path_str: str):
+    p = Path(path_str)
+    p.parent.mkdir(parents=True, exist_ok=True)
+
+
+def apply_rows(plan_rows: List[dict], dry_run: bool) -> Tuple[list, list]:
+    """計画を順に適用し、(Applied 行, Errors 行) を返す。"""
+    applied = []
+    errors = []
+    for r in plan_rows:
+        act = r["action"]
+        if act == "NONE":
+            continue
+
+        lp = Path(r["local_path"]) if r["local_path"] else None
+        rp = Path(r["remote_path"]) if r["remote_path"] else None
+
+        try:
+            if act in ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE"):
+                if not rp or not rp.exists():
+                    raise FileNotFoundError(f"remote not found: {rp}")
+                ensure_parent(str(lp))
+                if dry_run:
+                    print(f"[DRY] {act}  {rp} -> {lp}")
+                else:
+                    shutil.copy2(rp, lp)
+                applied.append((act, str(rp), str(lp)))
+            elif act == "DELETE_LOCAL":
+                if lp and lp.exists():
+                    if dry_run:
+                        print(f"[DRY] DELETE  {lp}")
+                    else:
+                        lp.unlink()
+                    applied.append((act, "", str(lp)))
+            else:
+                continue
+        except Exception as e:
+            errors.append((act, str(lp) if lp else "", str(rp) if rp else "", repr(e)))
+    return applied, errors
+
+
+def write_apply_results(report: ReportWriter, applied: list, errors: list) -> None:
+    # 結果追記（同じライターに書き足す。ブックの読み直しなし）
+    if applied:
+        report.write_sheet("Applied", ["action", "src_remote", "dst_local"], applied)
+    else:
+        report.write_sheet("Applied", ["info"], [["No actions executed (nothing to apply or DRY_RUN)"]])
+    if errors:
+        report.write_sheet("Errors", ["action", "local_path", "remote_path", "error"], errors)
+
+
+def apply_saved_plan(args) -> None:
+    """
+    --apply-plan：保存済みの計画を、触るファイルだけ再検証して適用する（全体の走査・ハッシュなし）。
+    計画時に問題ありと判定された計画は、--apply で作られた計画か --apply-unclean 指定時だけ適用する
+    （--apply と同じく問題は無視するが、計画のファイルの再検証は同じように全件行う）。
+    結果は <excel-out>_apply.xlsx に出す。
+    """
+    try:
+        header, actions = load_plan(args.apply_plan)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] 計画ファイルを読めません: {e}")
+        sys.exit(1)
+    print(f"[INFO] 計画ファイル: {args.apply_plan}（{header['created']} 作成, {len(actions)} 件, "
+          f"local={header['local_root']}, remote={header['remote_root']}）")
+    for opt, key in (("local", "local_root"), ("remote", "remote_root")):
+        given = getattr(args, opt)
+        if given and Path(given) != Path(header[key]):
+            print(f"[ERROR] --{opt}（{given}）が計画時（{header[key]}）と異なります")
+            sys.exit(1)
+    if not header["clean"]:
+        problems = "\n  - " + "\n  - ".join(header["reasons"])
+        mode = header.get("mode", "check")
+        if not (args.apply_unclean or mode == "apply"):
+            print(f"[INFO] 適用可否: False  (計画時に問題が検出されています。再比較するか、"
+                  f"承知の上で適用するなら --apply-unclean を指定してください){problems}")
+            return
+        why = "--apply-unclean 指定" if args.apply_unclean else "--apply で作られた計画"
+        print(f"[WARN] 計画時に問題が検出されていますが、{why}のため適用します{problems}")
+
+    engine = HashEngine(header["hash_algo"])
+    stale = revalidate_all(actions, lambda p: engine.hexdigest(p), args.remote_workers)
+    todo = [a for a, why in zip(actions, stale) if not why]
+    stale_rows = [(a["action"], a["rel_path"], a["local_path"], a["remote_path"], why)
+                  for a, why in zip(actions, stale) if why]
+    print(f"[INFO] 再検証: {len(actions)} 件中 適用 {len(todo)} 件 / 計画時から変化 {len(stale_rows)} 件")
+
+    applied, errors = apply_rows(todo, args.dry_run)
+    out = Path(args.excel_out).with_name(Path(args.excel_out).stem + "_apply.xlsx")
+    with ReportWriter(out, sidecar=args.report_sidecar) as report:
+        write_apply_results(report, applied, errors)
+        if stale_rows:
+            report.write_sheet("Stale", ["action", "rel_path", "local_path", "remote_path", "reason"], stale_rows)
+    print(f"[INFO] 適用完了（dry-run={args.dry_run}, applied={len(applied)}, errors={len(errors)}）")
+    if stale_rows:
+        print(f"[WARN] 計画時から変わったファイルの {len(stale_rows)} 件は適用していません（Stale シート参照）")
+    print(f"[INFO] Excel 出力: {out}")
+
+
 def main():
     args = parse_args()
 
+    if args.apply_plan:
+        start_ts = datetime.now()
+        apply_saved_plan(args)
+        print(f"[DONE] 終了。処理時間: {datetime.now() - start_ts}")
+        return
+
     LOCAL_ROOT = Path(args.local)
     REMOTE_ROOT = Path(args.remote)
     EXCEL_OUT = args.excel_out
@@ -125,101 +246,115 @@ def main():
         sys.exit(1)
 
     start_ts = datetime.now()
+    engine = HashEngine(args.hash_algo)
+    cache = open_cache(args.hash_cache, algo=engine.algo)
+
+    pool = HashPool(args.local_workers, args.remote_workers)
+
+    def gated_hash(side: str, m: FileMeta) -> str:
+        with pool.gate(side):
+            return content_hash(m, engine, cache, local=(side == "local"))
+
+    def compare_local_image(job: Tuple[str, FileMeta, Optional[FileMeta]]) -> dict:
+        rel, lm, rm = job
 
-    # 収集
+        local_exists = True
+        remote_exists_file = rm is not None
+
+        if not remote_exists_file:
+            cmp = "MissingOnRemote"
+            same = False
+            li_hash = gated_hash("local", lm)
+            ri_hash = ""
+        else:
+            li_hash = gated_hash("local", lm)
+            ri_hash = gated_hash("remote", rm)
+            same = (li_hash != "" and li_hash == ri_hash)
+            cmp = "Same" if same else "Different"
+
+        return {
+            "rel_path": join_rel(rel, lm.name),
+            "file_name": lm.name,
+            "folder_rel": rel,
+            "local_path": lm.path,
+            "remote_path": rm.path if rm is not None else "",
+            "local_exists": local_exists,
+            "remote_exists": remote_exists_file,
+            "compare_result": cmp,
+            "same_content": same,
+            "local_size": lm.size,
+            "remote_size": rm.size if rm is not None else None,
+            "local_mtime": lm.mtime,
+            "remote_mtime": rm.mtime if rm is not None else None,
+            "local_hash": li_hash,
+            "remote_hash": ri_hash,
+            "hash_algo": engine.algo,
+        }
+
+    def describe_missing_on_local(job: Tuple[str, Path, FileMeta]) -> dict:
+        rel, lf, rm = job
+        return {
+            "rel_path": join_rel(rel, rm.name),
+            "file_name": rm.name,
+            "folder_rel": rel,
+            "local_path": str(lf / rm.name),
+            "remote_path": rm.path,
+            "local_exists": False,
+            "remote_exists": True,
+            "compare_result": "MissingOnLocal",
+            "same_content": False,
+            "local_size": None,
+            "remote_size": rm.size,
+            "local_mtime": None,
+            "remote_mtime": rm.mtime,
+            "local_hash": "",
+            "remote_hash": gated_hash("remote", rm),
+            "hash_algo": engine.algo,
+        }
+
+    # 収集（問題判定・計画ファイル・適用で全件を使うので溜める）
     records = []      # ファイル粒度
     folder_rows = []  # フォルダ粒度
+    metas: Dict[str, Tuple[Optional[FileMeta], Optional[FileMeta]]] = {}  # rel_path → (local, remote)。計画の指紋用
 
-    local_folders = collect_local_tree(LOCAL_ROOT)
+    # 各側 scandir 1パスのスナップショット（リモートはローカルにある相対フォルダのみ走査）
+    local_snap = TreeSnapshot.build(LOCAL_ROOT, IMAGE_EXTS)
+    remote_snap = remote_snapshot(REMOTE_ROOT, IMAGE_EXTS, args.remote_manifest, engine.algo,
+                                  rels=local_snap.dirs)
 
-    for lf in local_folders:
-        rel = to_rel(lf, LOCAL_ROOT)
+    for rel, l_dir in local_snap.dirs.items():
+        lf = Path(l_dir.path)
         rf = REMOTE_ROOT / rel
-        remote_exists = rf.exists() and rf.is_dir()
+        r_dir = remote_snap.get(rel)
+        remote_exists = r_dir is not None
 
         folder_rows.append({
-            "rel_folder": str(rel).replace("\\", "/"),
+            "rel_folder": rel,
             "local_path": str(lf),
             "remote_path": str(rf),
             "folder_status": "Match" if remote_exists else "RemoteMissing",
         })
 
-        local_imgs = comparable_images_in(lf, IMAGE_EXTS)
+        local_imgs = l_dir.images
+        remote_imgs_index: Dict[str, FileMeta] = r_dir.index() if remote_exists else {}
 
-        remote_imgs_index: Dict[str, Path] = {}
-        if remote_exists:
-            for rp in comparable_images_in(rf, IMAGE_EXTS):
-                remote_imgs_index[rp.name.lower()] = rp
-
-        # ローカル基準で同名ファイルの比較
-        for li in local_imgs:
-            rel_file = to_rel(li, LOCAL_ROOT)
-            li_key = li.name.lower()
-            ri = remote_imgs_index.get(li_key)
-
-            local_exists = True
-            remote_exists_file = ri is not None
-
-            li_size = li.stat().st_size if li.exists() else None
-            li_mtime = datetime.fromtimestamp(li.stat().st_mtime) if li.exists() else None
-            ri_size = ri.stat().st_size if (ri is not None and ri.exists()) else None
-            ri_mtime = datetime.fromtimestamp(ri.stat().st_mtime) if (ri is not None and ri.exists()) else None
-
-            if not remote_exists_file:
-                cmp = "MissingOnRemote"
-                same = False
-                li_md5 = md5sum(li)
-                ri_md5 = ""
-            else:
-                li_md5 = md5sum(li)
-                ri_md5 = md5sum(ri)
-                same = (li_md5 != "" and li_md5 == ri_md5)
-                cmp = "Same" if same else "Different"
-
-            records.append({
-                "rel_path": str(rel_file).replace("\\", "/"),
-                "file_name": li.name,
-                "folder_rel": str(rel).replace("\\", "/"),
-                "local_path": str(li),
-                "remote_path": str(ri) if ri is not None else "",
-                "local_exists": local_exists,
-                "remote_exists": remote_exists_file,
-                "compare_result": cmp,
-                "same_content": same,
-                "local_size": li_size,
-                "remote_size": ri_size,
-                "local_mtime": li_mtime,
-                "remote_mtime": ri_mtime,
-                "local_md5": li_md5,
-                "remote_md5": ri_md5,
-            })
+        # ローカル基準で同名ファイルの比較（並列・結果は投入順）
+        jobs = [(rel, lm, remote_imgs_index.get(lm.name.lower())) for lm in local_imgs]
+        records.extend(pool.map_ordered(compare_local_image, jobs))
+        metas.update((join_rel(rel, lm.name), (lm, rm)) for _, lm, rm in jobs)
 
         # リモートにのみある画像 → ローカル取り込み候補
         if remote_exists:
-            local_names = {p.name.lower() for p in local_imgs}
-            for ri_name_key, ri in remote_imgs_index.items():
-                if ri.name.lower() not in local_names:
-                    rel_file_remote = ri.relative_to(REMOTE_ROOT)
-                    records.append({
-                        "rel_path": str(rel_file_remote).replace("\\", "/"),
-                        "file_name": ri.name,
-                        "folder_rel": str(rel).replace("\\", "/"),
-                        "local_path": str(lf / ri.name),
-                        "remote_path": str(ri),
-                        "local_exists": False,
-                        "remote_exists": True,
-                        "compare_result": "MissingOnLocal",
-                        "same_content": False,
-                        "local_size": None,
-                        "remote_size": ri.stat().st_size if ri.exists() else None,
-                        "local_mtime": None,
-                        "remote_mtime": datetime.fromtimestamp(ri.stat().st_mtime) if ri.exists() else None,
-                        "local_md5": "",
-                        "remote_md5": md5sum(ri),
-                    })
-
-    df_files = pd.DataFrame.from_records(records)
-    df_folders = pd.DataFrame.from_records(folder_rows)
+            local_names = {m.name.lower() for m in local_imgs}
+            jobs = [(rel, lf, rm) for rm in remote_imgs_index.values() if rm.name.lower() not in local_names]
+            records.extend(pool.map_ordered(describe_missing_on_local, jobs))
+            metas.update((join_rel(rel, rm.name), (None, rm)) for _, _, rm in jobs)
+
+    pool.close()
+
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        cache.close()
 
     # 反映プラン生成
     plan_rows = []
@@ -248,17 +383,40 @@ def main():
             "remote_path": row["remote_path"]
         })
 
-    df_plan = pd.DataFrame.from_records(plan_rows)
-
-    # Excel 出力
-    with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl") as xw:
-        if not df_folders.empty:
-            df_folders.sort_values("rel_folder").to_excel(xw, sheet_name="Folders", index=False)
-        if not df_files.empty:
-            df_files.sort_values("rel_path").to_excel(xw, sheet_name="Files", index=False)
-        df_plan[df_plan["action"] != "NONE"].sort_values("rel_path").to_excel(xw, sheet_name="PlannedActions", index=False)
-
-    print(f"[INFO] Excel 出力: {EXCEL_OUT}")
+    # Excel 出力（行単位で書き出し。xlsx は適用結果を書き足してから保存）
+    report = ReportWriter(EXCEL_OUT, sidecar=args.report_sidecar)
+    report.write_records("Folders", sorted(folder_rows, key=lambda r: r["rel_folder"]))
+    report.write_records("Files", sorted(records, key=lambda r: r["rel_path"]))
+    report.write_sheet("PlannedActions",
+                       ["rel_path", "file_name", "action", "reason", "local_path", "remote_path"],
+                       sorted((r for r in plan_rows if r["action"] != "NONE"), key=lambda r: r["rel_path"]))
+
+    # --- 計画ファイル（後から --apply-plan で再走査せずに適用できる）---
+    clean, reasons = is_clean_plan(folder_rows, records, plan_rows, args.delete_local_extra)
+    plan_out = str(Path(EXCEL_OUT).with_suffix(".plan.jsonl.gz")) if args.plan_out is None else args.plan_out
+    if plan_out:
+        by_rel = {r["rel_path"]: r for r in records}
+        actions = []
+        for r in plan_rows:
+            if r["action"] == "NONE":
+                continue
+            lm, rm = metas[r["rel_path"]]
+            row = by_rel[r["rel_path"]]
+            actions.append({**r,
+                            "local": fingerprint(lm, row["local_hash"]),
+                            "remote": fingerprint(rm, row["remote_hash"]) if r["action"] != "DELETE_LOCAL" else None})
+        n = write_plan(plan_out, {
+            "local_root": str(LOCAL_ROOT),
+            "remote_root": str(REMOTE_ROOT),
+            "hash_algo": engine.algo,
+            "image_exts": sorted(IMAGE_EXTS),
+            "delete_local_extra": args.delete_local_extra,
+            "clean": clean,
+            "reasons": reasons,
+            "mode": ("apply" if args.apply else "apply-if-clean" if args.apply_if_clean
+                     else "first-pass-only" if args.first_pass_only else "check"),
+        }, actions)
+        print(f"[INFO] 計画ファイル: {plan_out}（{n} 件。--apply-plan で再走査せずに適用できます）")
 
     # --- 適用フロー制御 ---
     will_apply = False
@@ -271,7 +429,6 @@ def main():
         will_apply = True
         apply_reason = "--apply 指定のため適用します"
     elif args.apply_if_clean:
-        clean, reasons = is_clean_plan(df_folders, df_files, df_plan, args.delete_local_extra)
         if clean:
             will_apply = True
             apply_reason = "--apply-if-clean：問題なし判定のため適用します"
@@ -287,54 +444,15 @@ def main():
 
     # --- 適用実行 ---
     if will_apply:
-        applied = []
-        errors = []
-
-        def ensure_parent(path_str: str):
-            p = Path(path_str)
-            p.parent.mkdir(parents=True, exist_ok=True)
-
-        for _, r in df_plan.iterrows():
-            act = r["action"]
-            if act == "NONE":
-                continue
-
-            lp = Path(r["local_path"]) if r["local_path"] else None
-            rp = Path(r["remote_path"]) if r["remote_path"] else None
-
-            try:
-                if act in ("COPY_REMOTE_TO_LOCAL", "OVERWRITE_LOCAL_WITH_REMOTE"):
-                    if not rp or not rp.exists():
-                        raise FileNotFoundError(f"remote not found: {rp}")
-                    ensure_parent(str(lp))
-                    if args.dry_run:
-                        print(f"[DRY] {act}  {rp} -> {lp}")
-                    else:
-                        shutil.copy2(rp, lp)
-                    applied.append((act, str(rp), str(lp)))
-                elif act == "DELETE_LOCAL":
-                    if lp and lp.exists():
-                        if args.dry_run:
-                            print(f"[DRY] DELETE  {lp}")
-                        else:
-                            lp.unlink()
-                        applied.append((act, "", str(lp)))
-                else:
-                    continue
-            except Exception as e:
-                errors.append((act, str(lp) if lp else "", str(rp) if rp else "", repr(e)))
-
-        # 結果追記
-        with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl", mode="a", if_sheet_exists="replace") as xw:
-            if applied:
-                pd.DataFrame(applied, columns=["action", "src_remote", "dst_local"]).to_excel(xw, sheet_name="Applied", index=False)
-            else:
-                pd.DataFrame({"info": ["No actions executed (nothing to apply or DRY_RUN)"]}).to_excel(xw, sheet_name="Applied", index=False)
-            if errors:
-                pd.DataFrame(errors, columns=["action", "local_path", "remote_path", "error"]).to_excel(xw, sheet_name="Errors", index=False)
-
+        applied, errors = apply_rows(plan_rows, args.dry_run)
+        write_apply_results(report, applied, errors)
         print(f"[INFO] 適用完了（dry-run={args.dry_run}）")
 
+    report.close()
+    print(f"[INFO] Excel 出力: {EXCEL_OUT}")
+    for p in report.sidecar_paths:
+        print(f"[INFO] サイドカー出力: {p}")
+
     dur = datetime.now() - start_ts
     print(f"[DONE] 終了。処理時間: {dur}")
 
@@ -342,16 +460,26 @@ def main():
 if __name__ == "__main__":
     main()
 
-# 1回目：チェックのみ（Excelを見て確認）
-python sync_images.py ^
-  --local "D:\local folder" ^
-  --remote "\\SERVER\Share\remote folder" ^
-  --excel-out "compare_result.xlsx" ^
-  --first-pass-only
-
-# 2回目：問題なければ自動で適用（コピー/上書き）
-python sync_images.py ^
-  --local "D:\local folder" ^
-  --remote "\\SERVER\Share\remote folder" ^
-  --excel-out "compare_result.xlsx" ^
-  --apply-if-clean
+
+# 使用例
+# # 1回目：チェックのみ（Excelを見て確認）
+# python sync_images.py ^
+#   --local "D:\local folder" ^
+#   --remote "\\SERVER\Share\remote folder" ^
+#   --excel-out "compare_result.xlsx" ^
+#   --first-pass-only
+#
+# # 2回目：1回目の計画ファイルをそのまま適用（再走査しない。変わったファイルだけ除外）
+# python sync_images.py ^
+#   --apply-plan "compare_result.plan.jsonl.gz"
+#
+# # 問題ありと判定された計画を、Excel を確認した上で適用する（変わったファイルは同じく除外）
+# python sync_images.py ^
+#   --apply-plan "compare_result.plan.jsonl.gz" --apply-unclean
+#
+# # または：比較し直して、問題なければ自動で適用（コピー/上書き）
+# python sync_images.py ^
+#   --local "D:\local folder" ^
+#   --remote "\\SERVER\Share\remote folder" ^
+#   --excel-out "compare_result.xlsx" ^
+#   --apply-if-clean
@@ -2,26 +2,39 @@
 """
 フォルダ比較＆差分反映ツール（Windows 共有/UNC 対応）
 - ローカル構成を基準（ローカル配下に存在するフォルダを対象）
-- 画像ファイル（拡張子指定）の存在・内容（MD5）比較
-- 差分をExcel出力
+- 画像ファイル（拡張子指定）の存在・内容（ハッシュ：既定 MD5）比較
+- 差分をExcel出力（行単位のストリーミング出力。上限超過のシートは自動分割、CSV/Parquet サイドカー可）
 - 差分のローカル反映（コピー/上書き、必要なら削除）
+- 走査 → 比較 → 計画 → レポート/反映 はフォルダ単位のジェネレータでつなぎ、
+  反映は走査中に届いた計画から始める（Files / PlannedActions はフォルダの深さ優先順）
+- フェーズ別の計測を METRICS_OUT（JSON）と Metrics シートに出力
+- 反映のコピーは MAX_MBPS / MAX_FILES_PER_SEC で帯域・件数を制限できる（THROTTLE_CONTROL の
+  制御ファイルを書き換えると実行中でも変更可）。リモートの存在確認はフォルダ一覧1回でまとめて答える
 
 要件:
-    pip install pandas openpyxl  # または xlsxwriter
+    pip install openpyxl（Parquet サイドカーは pyarrow も）
 
 注意:
     - リモートはUNCやマップドドライブ等、Pythonから直接参照可能であること
     - 権限・ロック中ファイル・超大容量のハッシュ計算に注意
 """
 
-import os
 import sys
-import hashlib
-import shutil
+import time
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
-import pandas as pd
-from typing import Dict, Tuple, List
+from typing import Dict, Iterator, Optional
+
+from copy_engine import fast_copy
+from hash_cache import HashCache, open_cache
+from hash_engine import HashEngine
+from pipeline import FolderResult, bounded, walk_pairs
+from report_writer import ReportWriter
+from sync_manifest import remote_snapshot
+from sync_metrics import Metrics
+from throttle import DirListing, TransferThrottle
+from tree_snapshot import FileMeta, join_rel
 
 # ========= 設定 =========
 # 例: r"\\SERVER\Share\RemoteFolder" もしくは "Z:\\RemoteFolder"
@@ -34,54 +47,85 @@ IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
 # Excel 出力先
 EXCEL_OUT = "compare_result.xlsx"
 
+# 各シートの CSV/Parquet サイドカー（"none" / "csv" / "parquet"）
+REPORT_SIDECAR = "none"
+
 # 反映動作（ローカルへ適用）
 APPLY_DIFFS = True                # True: 差分をローカルへ反映する / False: レポートのみ
 DELETE_LOCAL_EXTRA = False        # True: ローカルにしか無い画像を削除（危険）/ 既定 False
 DRY_RUN = False                   # True: 反映内容を表示のみ（コピー/削除は実行しない）
-# =======================
-
-
-def is_image(p: Path) -> bool:
-    return p.suffix.lower() in IMAGE_EXTS
-
 
-def md5sum(path: Path, chunk_size: int = 1024 * 1024) -> str:
-    """大きなファイルも考慮したMD5計算。アクセス不可時は空文字を返す。"""
-    h = hashlib.md5()
-    try:
-        with path.open("rb") as f:
-            for chunk in iter(lambda: f.read(chunk_size), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    except Exception:
-        return ""
+# ハッシュキャッシュ（SQLite）。None で無効。size/mtime/inode 一致時は内容を読まない
+HASH_CACHE_DB = "hash_cache.sqlite"
 
+# 内容比較のハッシュ（md5 / sha1 / sha256 / blake2b / blake2s）。Files の hash_algo 列に記録
+HASH_ALGO = "md5"
 
-def collect_local_tree(local_root: Path) -> List[Path]:
-    """ローカルの基準フォルダ配下に存在する全サブフォルダ（自分含む）を返す。"""
-    folders = []
-    for dirpath, dirnames, filenames in os.walk(local_root):
-        folders.append(Path(dirpath))
-    return folders
+# sync_manifest.py で作成したリモートのマニフェスト（None でリモートを直接走査）
+REMOTE_MANIFEST = None
 
+# 走査・比較と反映の間に溜める計画の上限件数（メモリ上限の目安）
+QUEUE_SIZE = 256
 
-def comparable_images_in(folder: Path) -> List[Path]:
-    """フォルダ内の画像ファイル（直下のみ。サブフォルダは別途走査）"""
-    try:
-        return [p for p in folder.iterdir() if p.is_file() and is_image(p)]
-    except Exception:
-        return []
+# 反映コピーの転送制限（0 で無制限）。共有回線を使う日中の実行向け
+MAX_MBPS = 0              # MiB/秒
+MAX_FILES_PER_SEC = 0     # 件/秒
+# 制御ファイル（max_mbps / max_files_per_sec / paused を key = value で記述）。None で使わない。
+# 実行中に書き換えると数秒で反映。無ければ上の値で作成する
+THROTTLE_CONTROL = None
 
+# フェーズ別計測（時間・stat 数・ハッシュ読み込み量・キャッシュヒット・コピー速度）
+METRICS_OUT = "compare_metrics.json"   # None で出力しない
+METRICS_SHEET = True                   # Excel に Metrics シートを追加
+# =======================
 
-def to_rel(p: Path, root: Path) -> Path:
-    try:
-        return p.relative_to(root)
-    except Exception:
-        return p
+FOLDER_COLUMNS = ["rel_folder", "local_path", "remote_path", "folder_status"]
+FILE_COLUMNS = ["rel_path", "file_name", "folder_rel", "local_path", "remote_path",
+                "local_exists", "remote_exists", "compare_result", "same_content",
+                "local_size", "remote_size", "local_mtime", "remote_mtime",
+                "local_hash", "remote_hash", "hash_algo"]
+PLAN_COLUMNS = ["rel_path", "file_name", "action", "reason", "local_path", "remote_path"]
+
+
+def content_hash(meta: FileMeta, engine: HashEngine, cache: Optional[HashCache] = None,
+                 local: bool = False, metrics: Optional[Metrics] = None) -> str:
+    """ハッシュ計算（mmap はローカルのみ）。アクセス不可時は空文字を返す。"""
+    if meta.digest:
+        return meta.digest  # マニフェスト等で既知
+    side = "local" if local else "remote"
+
+    hashed = False
+
+    def compute(p) -> str:
+        nonlocal hashed
+        digest, nread = engine.hash_path(p, allow_mmap=local)
+        hashed = True
+        if metrics is not None:
+            metrics.add(f"{side}_files_hashed")  # 実際に読んだものだけ（キャッシュヒットは別に数える）
+            metrics.add(f"{side}_bytes_hashed", nread)
+        return digest
+
+    with metrics.phase(f"hash_{side}") if metrics is not None else nullcontext():
+        if cache is not None:
+            # スナップショットの stat 情報で照合（stat を再発行しない）
+            digest = cache.get_or_compute_stat(meta.path, meta.size, meta.mtime_ns, meta.inode, compute)
+            if metrics is not None and not hashed:
+                metrics.add(f"{side}_hash_cache_hits")
+            return digest
+        return compute(meta.path)
 
 
 def main():
     start_ts = datetime.now()
+    metrics = Metrics("check_remote_local")
+    for k in ("HASH_ALGO", "REMOTE_MANIFEST", "APPLY_DIFFS", "DRY_RUN", "DELETE_LOCAL_EXTRA"):
+        metrics.set(k.lower(), globals()[k])
+    metrics.rate("local_hash_bytes_per_sec", "local_bytes_hashed", "hash_local")
+    metrics.rate("remote_hash_bytes_per_sec", "remote_bytes_hashed", "hash_remote")
+    metrics.rate("copy_bytes_per_sec", "copy_bytes", "apply")
+    metrics.rate("copy_files_per_sec", "copy_files", "apply")
+    engine = HashEngine(HASH_ALGO)
+    cache = open_cache(HASH_CACHE_DB, algo=engine.algo)
     local_root = Path(LOCAL_ROOT)
     remote_root = Path(REMOTE_ROOT)
 
@@ -89,114 +133,108 @@ def main():
         print(f"[ERROR] LOCAL_ROOT が存在しません: {local_root}")
         sys.exit(1)
 
-    # レコード蓄積
-    records = []   # 画像単位
-    folder_rows = []  # フォルダ単位要約
-
-    # ローカル基準で全フォルダ列挙
-    local_folders = collect_local_tree(local_root)
-
-    for lf in local_folders:
-        rel = to_rel(lf, local_root)
-        rf = remote_root / rel
-        remote_exists = rf.exists() and rf.is_dir()
-
-        # 1) フォルダ名一致（=同じ相対パスのフォルダがリモートに存在するか）
-        folder_status = "Match" if remote_exists else "RemoteMissing"
-        folder_rows.append({
-            "rel_folder": str(rel).replace("\\", "/"),
-            "local_path": str(lf),
-            "remote_path": str(rf),
-            "folder_status": folder_status
-        })
-
-        # 2) フォルダ内の画像チェック（ローカル側に存在する画像が基準）
-        local_imgs = comparable_images_in(lf)
-
-        # リモート側にも画像があるかを把握（名前→Path）
-        remote_imgs_index: Dict[str, Path] = {}
-        if remote_exists:
-            for rp in comparable_images_in(rf):
-                remote_imgs_index[rp.name.lower()] = rp
-
-        # a) ローカルの各画像について存在 & 内容比較
-        for li in local_imgs:
-            rel_file = to_rel(li, local_root)
-            li_name_key = li.name.lower()
-            ri = remote_imgs_index.get(li_name_key)
-
-            local_exists = True
-            remote_exists_file = ri is not None
-
-            li_size = li.stat().st_size if li.exists() else None
-            li_mtime = datetime.fromtimestamp(li.stat().st_mtime) if li.exists() else None
-            ri_size = ri.stat().st_size if ri is not None and ri.exists() else None
-            ri_mtime = datetime.fromtimestamp(ri.stat().st_mtime) if ri is not None and ri.exists() else None
-
-            if not remote_exists_file:
-                cmp = "MissingOnRemote"
-                same = False
-                li_md5 = md5sum(li)
-                ri_md5 = ""
-            else:
-                # 3) 同名 → 中身比較（MD5）
-                li_md5 = md5sum(li)
-                ri_md5 = md5sum(ri)
-                same = (li_md5 != "" and li_md5 == ri_md5)
-                cmp = "Same" if same else "Different"
-
-            records.append({
-                "rel_path": str(rel_file).replace("\\", "/"),
-                "file_name": li.name,
-                "folder_rel": str(rel).replace("\\", "/"),
-                "local_path": str(li),
-                "remote_path": str(ri) if ri is not None else "",
-                "local_exists": local_exists,
-                "remote_exists": remote_exists_file,
-                "compare_result": cmp,
-                "same_content": same,
-                "local_size": li_size,
-                "remote_size": ri_size,
-                "local_mtime": li_mtime,
-                "remote_mtime": ri_mtime,
-                "local_md5": li_md5,
-                "remote_md5": ri_md5,
-            })
-
-        # b) リモートにだけ存在する画像（ローカルに無いもの） → ローカルへ取り込み候補
-        if remote_exists:
-            local_names = {p.name.lower() for p in local_imgs}
-            for ri_name_key, ri in remote_imgs_index.items():
-                if ri.name.lower() not in local_names:
-                    rel_file_remote = ri.relative_to(remote_root)
-                    records.append({
-                        "rel_path": str(rel_file_remote).replace("\\", "/"),
-                        "file_name": ri.name,
-                        "folder_rel": str(rel).replace("\\", "/"),
-                        "local_path": str(lf / ri.name),
-                        "remote_path": str(ri),
-                        "local_exists": False,
-                        "remote_exists": True,
-                        "compare_result": "MissingOnLocal",
-                        "same_content": False,
-                        "local_size": None,
-                        "remote_size": ri.stat().st_size if ri.exists() else None,
-                        "local_mtime": None,
-                        "remote_mtime": datetime.fromtimestamp(ri.stat().st_mtime) if ri.exists() else None,
-                        "local_md5": "",
-                        "remote_md5": md5sum(ri),
-                    })
-
-    # DataFrame 化
-    df_files = pd.DataFrame.from_records(records)
-    df_folders = pd.DataFrame.from_records(folder_rows)
+    # ローカル基準でフォルダを深さ優先に列挙（リモートはローカルにある相対フォルダのみ scandir）。
+    # 走査 → 比較 → 計画 → レポート/反映 はフォルダ単位のジェネレータでつなぎ、画像単位の行は溜めない
+    remote_manifest_snap = (remote_snapshot(remote_root, IMAGE_EXTS, REMOTE_MANIFEST, engine.algo)
+                            if REMOTE_MANIFEST else None)
+
+    def compared_folders() -> Iterator[FolderResult]:
+        walk = walk_pairs(local_root, remote_root, IMAGE_EXTS, remote_manifest_snap, local_only=True)
+        for rel, l_dir, r_dir in metrics.timed("walk", walk):
+            metrics.add("folders")
+            metrics.add("local_files_stat", len(l_dir.images))
+            if r_dir is not None:
+                metrics.add("remote_files_manifest" if remote_manifest_snap else "remote_files_stat",
+                            len(r_dir.images))
+            lf = Path(l_dir.path)
+            rf = remote_root / rel
+            remote_exists = r_dir is not None
+            records = []   # このフォルダの画像単位
+
+            # 1) フォルダ名一致（=同じ相対パスのフォルダがリモートに存在するか）
+            folder_status = "Match" if remote_exists else "RemoteMissing"
+            folder_row = {
+                "rel_folder": rel,
+                "local_path": str(lf),
+                "remote_path": str(rf),
+                "folder_status": folder_status
+            }
+
+            # 2) フォルダ内の画像チェック（ローカル側に存在する画像が基準）
+            local_imgs = l_dir.images
+
+            # リモート側にも画像があるかを把握（小文字名→FileMeta）
+            remote_imgs_index: Dict[str, FileMeta] = r_dir.index() if remote_exists else {}
+
+            # a) ローカルの各画像について存在 & 内容比較
+            for lm in local_imgs:
+                rm = remote_imgs_index.get(lm.name.lower())
+
+                local_exists = True
+                remote_exists_file = rm is not None
+
+                if not remote_exists_file:
+                    cmp = "MissingOnRemote"
+                    same = False
+                    li_hash = content_hash(lm, engine, cache, local=True, metrics=metrics)
+                    ri_hash = ""
+                else:
+                    # 3) 同名 → 中身比較（ハッシュ）
+                    li_hash = content_hash(lm, engine, cache, local=True, metrics=metrics)
+                    ri_hash = content_hash(rm, engine, cache, metrics=metrics)
+                    same = (li_hash != "" and li_hash == ri_hash)
+                    cmp = "Same" if same else "Different"
+
+                records.append({
+                    "rel_path": join_rel(rel, lm.name),
+                    "file_name": lm.name,
+                    "folder_rel": rel,
+                    "local_path": lm.path,
+                    "remote_path": rm.path if rm is not None else "",
+                    "local_exists": local_exists,
+                    "remote_exists": remote_exists_file,
+                    "compare_result": cmp,
+                    "same_content": same,
+                    "local_size": lm.size,
+                    "remote_size": rm.size if rm is not None else None,
+                    "local_mtime": lm.mtime,
+                    "remote_mtime": rm.mtime if rm is not None else None,
+                    "local_hash": li_hash,
+                    "remote_hash": ri_hash,
+                    "hash_algo": engine.algo,
+                })
+
+            # b) リモートにだけ存在する画像（ローカルに無いもの） → ローカルへ取り込み候補
+            if remote_exists:
+                local_names = {m.name.lower() for m in local_imgs}
+                for rm in remote_imgs_index.values():
+                    if rm.name.lower() not in local_names:
+                        records.append({
+                            "rel_path": join_rel(rel, rm.name),
+                            "file_name": rm.name,
+                            "folder_rel": rel,
+                            "local_path": str(lf / rm.name),
+                            "remote_path": rm.path,
+                            "local_exists": False,
+                            "remote_exists": True,
+                            "compare_result": "MissingOnLocal",
+                            "same_content": False,
+                            "local_size": None,
+                            "remote_size": rm.size,
+                            "local_mtime": None,
+                            "remote_mtime": rm.mtime,
+                            "local_hash": "",
+                            "remote_hash": content_hash(rm, engine, cache, metrics=metrics),
+                            "hash_algo": engine.algo,
+                        })
+
+            yield FolderResult(folder_row, l_dir, r_dir, records)
 
     # 反映計画（ローカル基準）
     # - MissingOnLocal: リモート→ローカルへコピー
     # - Different: リモートの内容でローカルを上書き（ローカルを基準構成として“差分反映”する解釈）
     # - MissingOnRemote: 既定では何もしない（必要ならローカル削除もあり得るが要注意）
-    plan_rows = []
-    for row in records:
+    def plan_row(row: dict) -> dict:
         action = "None"
         reason = ""
         if row["compare_result"] == "MissingOnLocal" and row["remote_exists"]:
@@ -212,26 +250,36 @@ def main():
             action = "NONE"
             reason = reason or "変更なし/対象外"
 
-        plan_rows.append({
+        return {
             "rel_path": row["rel_path"],
             "file_name": row["file_name"],
             "action": action,
             "reason": reason,
             "local_path": row["local_path"],
             "remote_path": row["remote_path"]
-        })
-
-    df_plan = pd.DataFrame.from_records(plan_rows)
-
-    # Excel 出力
-    with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl") as xw:
-        df_folders.sort_values("rel_folder").to_excel(xw, sheet_name="Folders", index=False)
-        df_files.sort_values("rel_path").to_excel(xw, sheet_name="Files", index=False)
-        df_plan[df_plan["action"] != "NONE"].sort_values("rel_path").to_excel(xw, sheet_name="PlannedActions", index=False)
-
-    print(f"[INFO] Excel 出力: {EXCEL_OUT}")
-
-    # 差分のローカル反映
+        }
+
+    # Excel 出力（行単位で書き出し。xlsx は反映結果を書き足してから保存）
+    report = ReportWriter(EXCEL_OUT, sidecar=REPORT_SIDECAR)
+    s_folders = report.sheet("Folders", FOLDER_COLUMNS)
+    s_files = report.sheet("Files", FILE_COLUMNS)
+    s_plan = report.sheet("PlannedActions", PLAN_COLUMNS)
+    folder_rows = []  # フォルダ単位要約（フォルダ数分のみ保持し、最後に並べ替えて出力）
+
+    def planned() -> Iterator[dict]:
+        """比較結果をレポートに流しつつ、反映対象（NONE 以外）の計画を1件ずつ返す。"""
+        for fr in compared_folders():
+            folder_rows.append(fr.folder_row)
+            for row in fr.file_rows:
+                r = plan_row(row)
+                with metrics.phase("report"):
+                    s_files.write(row)
+                    if r["action"] != "NONE":
+                        s_plan.write(r)
+                if r["action"] != "NONE":
+                    yield r
+
+    # 差分のローカル反映（走査・比較は別スレッドで先行させ、届いた計画から反映する）
     if APPLY_DIFFS:
         applied = []
         errors = []
@@ -241,27 +289,37 @@ def main():
             p = Path(path_str)
             p.parent.mkdir(parents=True, exist_ok=True)
 
-        for _, r in df_plan.iterrows():
+        throttle = TransferThrottle(MAX_MBPS, MAX_FILES_PER_SEC, THROTTLE_CONTROL)
+        listing = DirListing()
+
+        def copy_file(rp: Path, lp: Path) -> None:
+            throttle.before_file()
+            nbytes = fast_copy(rp, lp, pace=throttle.pace)
+            metrics.add("copy_files")
+            metrics.add("copy_bytes", nbytes)
+
+        apply_t0 = time.perf_counter()
+        for r in bounded(planned(), QUEUE_SIZE):
             act = r["action"]
             lp = Path(r["local_path"]) if r["local_path"] else None
             rp = Path(r["remote_path"]) if r["remote_path"] else None
 
             try:
                 if act == "COPY_REMOTE_TO_LOCAL":
-                    if rp and rp.exists():
+                    if rp and listing.exists(rp):
                         ensure_parent(str(lp))
                         if DRY_RUN:
                             print(f"[DRY] COPY  {rp} -> {lp}")
                         else:
-                            shutil.copy2(rp, lp)
+                            copy_file(rp, lp)
                         applied.append((act, str(rp), str(lp)))
                 elif act == "OVERWRITE_LOCAL_WITH_REMOTE":
-                    if rp and rp.exists():
+                    if rp and listing.exists(rp):
                         ensure_parent(str(lp))
                         if DRY_RUN:
                             print(f"[DRY] OVERWRITE  {rp} -> {lp}")
                         else:
-                            shutil.copy2(rp, lp)
+                            copy_file(rp, lp)
                         applied.append((act, str(rp), str(lp)))
                 elif act == "DELETE_LOCAL":
                     if lp and lp.exists():
@@ -274,21 +332,49 @@ def main():
                     continue
             except Exception as e:
                 errors.append((act, str(lp), str(rp), repr(e)))
+        metrics.add_time("apply", time.perf_counter() - apply_t0)  # 走査と重なる
+        metrics.add("remote_dir_listings", listing.listed)
+        metrics.add("remote_exists_stats", listing.stats)
+        if throttle.waited > 0:
+            metrics.add("throttle_wait_sec", round(throttle.waited, 3))
+            print(f"[INFO] 転送制限による待ち: 合計 {throttle.waited:.1f} 秒（{throttle.describe()}）")
+        metrics.add("apply_ok", len(applied))
+        metrics.add("apply_errors", len(errors))
+
+        # 反映結果を追記出力（同じライターに書き足す。ブックの読み直しなし）
+        if applied:
+            report.write_sheet("Applied", ["action", "src_remote", "dst_local"], applied)
+        else:
+            report.write_sheet("Applied", ["info"], [["No actions executed (nothing to apply or DRY_RUN)"]])
 
-        # 反映結果を追記出力
-        applied_df = pd.DataFrame(applied, columns=["action", "src_remote", "dst_local"])
-        errors_df = pd.DataFrame(errors, columns=["action", "local_path", "remote_path", "error"])
-
-        with pd.ExcelWriter(EXCEL_OUT, engine="openpyxl", mode="a", if_sheet_exists="replace") as xw:
-            if not applied_df.empty:
-                applied_df.to_excel(xw, sheet_name="Applied", index=False)
-            else:
-                pd.DataFrame({"info": ["No actions executed (nothing to apply or DRY_RUN)"]}).to_excel(xw, sheet_name="Applied", index=False)
-
-            if not errors_df.empty:
-                errors_df.to_excel(xw, sheet_name="Errors", index=False)
+        if errors:
+            report.write_sheet("Errors", ["action", "local_path", "remote_path", "error"], errors)
 
         print(f"[INFO] 反映完了（APPLY_DIFFS={APPLY_DIFFS}, DRY_RUN={DRY_RUN}, DELETE_LOCAL_EXTRA={DELETE_LOCAL_EXTRA})")
+    else:
+        for _ in planned():
+            pass
+
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        metrics.add("cache_hits", cache.hits)
+        metrics.add("cache_misses", cache.misses)
+        cache.close()
+    metrics.add("file_rows", s_files.rows)
+    metrics.add("planned_actions", s_plan.rows)
+
+    with metrics.phase("report"):
+        s_folders.write_many(sorted(folder_rows, key=lambda r: r["rel_folder"]))
+        if METRICS_SHEET:
+            report.write_sheet("Metrics", ["kind", "name", "value"], metrics.rows())  # 保存時間は含まない
+        report.close()
+    print(f"[INFO] Excel 出力: {EXCEL_OUT}")
+    for p in report.sidecar_paths:
+        print(f"[INFO] サイドカー出力: {p}")
+
+    if METRICS_OUT:
+        metrics.write_json(METRICS_OUT)
+        print(f"[INFO] 計測: {metrics.summary()} → {METRICS_OUT}")
 
     dur = datetime.now() - start_ts
     print(f"[DONE] 終了。処理時間: {dur}")
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+並列コピー実行エンジン
+
+- fast_copy：可能ならカーネル内コピー（os.copy_file_range → os.sendfile）、
+  使えない環境・FS 組み合わせでは大きめバッファのユーザ空間コピーに自動で切り替え。
+  最後に copystat で mtime 等を複写（shutil.copy2 相当）
+- CopyExecutor：指定並列数でアクションを実行し、files/s・MB/s を定期表示
+- 検証：比較フェーズで得たリモート側ハッシュ（expected_hash）とコピー先を照合。
+  コピー元（リモート）は読み直さない
+- 転送制限（throttle.TransferThrottle）を渡すと、ファイル数/秒と帯域（1 MiB ごと）の上限を守る
+"""
+
+import os
+import sys
+import time
+import errno
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar, Union
+
+from hash_engine import HashEngine
+from throttle import PACE_CHUNK, TransferThrottle
+
+PathLike = Union[str, Path]
+T = TypeVar("T")
+
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.EBADF}
+
+# 一度失敗した方式は以降試さない（NFS/SMB 等で毎回失敗するのを避ける）
+_kernel_copy = {"copy_file_range": hasattr(os, "copy_file_range"),
+                "sendfile": hasattr(os, "sendfile") and sys.platform.startswith("linux")}
+
+
+class CopyVerifyError(Exception):
+    pass
+
+
+def _copy_kernel(fsrc, fdst, size: int, method: str,
+                 pace: Optional[Callable[[int], None]] = None) -> bool:
+    """カーネル内コピー。使えなかった場合は False（ファイル位置は先頭のまま）。"""
+    in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+    off = 0
+    try:
+        while off < size:
+            count = size - off if pace is None else min(PACE_CHUNK, size - off)
+            if method == "copy_file_range":
+                n = os.copy_file_range(in_fd, out_fd, count)
+            else:
+                n = os.sendfile(out_fd, in_fd, off, count)
+            if n == 0:
+                break
+            off += n
+            if pace is not None:
+                pace(n)
+        return True
+    except OSError as e:
+        if off == 0 and e.errno in _FALLBACK_ERRNOS:
+            _kernel_copy[method] = False
+            return False
+        raise
+
+
+def fast_copy(src: PathLike, dst: PathLike, buf_size: int = 4 * 1024 * 1024,
+              pace: Optional[Callable[[int], None]] = None) -> int:
+    """
+    src → dst をコピーしてメタデータも複写し、コピーしたバイト数を返す。
+    pace を渡すと PACE_CHUNK ごとに pace(バイト数) を呼ぶ（帯域制限用。呼び出し中は次を読まない）。
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        done = False
+        for method in ("copy_file_range", "sendfile"):
+            if _kernel_copy[method] and size > 0:
+                done = _copy_kernel(fsrc, fdst, size, method, pace)
+                if done:
+                    break
+        if not done and pace is None:
+            shutil.copyfileobj(fsrc, fdst, buf_size)
+        elif not done:
+            while True:
+                buf = fsrc.read(PACE_CHUNK)
+                if not buf:
+                    break
+                fdst.write(buf)
+                pace(len(buf))
+    shutil.copystat(src, dst)
+    return size
+
+
+class TransferStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+
+    def line(self, total: Optional[int] = None) -> str:
+        sec = max(time.monotonic() - self.start, 1e-9)
+        prog = f"{self.files}/{total}" if total is not None else f"{self.files}"
+        return (f"{prog} files, {self.bytes / 1024 / 1024:.1f} MiB, "
+                f"{self.files / sec:.1f} files/s, {self.bytes / 1024 / 1024 / sec:.1f} MB/s")
+
+
+class CopyExecutor:
+    def __init__(self, workers: int = 4, verify_engine: Optional[HashEngine] = None,
+                 progress_interval: float = 5.0, throttle: Optional[TransferThrottle] = None):
+        self.workers = max(1, workers)
+        self.verify_engine = verify_engine
+        self.progress_interval = progress_interval
+        self.throttle = throttle
+        self.stats = TransferStats()
+
+    def copy(self, src: PathLike, dst: PathLike, expected_hash: str = "",
+             throttled: bool = True) -> Optional[bool]:
+        """
+        コピーを実行。戻り値は検証結果（True=一致 / None=検証なし）。
+        不一致時は CopyVerifyError。throttled=False は転送制限の対象外（ローカル内のコピー用）。
+        """
+        pace = None
+        if throttled and self.throttle is not None:
+            self.throttle.before_file()
+            pace = self.throttle.pace
+        nbytes = fast_copy(src, dst, pace=pace)
+        self.stats.add(nbytes)
+        if self.verify_engine is None or not expected_hash:
+            return None
+        actual = self.verify_engine.hexdigest(dst, allow_mmap=True)  # コピー先（ローカル）のみ読む
+        if actual != expected_hash:
+            raise CopyVerifyError(f"hash mismatch after copy: {dst} ({actual} != {expected_hash})")
+        return True
+
+    @staticmethod
+    def _collect(pending: dict, done: set) -> Iterator[tuple]:
+        for fut in done:
+            it = pending.pop(fut)
+            exc = fut.exception()
+            yield it, (None if exc else fut.result()), exc
+
+    def run(self, fn: Callable[[T], object], items: Iterable[T],
+            total: Optional[int] = None) -> Iterator[Tuple[T, object, Optional[BaseException]]]:
+        """
+        fn(item) を並列実行し、完了順に (item, 結果, 例外) を返す。進捗を定期表示。
+        items は逐次取り出すので、上流の走査と並行して適用を始められる。
+        """
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(self.progress_interval):
+                print(f"[PROGRESS] {self.stats.line(total)}")
+
+        reporter = threading.Thread(target=report, daemon=True)
+        reporter.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="copy") as ex:
+                # 投入は workers の数倍までに抑える（items がジェネレータでも先読みしすぎない）
+                pending: Dict[Future, T] = {}
+                for it in items:
+                    pending[ex.submit(fn, it)] = it
+                    if len(pending) >= self.workers * 4:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        yield from self._collect(pending, done)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self._collect(pending, done)
+        finally:
+            stop.set()
+            reporter.join()
+            print(f"[INFO] 転送: {self.stats.line()}")
+            if self.throttle is not None and self.throttle.waited > 0:
+                print(f"[INFO] 転送制限による待ち: 合計 {self.throttle.waited:.1f} 秒（{self.throttle.describe()}）")
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+フォルダ一覧の先読み（asyncio）
+
+SMB などの高遅延リモートでは、フォルダを1つずつ scandir すると往復待ちが直列に積み重なる。
+ここでは asyncio のイベントループ（専用スレッド）が一覧取得をスレッドプールに投げ、
+最大 inflight 件を同時に走らせる。一覧が届いたフォルダの子フォルダはその場で予約し、
+呼び出し側（pipeline.walk_pairs）は従来と同じ深さ優先順に結果を受け取る。
+
+- 予約は深さ優先順（相対パスの辞書順）で小さいものから開始するので、
+  次に必要なフォルダが後回しにならない
+- 先読みして溜める件数は window 件まで（呼び出し側が待っているフォルダは上限を無視して開始）
+- prune(rel) で rel 配下の予約を取り消す（walk_pairs の descend=False 用）
+
+os.scandir はブロッキング呼び出しのため、実際の I/O はスレッドプール上で行う
+（asyncio は同時実行数の管理と、完了順の受け渡しを担当する）。
+"""
+
+import heapq
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+
+Job = Tuple[str, bool, bool]   # (rel, ローカル側を見るか, リモート側を見るか)
+R = TypeVar("R")
+
+
+def order_key(rel: str) -> tuple:
+    """深さ優先（名前順）の順序キー。ルート "." が最小"""
+    return () if rel == "." else tuple(rel.split("/"))
+
+
+class AsyncPrefetcher(Generic[R]):
+    def __init__(self, scan: Callable[[str, bool, bool], R], children: Callable[[Job, R], List[Job]],
+                 root: Job, inflight: int = 16, window: Optional[int] = None):
+        self.scan = scan
+        self.children = children
+        self.inflight = max(1, inflight)
+        self.window = window or self.inflight * 4
+        self.peak = 0        # 同時実行数の最大値（計測用）
+        self.scanned = 0
+        self._heap: List[Tuple[tuple, Job]] = []
+        self._results: Dict[str, Tuple[Optional[R], Optional[BaseException]]] = {}
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._pruned: Set[str] = set()
+        self._running = 0
+        self._ex = ThreadPoolExecutor(max_workers=self.inflight, thread_name_prefix="crawl")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="crawler")
+        self._thread.start()
+        self._loop.call_soon_threadsafe(self._push, root)
+
+    # --- イベントループ側 ---
+    def _under_pruned(self, rel: str) -> bool:
+        if not self._pruned or rel == ".":
+            return False
+        if "." in self._pruned:
+            return True
+        parts = rel.split("/")
+        return any("/".join(parts[:k]) in self._pruned for k in range(1, len(parts)))
+
+    def _push(self, job: Job) -> None:
+        heapq.heappush(self._heap, (order_key(job[0]), job))
+        self._schedule()
+
+    def _schedule(self) -> None:
+        while self._heap and self._running < self.inflight:
+            rel = self._heap[0][1][0]
+            if self._under_pruned(rel):
+                heapq.heappop(self._heap)
+                continue
+            if self._running + len(self._results) >= self.window and rel not in self._waiters:
+                break  # 先読みは十分。呼び出し側が追いつくまで待つ
+            _, job = heapq.heappop(self._heap)
+            self._running += 1
+            self.peak = max(self.peak, self._running)
+            fut = self._loop.run_in_executor(self._ex, self.scan, *job)
+            fut.add_done_callback(partial(self._done, job))
+
+    def _done(self, job: Job, fut: asyncio.Future) -> None:
+        self._running -= 1
+        self.scanned += 1
+        rel = job[0]
+        if self._under_pruned(rel):
+            self._schedule()
+            return
+        try:
+            res, err = fut.result(), None
+        except BaseException as e:  # 呼び出し側で再送出
+            res, err = None, e
+        if err is None:
+            for child in self.children(job, res):
+                heapq.heappush(self._heap, (order_key(child[0]), child))
+        self._results[rel] = (res, err)
+        waiter = self._waiters.pop(rel, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        self._schedule()
+
+    def _prune(self, rel: str) -> None:
+        self._pruned.add(rel)
+        for r in [r for r in self._results if self._under_pruned(r)]:
+            del self._results[r]  # 先読み済みの分も捨てる（window を空ける）
+        self._schedule()
+
+    async def _get(self, rel: str) -> R:
+        if rel not in self._results:
+            waiter = self._loop.create_future()
+            self._waiters[rel] = waiter
+            self._schedule()
+            await waiter
+        res, err = self._results.pop(rel)
+        if err is not None:
+            raise err
+        return res
+
+    # --- 呼び出し側（別スレッド）---
+    def get(self, rel: str) -> R:
+        """rel の一覧結果を返す（未着なら届くまで待つ）。rel は深さ優先順に要求すること。"""
+        return asyncio.run_coroutine_threadsafe(self._get(rel), self._loop).result()
+
+    def prune(self, rel: str) -> None:
+        """rel 配下（rel 自身は除く）の先読みを取り消す"""
+        self._loop.call_soon_threadsafe(self._prune, rel)
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._ex.shutdown(wait=False, cancel_futures=True)
+        self._loop.close()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+データセットの頭数調べ（クラス × split の画像数・合計サイズ）
+
+<base>/<split>/<class>/... を走査し、クラスごと・split ごとの画像数と画像の合計バイト数を表にする。
+find_dataset_paths_update.py と同じ Excel のクラス一覧（A列）を渡すと、その順で並べ、
+どの split にも無いクラス・一覧に無いフォルダも分かるようにする。
+
+- 走査はクラスフォルダ単位で並列（スレッドプール）
+- フォルダごとの集計（直下の画像数・バイト数・子フォルダ名）をハッシュキャッシュ（hash_cache.py の
+  SQLite。フォルダダイジェストの表を、アルゴリズム名 census:<拡張子> で使う）に保存する。
+  キーはフォルダの mtime_ns で、一致すれば stat 1回で済ませて scandir しない（子フォルダも同様にたどる）
+- フォルダの mtime はファイルの追加・削除・改名で変わるが、同じ名前での上書きでは変わらない。
+  上書きでサイズが変わった分まで拾い直したいときは --full（キャッシュを使わず全走査し、記録し直す）
+
+Excel出力
+- Census：クラスごとの <split>_images / <split>_bytes・合計・無い split
+- Splits：split ごとのクラス数・画像数・バイト数
+
+例:
+    python dataset_census.py --base /srv/datasets --excel-out census.xlsx
+    python dataset_census.py --base /srv/datasets --classes-excel /path/to/workbook.xlsx --sheet_in sheet1 --col A
+"""
+
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from hash_cache import HashCache, open_cache
+from report_writer import SIDECAR_FORMATS, ReportWriter
+from tree_snapshot import scan_dir
+
+
+class FolderCount(NamedTuple):
+    images: int          # 直下の画像数
+    bytes: int           # 直下の画像の合計サイズ
+    subdirs: List[str]   # 直下の子フォルダ名
+
+
+class ClassCount(NamedTuple):
+    images: int          # 配下（サブフォルダ含む）の画像数
+    bytes: int
+    folders: int         # たどったフォルダ数
+    cached: int          # うちキャッシュで済んだフォルダ数
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="データセットのクラス × split の画像数・サイズ集計（フォルダ mtime でキャッシュ）")
+    p.add_argument("--base", required=True, help="データセットのベース（<base>/<split>/<class>/...）")
+    p.add_argument("--subsets", nargs="*", default=["train", "val", "test"], help="対象の split フォルダ名")
+    p.add_argument("--excel-out", default="dataset_census.xlsx", help="Excel出力先")
+    p.add_argument("--classes-excel", default=None,
+                   help="クラス一覧の Excel（find_dataset_paths_update.py の --excel と同じもの）。この順で並べる")
+    p.add_argument("--sheet_in", default="sheet1", help="クラス一覧のシート名")
+    p.add_argument("--col", default="A", help="クラス一覧の列")
+    p.add_argument("--header", type=int, default=None, help="クラス一覧のヘッダ行（無ければ省略）")
+    p.add_argument("--start_row", type=int, default=0, help="クラス一覧の読み始め行")
+    p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
+                   help="対象拡張子（小文字・カンマ区切り）")
+    p.add_argument("--hash-cache", default="hash_cache.sqlite",
+                   help="集計を保存するキャッシュ（SQLite。比較ツールのハッシュキャッシュと共用可）")
+    p.add_argument("--no-hash-cache", dest="hash_cache", action="store_const", const=None,
+                   help="キャッシュを使わない（毎回全走査）")
+    p.add_argument("--full", action="store_true",
+                   help="キャッシュを引かずに全走査し、結果でキャッシュを記録し直す（上書きされたファイルも拾う）")
+    p.add_argument("--workers", type=int, default=8, help="走査の並列数（クラスフォルダ単位）")
+    p.add_argument("--report-sidecar", choices=SIDECAR_FORMATS, default="none",
+                   help="各シートを CSV/Parquet にも出力")
+    return p.parse_args()
+
+
+def read_class_list(args) -> List[str]:
+    """find_dataset_paths_update.py と同じ読み方（空・重複は除く）"""
+    import pandas as pd
+    df = pd.read_excel(args.classes_excel, sheet_name=args.sheet_in, header=args.header, usecols=args.col)
+    col = df.iloc[args.start_row:, 0].dropna().astype(str).str.strip()
+    return list(dict.fromkeys(c for c in col if c))
+
+
+def folder_count(path: str, image_exts: set, cache: Optional[HashCache], full: bool) -> Tuple[Optional[FolderCount], bool]:
+    """1フォルダの集計と、キャッシュで済んだかを返す（読めなければ None）。"""
+    try:
+        key = str(os.stat(path).st_mtime_ns)  # 走査より前に取る（走査中の変更は次回に拾える）
+    except OSError:
+        return None, False
+    if cache is not None and not full:
+        cached = cache.lookup_folder(path, key)
+        if cached is not None:
+            v = json.loads(cached)
+            return FolderCount(v["images"], v["bytes"], v["subdirs"]), True
+    res = scan_dir(path, ".", image_exts)
+    if res is None:
+        return None, False
+    d, subs = res
+    fc = FolderCount(len(d.images), sum(m.size for m in d.images), [os.path.basename(p) for _, p in subs])
+    if cache is not None:
+        cache.store_folder(path, key, json.dumps(fc._asdict(), ensure_ascii=False))
+    return fc, False
+
+
+def count_tree(root: str, image_exts: set, cache: Optional[HashCache], full: bool) -> ClassCount:
+    """root 配下を集計する（未変更のフォルダはキャッシュの子フォルダ名でたどる）。"""
+    images = size = folders = cached = 0
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        fc, hit = folder_count(path, image_exts, cache, full)
+        if fc is None:
+            continue
+        folders += 1
+        cached += hit
+        images += fc.images
+        size += fc.bytes
+        stack.extend(os.path.join(path, name) for name in fc.subdirs)
+    return ClassCount(images, size, folders, cached)
+
+
+def main():
+    args = parse_args()
+    base = Path(args.base)
+    image_exts = {e.strip().lower() for e in args.image_exts.split(",") if e.strip()}
+    if not base.exists():
+        print(f"[ERROR] ベースが存在しません: {base}")
+        sys.exit(1)
+    excel_classes = read_class_list(args) if args.classes_excel else []
+
+    t0 = datetime.now()
+    cache = open_cache(args.hash_cache, algo="census:" + ",".join(sorted(image_exts)))
+
+    # split 直下（クラスフォルダの一覧）もキャッシュ経由で得る
+    jobs: List[Tuple[str, str]] = []
+    for sb in args.subsets:
+        fc, _ = folder_count(str(base / sb), image_exts, cache, args.full)
+        if fc is None:
+            print(f"[WARN] split フォルダがありません: {base / sb}")
+            continue
+        if fc.images:
+            print(f"[WARN] {sb} 直下の画像 {fc.images} files はクラスが決まらないので数えません")
+        jobs.extend((sb, name) for name in fc.subdirs)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        counts = list(ex.map(lambda j: count_tree(str(base / j[0] / j[1]), image_exts, cache, args.full), jobs))
+    if cache is not None:
+        cache.close()
+
+    table: Dict[str, Dict[str, ClassCount]] = {}
+    for (sb, name), c in zip(jobs, counts):
+        table.setdefault(name, {})[sb] = c
+    folders = sum(c.folders for c in counts)
+    cached = sum(c.cached for c in counts)
+    print(f"[INFO] 走査: {len(table)} classes / {folders} folders（キャッシュ {cached} / 走査 {folders - cached}）")
+
+    excel_set = set(excel_classes)
+    order = excel_classes + sorted(n for n in table if n not in excel_set)
+    columns = (["class_name", "in_excel"] + [f"{sb}_{k}" for sb in args.subsets for k in ("images", "bytes")]
+               + ["total_images", "total_bytes", "missing_splits"])
+    rows: List[dict] = []
+    for name in order:
+        per = table.get(name, {})
+        rows.append({
+            "class_name": name,
+            "in_excel": (name in excel_set) if excel_classes else "",
+            **{f"{sb}_images": per[sb].images for sb in args.subsets if sb in per},
+            **{f"{sb}_bytes": per[sb].bytes for sb in args.subsets if sb in per},
+            "total_images": sum(c.images for c in per.values()),
+            "total_bytes": sum(c.bytes for c in per.values()),
+            "missing_splits": ";".join(sb for sb in args.subsets if sb not in per),
+        })
+    split_rows = [[sb, sum(1 for per in table.values() if sb in per),
+                   sum(per[sb].images for per in table.values() if sb in per),
+                   sum(per[sb].bytes for per in table.values() if sb in per)] for sb in args.subsets]
+
+    with ReportWriter(args.excel_out, sidecar=args.report_sidecar) as report:
+        report.write_sheet("Census", columns, rows)
+        report.write_sheet("Splits", ["split", "classes", "images", "bytes"], split_rows)
+
+    for sb, n_cls, n_img, n_bytes in split_rows:
+        print(f"[INFO] {sb}: {n_cls} classes / {n_img} images / {n_bytes} bytes")
+    if excel_classes:
+        absent = [n for n in excel_classes if n not in table]
+        extra = [n for n in table if n not in excel_set]
+        if absent:
+            print(f"[WARN] どの split にも無いクラス: {len(absent)} 件（例: {', '.join(absent[:5])}）")
+        if extra:
+            print(f"[WARN] クラス一覧に無いフォルダ: {len(extra)} 件（例: {', '.join(sorted(extra)[:5])}）")
+    print(f"[INFO] Excel 出力: {args.excel_out}")
+    print(f"[DONE] 終了。処理時間: {datetime.now() - t0}")
+
+
+if __name__ == "__main__":
+    main()
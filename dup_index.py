@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+データセット全体の完全一致（同一バイト列）画像インデックス
+
+<base>/<split>/<class>/... の全画像を内容ハッシュで突き合わせ、
+複数のクラスフォルダ、または複数の split（train/val/test）にまたがって存在する画像を一覧にする。
+train と test に同じ画像があると精度が水増しされ、別クラスに同じ画像があるとラベルが矛盾する。
+
+- サイズが他と重ならない画像は重複し得ないので読まない（サイズ → ハッシュの順に絞る）
+- ハッシュは並列計算し、ハッシュキャッシュ（hash_cache.py）があれば未変更ファイルは読まない
+- sync_manifest.py のマニフェストを --manifest で渡すと、記録済みのハッシュを使い一切読まない
+
+Excel出力
+- Groups：重複グループ（ハッシュ・サイズ・件数・クラス一覧・split 一覧・種別）
+- Files：グループに属する全画像（group_id・split・class・パス）
+- SplitLeaks：split の組ごとのグループ数（train×test 等）
+- ClassPairs：同じ画像を持つクラスの組（ラベル矛盾の候補）
+
+種別（kind）
+- cross_split：2つ以上の split にまたがる
+- cross_class：同じ split 内で2つ以上のクラスにまたがる
+- same_class：同じクラス内の重複のみ（--include-same-class 指定時のみ出力）
+
+例:
+    python dup_index.py --base /srv/datasets --excel-out dup_index.xlsx
+    python dup_index.py --base "\\\\SERVER\\Share\\datasets" --manifest remote_manifest.jsonl.gz
+"""
+
+import sys
+import argparse
+from pathlib import Path
+from datetime import datetime
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple
+
+from hash_cache import open_cache
+from hash_engine import ALGORITHMS, HashEngine
+from report_writer import SIDECAR_FORMATS, ReportWriter
+from sync_manifest import remote_snapshot
+from tree_snapshot import FileMeta, TreeSnapshot
+
+GROUP_COLUMNS = ["group_id", "digest", "size", "copies", "n_splits", "n_classes", "splits", "classes", "kind"]
+FILE_COLUMNS = ["group_id", "split", "class_name", "rel_path", "path", "size", "mtime", "kind"]
+
+
+class Entry(NamedTuple):
+    split: str
+    class_name: str
+    rel_path: str
+    meta: FileMeta
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="データセット全体の完全一致画像インデックス（クラス・split 間の重複検出）")
+    p.add_argument("--base", required=True, help="データセットのベース（<base>/<split>/<class>/...）")
+    p.add_argument("--subsets", nargs="*", default=["train", "val", "test"], help="対象の split フォルダ名")
+    p.add_argument("--excel-out", default="dup_index.xlsx", help="Excel出力先")
+    p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
+                   help="対象拡張子（小文字・カンマ区切り）")
+    p.add_argument("--hash-algo", choices=sorted(ALGORITHMS), default="md5",
+                   help="ハッシュ（比較ツール・マニフェストと揃えるとキャッシュを共有できる）")
+    p.add_argument("--hash-cache", default="hash_cache.sqlite",
+                   help="ハッシュキャッシュ（SQLite）。size/mtime/inode 一致時は再計算しない")
+    p.add_argument("--no-hash-cache", dest="hash_cache", action="store_const", const=None,
+                   help="ハッシュキャッシュを使わない")
+    p.add_argument("--manifest", default=None,
+                   help="sync_manifest.py で作成した --base のマニフェスト。指定時は走査も読み込みもしない")
+    p.add_argument("--workers", type=int, default=8, help="ハッシュ計算の並列数")
+    p.add_argument("--include-same-class", action="store_true",
+                   help="同じクラス内だけの重複も出力する（既定はクラス・split をまたぐものだけ）")
+    p.add_argument("--report-sidecar", choices=SIDECAR_FORMATS, default="none",
+                   help="各シートを CSV/Parquet にも出力")
+    return p.parse_args()
+
+
+def collect_entries(snap: TreeSnapshot, subsets: List[str]) -> List[Entry]:
+    """split 直下のフォルダをクラスとみなす（それより深い画像も最上位のクラスに含める）"""
+    subset_set = set(subsets)
+    entries: List[Entry] = []
+    for rel, d in snap.dirs.items():
+        parts = rel.split("/")
+        if parts[0] not in subset_set or len(parts) < 2:
+            continue  # split 外・split 直下の画像はクラスが決まらないので対象外
+        for m in d.images:
+            entries.append(Entry(parts[0], parts[1], f"{rel}/{m.name}", m))
+    return entries
+
+
+def hash_entries(entries: List[Entry], engine: HashEngine, cache, workers: int) -> List[str]:
+    def digest_of(m: FileMeta) -> str:
+        if m.digest:
+            return m.digest
+        if cache is None:
+            return engine.hexdigest(m.path, allow_mmap=True)
+        return cache.get_or_compute_stat(m.path, m.size, m.mtime_ns, m.inode,
+                                         lambda p: engine.hexdigest(p, allow_mmap=True))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        return list(ex.map(digest_of, (e.meta for e in entries), chunksize=64))
+
+
+def classify(members: List[Entry]) -> str:
+    if len({e.split for e in members}) > 1:
+        return "cross_split"
+    if len({e.class_name for e in members}) > 1:
+        return "cross_class"
+    return "same_class"
+
+
+def main():
+    args = parse_args()
+    base = Path(args.base)
+    image_exts = {e.strip().lower() for e in args.image_exts.split(",") if e.strip()}
+    if not args.manifest and not base.exists():
+        print(f"[ERROR] ベースが存在しません: {base}")
+        sys.exit(1)
+
+    t0 = datetime.now()
+    engine = HashEngine(args.hash_algo)
+    snap = remote_snapshot(base, image_exts, args.manifest, engine.algo)
+    entries = collect_entries(snap, args.subsets)
+    print(f"[INFO] 走査: {len(entries)} files（{', '.join(args.subsets)}）")
+
+    # 1) サイズで絞る：同じサイズが他に無い画像は重複し得ない
+    size_count = Counter(e.meta.size for e in entries)
+    candidates = [e for e in entries if size_count[e.meta.size] > 1]
+    print(f"[INFO] サイズ一致の候補: {len(candidates)} files（残り {len(entries) - len(candidates)} 件は読まない）")
+
+    # 2) 候補だけハッシュ（キャッシュ・マニフェストのハッシュを優先）
+    cache = open_cache(args.hash_cache, algo=engine.algo)
+    digests = hash_entries(candidates, engine, cache, args.workers)
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        cache.close()
+
+    groups: Dict[Tuple[str, int], List[Entry]] = defaultdict(list)
+    unreadable = 0
+    for e, digest in zip(candidates, digests):
+        if not digest:
+            unreadable += 1
+            continue
+        groups[(digest, e.meta.size)].append(e)
+    if unreadable:
+        print(f"[WARN] 読み込めなかった画像: {unreadable} files（重複判定から除外）")
+
+    # 3) グループ化・種別判定
+    group_rows: List[dict] = []
+    file_rows: List[dict] = []
+    split_pairs: Counter = Counter()
+    split_pair_files: Counter = Counter()
+    class_pairs: Counter = Counter()
+    kinds: Counter = Counter()
+    split_order = {sb: i for i, sb in enumerate(args.subsets)}
+    for (digest, size), members in groups.items():
+        if len(members) < 2:
+            continue
+        kind = classify(members)
+        if kind == "same_class" and not args.include_same_class:
+            continue
+        kinds[kind] += 1
+        members.sort(key=lambda e: (split_order[e.split], e.class_name, e.rel_path))
+        gid = len(group_rows) + 1
+        splits = sorted({e.split for e in members}, key=split_order.get)
+        classes = sorted({e.class_name for e in members})
+        group_rows.append({
+            "group_id": gid,
+            "digest": digest,
+            "size": size,
+            "copies": len(members),
+            "n_splits": len(splits),
+            "n_classes": len(classes),
+            "splits": ";".join(splits),
+            "classes": ";".join(classes),
+            "kind": kind,
+        })
+        for e in members:
+            file_rows.append({
+                "group_id": gid,
+                "split": e.split,
+                "class_name": e.class_name,
+                "rel_path": e.rel_path,
+                "path": e.meta.path,
+                "size": e.meta.size,
+                "mtime": e.meta.mtime,
+                "kind": kind,
+            })
+        for i, a in enumerate(splits):
+            for b in splits[i + 1:]:
+                split_pairs[(a, b)] += 1
+                split_pair_files[(a, b)] += sum(1 for e in members if e.split in (a, b))
+        for i, a in enumerate(classes):
+            for b in classes[i + 1:]:
+                class_pairs[(a, b)] += 1
+
+    with ReportWriter(args.excel_out, sidecar=args.report_sidecar) as report:
+        report.write_sheet("Groups", GROUP_COLUMNS, group_rows)
+        report.write_sheet("Files", FILE_COLUMNS, file_rows)
+        report.write_sheet("SplitLeaks", ["split_a", "split_b", "groups", "files"],
+                           [[a, b, n, split_pair_files[(a, b)]] for (a, b), n in split_pairs.most_common()])
+        report.write_sheet("ClassPairs", ["class_a", "class_b", "groups"],
+                           [[a, b, n] for (a, b), n in class_pairs.most_common()])
+
+    print(f"[INFO] 重複グループ: {len(group_rows)} 件（" + " ".join(f"{k}={v}" for k, v in kinds.most_common())
+          + f"）/ 該当画像 {len(file_rows)} files")
+    for (a, b), n in split_pairs.most_common():
+        print(f"[WARN] {a} × {b} に同一画像: {n} groups")
+    print(f"[INFO] Excel 出力: {args.excel_out}")
+    print(f"[DONE] 終了。処理時間: {datetime.now() - t0}")
+
+
+if __name__ == "__main__":
+    main()
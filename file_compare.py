@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+同名ファイルの段階的（ティア）比較
+
+判定は安いものから順に行い、決着した段階（tier）を記録する。
+- size    : サイズ不一致 → Different（読み込みなし）
+- mtime   : サイズ一致かつ mtime 一致 → Same とみなす（rsync 同様。quick モードのみ）
+- sampled : 先頭/中央/末尾ブロックのみ比較し、不一致 → Different（sampled モードのみ）
+- full    : 全体ハッシュで比較
+
+モード
+- full    : size → full
+- quick   : size → mtime → full
+- sampled : size → sampled → full
+"""
+
+import hashlib
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, ContextManager, NamedTuple, Optional, Tuple
+
+from tree_snapshot import FileMeta
+
+COMPARE_MODES = ("full", "quick", "sampled")
+
+TIER_SIZE = "size"
+TIER_MTIME = "mtime"
+TIER_SAMPLED = "sampled"
+TIER_FULL = "full"
+
+SAMPLE_BLOCK = 64 * 1024
+
+# full_hash(meta, side) -> (digest, 実際に読んだバイト数)。キャッシュヒット時は 0 を返す想定
+HashFunc = Callable[[FileMeta, str], Tuple[str, int]]
+
+# gate("local") / gate("remote")：各側の読み込みを囲むコンテキスト（同時実行数の制限用）
+GateFunc = Callable[[str], ContextManager]
+
+
+def _no_gate(side: str) -> ContextManager:
+    return nullcontext()
+
+
+class CompareOutcome(NamedTuple):
+    result: str        # "Same" / "Different"
+    tier: str          # 決着した段階
+    local_hash: str    # full まで進んだ場合のみ
+    remote_hash: str
+    bytes_read: int    # ローカル+リモートで実際に読んだバイト数
+
+
+def sampled_digest(path: Path, size: int, block: int = SAMPLE_BLOCK) -> Tuple[str, int]:
+    """先頭/中央/末尾の各 block バイトのハッシュ。読み出し不可時は ("", 0)。"""
+    h = hashlib.md5()
+    nread = 0
+    offsets = sorted({0, max(0, size // 2 - block // 2), max(0, size - block)})
+    try:
+        with path.open("rb") as f:
+            for off in offsets:
+                f.seek(off)
+                chunk = f.read(block)
+                nread += len(chunk)
+                h.update(chunk)
+        return h.hexdigest(), nread
+    except Exception:
+        return "", nread
+
+
+def compare_pair(lm: FileMeta, rm: FileMeta, mode: str, full_hash: HashFunc,
+                 mtime_window_ns: int = 0, gate: Optional[GateFunc] = None) -> CompareOutcome:
+    """lm / rm はスナップショット取得済みのメタデータ（ここでは stat を発行しない）。"""
+    gate = gate or _no_gate
+    if lm.size != rm.size:
+        return CompareOutcome("Different", TIER_SIZE, "", "", 0)
+
+    if mode == "quick" and abs(lm.mtime_ns - rm.mtime_ns) <= mtime_window_ns:
+        return CompareOutcome("Same", TIER_MTIME, "", "", 0)
+
+    bytes_read = 0
+    # ブロックが重なるほど小さいファイル・リモートのハッシュが既知（マニフェスト）の場合は直接 full で比較
+    if mode == "sampled" and lm.size > 3 * SAMPLE_BLOCK and not rm.digest:
+        with gate("local"):
+            l_s, nl = sampled_digest(Path(lm.path), lm.size)
+        with gate("remote"):
+            r_s, nr = sampled_digest(Path(rm.path), rm.size)
+        bytes_read += nl + nr
+        if l_s and r_s and l_s != r_s:
+            return CompareOutcome("Different", TIER_SAMPLED, "", "", bytes_read)
+
+    with gate("local"):
+        l_hash, nl = full_hash(lm, "local")
+    with gate("remote"):
+        r_hash, nr = full_hash(rm, "remote")
+    bytes_read += nl + nr
+    same = bool(l_hash) and l_hash == r_hash
+    return CompareOutcome("Same" if same else "Different", TIER_FULL, l_hash, r_hash, bytes_read)
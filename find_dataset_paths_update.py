@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import os
 import argparse
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
 import shutil
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
+from apply_journal import ApplyJournal
+
+class FolderStats(NamedTuple):
+    images: int   # 配下（サブフォルダ含む）の画像数
+    bytes: int    # 配下の全ファイルの合計サイズ
+
+# subset → フォルダ名 → 集計（--folder-stats 指定時のみ。既定は None）。各 subset を1回だけ一覧して作る
+SubsetListing = Dict[str, Dict[str, Optional[FolderStats]]]
+
+class PathResult(NamedTuple):
+    subset: str
+    src: Path    # 操作前のパス
+    path: Path   # 操作後のパス（DRY-RUN・失敗時は予定/元のパス）
+    note: str    # このパスについてのメモ（無ければ空）
+
 def extract_middle_token(name: str, strip_trailing_m: bool = True) -> Optional[str]:
     parts = str(name).split("_")
     if len(parts) < 3:
@@ -18,59 +35,104 @@ def extract_middle_token(name: str, strip_trailing_m: bool = True) -> Optional[s
     return mid
 
 def list_dirs_one_level(base: Path) -> List[Path]:
+    # scandir の種別情報を使う（NFS 等でエントリごとの stat を発行しない）
     try:
-        return [p for p in base.iterdir() if p.is_dir()]
+        with os.scandir(base) as it:
+            return [base / e.name for e in it if e.is_dir()]
     except FileNotFoundError:
         return []
 
-def check_paths_exact(base_dir: Path, class_name: str, subsets: List[str]) -> Dict[str, str]:
-    results: Dict[str, str] = {}
+def folder_stats(path: Path, image_exts: Set[str]) -> FolderStats:
+    images = total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                        continue
+                    try:
+                        total += e.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+                    if os.path.splitext(e.name)[1].lower() in image_exts:
+                        images += 1
+        except OSError:
+            continue
+    return FolderStats(images, total)
+
+def list_subsets(base_dir: Path, subsets: List[str], image_exts: Optional[Set[str]], workers: int = 8) -> SubsetListing:
+    # フォルダ名の一覧と（指定時は）各フォルダの画像数・サイズを1パスで集める。集計はフォルダ単位で並列
+    listing: SubsetListing = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for sb in subsets:
+            dirs = list_dirs_one_level(base_dir / sb)
+            if image_exts is None:
+                listing[sb] = {d.name: None for d in dirs}
+            else:
+                listing[sb] = dict(zip((d.name for d in dirs), ex.map(lambda d: folder_stats(d, image_exts), dirs)))
+    return listing
+
+def check_paths_exact(listing: SubsetListing, base_dir: Path, class_name: str, subsets: List[str]) -> Dict[str, str]:
+    return {sb: (str(base_dir / sb / class_name) if class_name in listing.get(sb, {}) else "") for sb in subsets}
+
+def stats_columns(listing: SubsetListing, names: Dict[str, List[str]], subsets: List[str]) -> Dict[str, object]:
+    # 行に対応するフォルダの集計（複数ヒットは合計）。該当なしは空欄
+    cols: Dict[str, object] = {}
     for sb in subsets:
-        candidate = base_dir / sb / class_name
-        results[sb] = str(candidate) if candidate.exists() else ""
-    return results
+        st = [listing.get(sb, {}).get(n) for n in names.get(sb, [])]
+        st = [x for x in st if x is not None]
+        cols[f"{sb}_images"] = sum(x.images for x in st) if st else ""
+        cols[f"{sb}_bytes"] = sum(x.bytes for x in st) if st else ""
+    return cols
 
-def find_dirs_by_middle(base_dir: Path, middle_core: str, subsets: List[str]) -> Dict[str, List[Path]]:
-    results: Dict[str, List[Path]] = {}
+# subset → 真ん中トークン（末尾 m 除去）→ フォルダ。各 subset は1回だけ一覧する
+MiddleIndex = Dict[str, Dict[str, List[Path]]]
+
+def build_middle_index(listing: SubsetListing, base_dir: Path, subsets: List[str]) -> MiddleIndex:
+    index: MiddleIndex = {}
     for sb in subsets:
-        root = base_dir / sb
-        hits: List[Path] = []
-        for d in list_dirs_one_level(root):
-            parts = d.name.split("_")
-            if len(parts) >= 3:
-                mid = parts[1]
-                mid_cmp = mid[:-1] if mid.endswith("m") else mid
-                if mid_cmp == middle_core:
-                    hits.append(d)
-        results[sb] = hits
-    return results
+        by_mid: Dict[str, List[Path]] = {}
+        for name in listing.get(sb, {}):
+            mid = extract_middle_token(name, strip_trailing_m=True)
+            if mid is not None:
+                by_mid.setdefault(mid, []).append(base_dir / sb / name)
+        index[sb] = by_mid
+    return index
+
+def find_dirs_by_middle(index: MiddleIndex, middle_core: str, subsets: List[str]) -> Dict[str, List[Path]]:
+    return {sb: list(index.get(sb, {}).get(middle_core, [])) for sb in subsets}
+
+def update_middle_index(index: MiddleIndex, hits: Dict[str, List[Path]], new_paths: Dict[str, List[Path]]) -> None:
+    # 実際にリネームしたフォルダを索引にも反映（以降のクラスは改名後の名前で探す）
+    for sb, olds in hits.items():
+        by_mid = index.setdefault(sb, {})
+        for old, new in zip(olds, new_paths.get(sb, [])):
+            if old == new:
+                continue
+            lst = by_mid.get(extract_middle_token(old.name, strip_trailing_m=True) or "", [])
+            if old in lst:
+                lst.remove(old)
+            mid = extract_middle_token(new.name, strip_trailing_m=True)
+            if mid is not None:
+                by_mid.setdefault(mid, []).append(new)
 
-def plan_and_maybe_rename(hits: Dict[str, List[Path]], target_name: str, apply: bool) -> Tuple[Dict[str, List[Path]], List[str]]:
-    new_paths: Dict[str, List[Path]] = {}
-    notes: List[str] = []
+def plan_and_maybe_rename(hits: Dict[str, List[Path]], target_name: str, planned: Set[Path]) -> Dict[str, List[PathResult]]:
+    # 計画のみ（実行は run_ops）。planned は計画済みの行き先（同じ名前への改名は最初の1件だけ）
+    results: Dict[str, List[PathResult]] = {}
     for sb, paths in hits.items():
-        updated_list: List[Path] = []
+        out: List[PathResult] = []
         for p in paths:
-            parent = p.parent
-            new_p = parent / target_name
+            new_p = p.parent / target_name
             if p == new_p:
-                updated_list.append(new_p); continue
-            if new_p.exists():
-                notes.append(f"[{sb}] skip: {p.name} -> {target_name} (already exists)")
-                updated_list.append(p); continue
-            if apply:
-                try:
-                    p.rename(new_p)
-                    notes.append(f"[{sb}] renamed: {p.name} -> {target_name}")
-                    updated_list.append(new_p)
-                except Exception as e:
-                    notes.append(f"[{sb}] error: {p.name} -> {target_name} ({e})")
-                    updated_list.append(p)
-            else:
-                notes.append(f"[{sb}] plan: {p.name} -> {target_name}")
-                updated_list.append(new_p)
-        new_paths[sb] = updated_list
-    return new_paths, notes
+                out.append(PathResult(sb, p, new_p, "")); continue
+            if new_p.exists() or new_p in planned:
+                out.append(PathResult(sb, p, p, f"[{sb}] skip: {p.name} -> {target_name} (already exists)")); continue
+            planned.add(new_p)
+            out.append(PathResult(sb, p, new_p, f"[{sb}] plan: {p.name} -> {target_name}"))
+        results[sb] = out
+    return results
 
 def unique_dest_path(dest: Path) -> Path:
     if not dest.exists():
@@ -78,31 +140,157 @@ def unique_dest_path(dest: Path) -> Path:
     ts = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
     return dest.with_name(dest.name + f"_{ts}")
 
-def move_or_plan(paths: Dict[str, List[Path]], move_to: Optional[Path], apply: bool) -> Tuple[Dict[str, List[Path]], List[str]]:
-    notes: List[str] = []
-    moved_paths: Dict[str, List[Path]] = {}
+def move_or_plan(paths: Dict[str, List[Path]], move_to: Optional[Path]) -> Dict[str, List[PathResult]]:
+    # 計画のみ（実行は run_ops）
+    results: Dict[str, List[PathResult]] = {}
     for sb, lst in paths.items():
-        moved_paths[sb] = []
+        out: List[PathResult] = []
         for p in lst:
             if move_to is None:
-                notes.append(f"[{sb}] plan move (no --move-to): {p.name}")
-                moved_paths[sb].append(p)
+                out.append(PathResult(sb, p, p, f"[{sb}] plan move (no --move-to): {p.name}"))
                 continue
-            dest_root = move_to / sb
-            dest_root.mkdir(parents=True, exist_ok=True)
-            dest = unique_dest_path(dest_root / p.name)
-            if apply:
-                try:
-                    shutil.move(str(p), str(dest))
-                    notes.append(f"[{sb}] moved: {p} -> {dest}")
-                    moved_paths[sb].append(dest)
-                except Exception as e:
-                    notes.append(f"[{sb}] error move: {p.name} ({e})")
-                    moved_paths[sb].append(p)
-            else:
-                notes.append(f"[{sb}] plan move: {p} -> {dest}")
-                moved_paths[sb].append(dest)
-    return moved_paths, notes
+            dest = unique_dest_path(move_to / sb / p.name)
+            out.append(PathResult(sb, p, dest, f"[{sb}] plan move: {p} -> {dest}"))
+        results[sb] = out
+    return results
+
+# ジャーナルの plan レコードのキー（同期用の PLAN_KEYS とは別）
+FSOP_KEYS = ("kind", "subset", "src", "dst")
+
+class FsOp(NamedTuple):
+    kind: str     # "RENAME"（同じ subset 内）/ "MOVE"（別ボリュームならコピー＋削除）
+    subset: str
+    src: Path
+    dst: Path
+
+def op_groups(ops: List[FsOp]) -> List[List[int]]:
+    # 同じパスに触る操作（A->B と B->C 等）は同じグループにして計画順に直列、グループ同士は並列
+    parent = list(range(len(ops)))
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    owner: Dict[Path, int] = {}
+    for i, op in enumerate(ops):
+        for p in (op.src, op.dst):
+            parent[find(i)] = find(owner.setdefault(p, i))
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(ops)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+class SkipOp(Exception):
+    # 実行時の状態から対象外と分かった操作（失敗ではないので同じグループの後続は止めない）
+    pass
+
+def run_op(op: FsOp) -> None:
+    if op.dst.exists():
+        raise FileExistsError(f"destination exists: {op.dst}")
+    if op.kind == "RENAME":
+        op.src.rename(op.dst)
+    else:
+        op.dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(op.src), str(op.dst))
+
+def run_ops(ops: List[FsOp], journal_path: Path, workers: int, meta: Optional[dict] = None,
+            run: Callable[[FsOp], None] = run_op) -> List[str]:
+    # ジャーナルに全件の計画を書いてから実行（各操作の前に begin、後に done）。戻り値は操作ごとのエラー（成功は空）
+    journal = ApplyJournal(journal_path, fsync_every=1, keys=FSOP_KEYS)
+    journal.start([{"kind": op.kind, "subset": op.subset, "src": str(op.src), "dst": str(op.dst)} for op in ops],
+                  meta=meta)
+    errors = [""] * len(ops)
+    def run_group(idx: List[int]) -> None:
+        for k, i in enumerate(idx):
+            journal.begin(i)
+            try:
+                run(ops[i])
+                journal.done(i)
+            except SkipOp as e:
+                errors[i] = str(e)
+                journal.done(i, ok=False, error=str(e))
+            except Exception as e:
+                errors[i] = str(e)
+                journal.done(i, ok=False, error=repr(e))
+                for j in idx[k + 1:]:  # 後続は前提が崩れているので実行しない
+                    errors[j] = f"skipped: earlier operation failed ({ops[i].src.name})"
+                return
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        list(ex.map(run_group, op_groups(ops)))
+    journal.end()
+    return errors
+
+def journal_path_of(p: Path) -> Path:
+    # ジャーナル・実行用の絶対パス（--undo は別の場所から実行され得る）。親だけ解決し、名前がリンクでもたどらない
+    return p.parent.resolve() / p.name
+
+def settled(p: Path, undone: Dict[Path, Path]) -> Path:
+    # 失敗した操作（行き先 → 元）をたどって、計画上のパスのフォルダが実際にある場所を返す
+    seen: Set[Path] = set()
+    while p in undone and p not in seen:
+        seen.add(p)
+        p = undone[p]
+    return p
+
+def applied(r: PathResult, kind: str, outcome: Dict[tuple, str], undone: Dict[Path, Path]) -> PathResult:
+    # 実行結果をパス・メモに反映（実行していないものはそのまま）
+    if (r.src, r.path) not in outcome:
+        return r
+    err = outcome[(r.src, r.path)]
+    if kind == "RENAME":
+        if err:
+            return PathResult(r.subset, r.src, settled(r.src, undone),
+                              f"[{r.subset}] error: {r.src.name} -> {r.path.name} ({err})")
+        return r._replace(note=f"[{r.subset}] renamed: {r.src.name} -> {r.path.name}")
+    if err:
+        return PathResult(r.subset, r.src, settled(r.src, undone), f"[{r.subset}] error move: {r.src.name} ({err})")
+    return r._replace(note=f"[{r.subset}] moved: {r.src} -> {r.path}")
+
+UNDO_DONE = "already at source"
+UNDO_BOTH = "both source and destination exist"
+UNDO_MISSING = "neither source nor destination exists"
+
+def undo_op(op: FsOp) -> None:
+    # op は逆向き（src = 元の行き先）。連鎖（A->B->C）では前の戻しが済んでから状態を見る
+    if not op.src.exists():
+        raise SkipOp(UNDO_DONE if op.dst.exists() else UNDO_MISSING)
+    if op.dst.exists():
+        raise SkipOp(UNDO_BOTH)
+    run_op(op)
+
+def undo_journal(journal_path: Path, workers: int) -> None:
+    # 成功した（または実行中に落ちた）操作を計画の逆順に戻す。失敗した操作は戻さない
+    state = ApplyJournal.load(journal_path)
+    if state is None:
+        raise FileNotFoundError(f"ジャーナルが見つかりません: {journal_path}")
+    if state.plan and "src" not in state.plan[0]:
+        raise ValueError(f"リネーム・移動のジャーナルではありません: {journal_path}")
+    touched = (state.done - state.failed) | state.in_flight
+    inverse = [FsOp(r["kind"], r["subset"], Path(r["dst"]), Path(r["src"]))
+               for r in reversed(state.plan) if r["i"] in touched]
+    if not any(op.src.exists() for op in inverse):
+        # 戻す対象が1つも無い（戻し済み等）。直前の戻しのジャーナルは上書きしない
+        missing = [op for op in inverse if not op.dst.exists()]
+        for op in missing:
+            print(f"[WARN] 元も行き先もありません（手動で確認してください）: {op.dst} / {op.src}")
+        print(f"[INFO] 戻す操作はありません: {journal_path}" + (f"（戻せない操作 {len(missing)} 件）" if missing else ""))
+        return
+    undo_path = journal_path.with_name(journal_path.stem + ".undo" + journal_path.suffix)
+    errors = run_ops(inverse, undo_path, workers, meta={"undo_of": str(journal_path)}, run=undo_op)
+    missing = 0
+    for op, err in zip(inverse, errors):
+        if err == UNDO_MISSING:
+            missing += 1
+            print(f"[WARN] 元も行き先もありません（手動で確認してください）: {op.dst} / {op.src}")
+        elif err == UNDO_BOTH:
+            print(f"[WARN] 元と行き先の両方があります（移動が途中で止まった？手動で確認してください）: {op.dst} / {op.src}")
+        elif err and err != UNDO_DONE:
+            print(f"[ERROR] {op.src} -> {op.dst} ({err})")
+    if missing:
+        print(f"[WARN] 戻せない操作: {missing} 件")
+    ok = sum(1 for e in errors if not e)
+    total = sum(1 for e in errors if e != UNDO_DONE)
+    print(f"[DONE] {ok}/{total} 件を元に戻しました（ジャーナル: {undo_path}）")
 
 def find_unlisted_dirs(base_dir: Path, subsets: List[str], protected_names: Set[str], exclude_paths: Set[Path]) -> Dict[str, List[Path]]:
     results: Dict[str, List[Path]] = {}
@@ -120,8 +308,8 @@ def find_unlisted_dirs(base_dir: Path, subsets: List[str], protected_names: Set[
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--excel", required=True)
-    parser.add_argument("--base", required=True)
+    parser.add_argument("--excel")
+    parser.add_argument("--base")
     parser.add_argument("--sheet_in", default="sheet1")
     parser.add_argument("--sheet_out", default="out")
     parser.add_argument("--col", default="A")
@@ -135,13 +323,31 @@ def main():
     g2 = parser.add_mutually_exclusive_group()
     g2.add_argument("--move-apply", action="store_true", help="移動を実行（--move-to が必要）")
     g2.add_argument("--move-dry-run", action="store_true", help="移動もDRY-RUN（既定）")
+    parser.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
+                        help="画像数として数える拡張子（小文字・カンマ区切り）")
+    parser.add_argument("--folder-stats", action="store_true",
+                        help="フォルダごとの画像数・サイズも出力する（配下の全ファイルを stat するので NFS/SMB では遅い。"
+                             "既定は一覧のみ。頭数調べは dataset_census.py の方が速い）")
+    parser.add_argument("--workers", type=int, default=8, help="フォルダ集計の並列数")
+    parser.add_argument("--op-workers", type=int, default=4,
+                        help="リネーム・移動の並列数（同じパスに触る操作どうしは順に実行）")
+    parser.add_argument("--journal", default=None,
+                        help="リネーム・移動のジャーナル（既定: <excel>.fsops.jsonl。実行ごとに上書き）")
+    parser.add_argument("--undo", metavar="JOURNAL", default=None,
+                        help="ジャーナルに記録された前回のリネーム・移動を元に戻して終了（--excel/--base 不要）")
     args = parser.parse_args()
 
+    if args.undo:
+        undo_journal(Path(args.undo), args.op_workers)
+        return
+    if not args.excel or not args.base:
+        parser.error("--excel と --base を指定してください（--undo 以外）")
+
     excel_path = Path(args.excel)
-    base_dir = Path(args.base)
+    base_dir = Path(args.base)  # レポートには指定どおりのパスを出す（ジャーナルには journal_path_of で絶対パス）
     do_apply = bool(args.apply)
     do_move_apply = bool(args.move_apply)
-    move_to = Path(args.move_to).resolve() if args.move_to else None
+    move_to = Path(args.move_to) if args.move_to else None
 
     if not excel_path.exists():
         raise FileNotFoundError(f"Excelが見つかりません: {excel_path}")
@@ -163,46 +369,64 @@ def main():
     exclude_paths_for_move: Set[Path] = set()
 
     records: List[Dict[str, str]] = []
+    image_exts = None if not args.folder_stats else {e.strip().lower() for e in args.image_exts.split(",") if e.strip()}
+    listing = list_subsets(base_dir, args.subsets, image_exts, args.workers)
+    middle_index: Optional[MiddleIndex] = None  # 完全一致しないクラスが出た時点で作る
+    planned_dsts: Set[Path] = set()
+    rename_rows: List[tuple] = []  # (record, 改名計画)。実行後にパス・メモを確定する
+    planned_rows: List[tuple] = []  # (record, subset)。改名予定の名前に完全一致した行（改名失敗時に直す）
 
     for cls in df_all["class_name"]:
-        exact = check_paths_exact(base_dir, cls, args.subsets)
+        exact = check_paths_exact(listing, base_dir, cls, args.subsets)
         found_exact = any(exact[sb] for sb in args.subsets)
         if found_exact:
-            for sb in args.subsets:
-                if exact[sb]:
-                    exclude_paths_for_move.add(Path(exact[sb]))
-            records.append({
+            record = {
                 "input_name": cls,
                 "used_query": cls,
                 **{f"{sb}_path": exact.get(sb, "") for sb in args.subsets},
+                **stats_columns(listing, {sb: [cls] for sb in args.subsets if exact[sb]}, args.subsets),
                 "status": "FOUND_ORIGINAL",
                 "note": "",
-            })
+            }
+            for sb in args.subsets:
+                if exact[sb]:
+                    exclude_paths_for_move.add(Path(exact[sb]))
+                    if Path(exact[sb]) in planned_dsts:
+                        planned_rows.append((record, sb))
+            records.append(record)
             continue
 
         middle_core = extract_middle_token(cls, strip_trailing_m=True)
         if middle_core:
-            hits = find_dirs_by_middle(base_dir, middle_core, args.subsets)
+            if middle_index is None:
+                middle_index = build_middle_index(listing, base_dir, args.subsets)
+            hits = find_dirs_by_middle(middle_index, middle_core, args.subsets)
             found_mid = any(hits[sb] for sb in args.subsets)
             if found_mid:
                 for sb in args.subsets:
                     for p in hits.get(sb, []):
                         exclude_paths_for_move.add(p)
-                new_paths, notes = plan_and_maybe_rename(hits, cls, apply=do_apply)
+                renamed = plan_and_maybe_rename(hits, cls, planned_dsts)
+                new_paths = {sb: [r.path for r in res] for sb, res in renamed.items()}
+                stats = stats_columns(listing, {sb: [r.src.name for r in res] for sb, res in renamed.items()},
+                                      args.subsets)
+                if do_apply:
+                    update_middle_index(middle_index, hits, new_paths)
+                    for sb, res in renamed.items():
+                        for r in res:
+                            if r.path != r.src:
+                                listing[sb][r.path.name] = listing[sb].pop(r.src.name, None)
                 status = "FOUND_BY_MIDDLE_RENAMED" if do_apply else "FOUND_BY_MIDDLE_DRYRUN"
-                records.append({
-                    "input_name": cls,
-                    "used_query": f"MIDDLE:{middle_core}",
-                    **{f"{sb}_path": ";".join(str(p) for p in new_paths.get(sb, [])) for sb in args.subsets},
-                    "status": status,
-                    "note": " | ".join(notes),
-                })
+                record = {"input_name": cls, "used_query": f"MIDDLE:{middle_core}", **stats, "status": status}
+                records.append(record)
+                rename_rows.append((record, renamed))
                 continue
 
         records.append({
             "input_name": cls,
             "used_query": "",
             **{f"{sb}_path": "" for sb in args.subsets},
+            **stats_columns(listing, {}, args.subsets),
             "status": "NOT_FOUND_ALL",
             "note": "",
         })
@@ -219,23 +443,56 @@ def main():
             lst.append(d)
         unlisted[sb] = lst
 
-    moved_preview, move_notes = move_or_plan(unlisted, move_to=move_to, apply=do_move_apply)
+    moved = move_or_plan(unlisted, move_to=move_to)
 
-    for sb, paths in moved_preview.items():
-        for p in paths:
-            status = "MOVED" if do_move_apply else "MOVE_CANDIDATE_DRYRUN"
-            note_msgs = [n for n in move_notes if f"[{sb}]" in n and (p.name in n or str(p) in n)]
+    planned_ops: List[tuple] = []  # (kind, 計画)
+    if do_apply:
+        planned_ops += [("RENAME", r) for _, renamed in rename_rows for res in renamed.values() for r in res
+                        if r.path != r.src]
+    if do_move_apply:
+        planned_ops += [("MOVE", r) for res in moved.values() for r in res if r.path != r.src]
+    outcome: Dict[tuple, str] = {}
+    undone: Dict[Path, Path] = {}  # 失敗した操作の 行き先 → 元
+    if planned_ops:
+        ops = [FsOp(kind, r.subset, journal_path_of(r.src), journal_path_of(r.path)) for kind, r in planned_ops]
+        journal_path = Path(args.journal) if args.journal else excel_path.with_suffix(".fsops.jsonl")
+        print(f"[INFO] リネーム・移動 {len(ops)} 件を実行（並列 {args.op_workers}、ジャーナル: {journal_path}）")
+        errors = run_ops(ops, journal_path, args.op_workers,
+                         meta={"base": str(journal_path_of(base_dir)), "excel": str(excel_path.resolve()),
+                               "created": dt.datetime.now().isoformat(timespec="seconds")})
+        outcome = {(r.src, r.path): err for (_, r), err in zip(planned_ops, errors)}
+        undone = {r.path: r.src for (_, r), err in zip(planned_ops, errors) if err}
+        print(f"[INFO] 失敗 {sum(1 for e in errors if e)} 件。元に戻す: --undo {journal_path}")
+
+    for record, renamed in rename_rows:
+        renamed = {sb: [applied(r, "RENAME", outcome, undone) for r in res] for sb, res in renamed.items()}
+        record.update({f"{sb}_path": ";".join(str(r.path) for r in renamed.get(sb, [])) for sb in args.subsets})
+        record["note"] = " | ".join(r.note for res in renamed.values() for r in res if r.note)
+    for record, sb in planned_rows:
+        # 改名後の名前で見つけた行：改名が失敗していれば、フォルダは元の名前のまま
+        p = Path(record[f"{sb}_path"])
+        if p in undone:
+            record[f"{sb}_path"] = str(settled(p, undone))
+            note = f"[{sb}] error: rename to {p.name} failed (still {settled(p, undone).name})"
+            record["note"] = " | ".join(n for n in (record["note"], note) if n)
+    moved = {sb: [applied(r, "MOVE", outcome, undone) for r in res] for sb, res in moved.items()}
+
+    status = "MOVED" if do_move_apply else "MOVE_CANDIDATE_DRYRUN"
+    for sb, results in moved.items():
+        for r in results:
             records.append({
-                "input_name": p.name,
+                "input_name": r.path.name,
                 "used_query": "MOVE_SCAN",
-                **{f"{s}_path": (str(p) if s == sb else "") for s in args.subsets},
+                **{f"{s}_path": (str(r.path) if s == sb else "") for s in args.subsets},
+                **stats_columns(listing, {sb: [r.src.name]}, args.subsets),
                 "status": status,
-                "note": " | ".join(note_msgs) if note_msgs else "",
+                "note": r.note,
             })
 
+    stat_cols = [] if not args.folder_stats else [f"{sb}_{k}" for sb in args.subsets for k in ("images", "bytes")]
     out_df = pd.DataFrame.from_records(
         records,
-        columns=["input_name", "used_query"] + [f"{sb}_path" for sb in args.subsets] + ["status", "note"]
+        columns=["input_name", "used_query"] + [f"{sb}_path" for sb in args.subsets] + stat_cols + ["status", "note"]
     )
 
     with pd.ExcelWriter(excel_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
@@ -247,9 +504,14 @@ def main():
 
 if __name__ == "__main__":
     main()
-python find_dataset_paths_move.py \
-  --excel /path/to/workbook.xlsx \
-  --base /srv/datasets \
-  --apply \
-  --move-to /srv/quarantine \
-  --move-apply
+
+# 使用例
+# python find_dataset_paths_update.py \
+#   --excel /path/to/workbook.xlsx \
+#   --base /srv/datasets \
+#   --apply \
+#   --move-to /srv/quarantine \
+#   --move-apply
+#
+# 直前の実行のリネーム・移動を元に戻す
+# python find_dataset_paths_update.py --undo /path/to/workbook.fsops.jsonl
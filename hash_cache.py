@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+画像ハッシュの永続キャッシュ（SQLite）
+
+- キー：パス + アルゴリズム。size / mtime_ns / inode が一致した場合のみヒット
+- ヒット時はファイル内容を一切読まない（stat のみ）
+- ヒット/ミス数を計数
+- invalidate（パス前方一致で削除）/ prune（消えたファイル・古いエントリの削除）
+- checked_at は最終確認時刻：ヒットでも更新する（TOUCH_AFTER_SEC より古いものだけ。
+  書き込みは store と同じく commit_every 件ごとにまとめる）。prune --older-than-days は
+  「しばらくヒットしていない」エントリを消し、毎日ヒットする安定したツリーの分は残る
+- フォルダダイジェスト（merkle.py）：フォルダ直下の一覧署名（名前・size・mtime_ns・inode）が
+  一致した場合のみヒット。未変更フォルダは配下のファイルを1件ずつ照合しない
+
+単体でも保守用に実行可能：
+    python hash_cache.py stats --db hash_cache.sqlite
+    python hash_cache.py prune --db hash_cache.sqlite --older-than-days 30
+    python hash_cache.py invalidate --db hash_cache.sqlite --prefix "\\\\SERVER\\Share\\remote folder"
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+PathLike = Union[str, Path]
+
+TOUCH_AFTER_SEC = 86400  # ヒット時に checked_at を更新する間隔（毎回は書かない）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hash (
+    path       TEXT    NOT NULL,
+    algo       TEXT    NOT NULL,
+    size       INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    inode      INTEGER NOT NULL,
+    digest     TEXT    NOT NULL,
+    checked_at REAL    NOT NULL,
+    PRIMARY KEY (path, algo)
+)
+"""
+
+_FOLDER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folder_digest (
+    path       TEXT    NOT NULL,
+    algo       TEXT    NOT NULL,
+    listing    TEXT    NOT NULL,
+    digest     TEXT    NOT NULL,
+    checked_at REAL    NOT NULL,
+    PRIMARY KEY (path, algo)
+)
+"""
+
+
+class HashCache:
+    """path/size/mtime_ns/inode をキーにしたハッシュ値のキャッシュ。スレッドセーフ。"""
+
+    def __init__(self, db_path: PathLike, algo: str = "md5", commit_every: int = 500):
+        self.db_path = str(db_path)
+        self.algo = algo
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.folder_hits = 0
+        self.folder_misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.execute(_FOLDER_SCHEMA)
+        self._conn.commit()
+
+    # --- 基本操作 ---
+    def lookup(self, path: PathLike, size: int, mtime_ns: int, inode: int, count: bool = True) -> Optional[str]:
+        """
+        stat 情報が一致するキャッシュ値を返す（不一致・未登録は None）。
+        count=False は同じファイルを別のキーで引き直すとき用（ヒット・ミスの件数に数えない）。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, digest, checked_at FROM file_hash WHERE path = ? AND algo = ?",
+                (os.fspath(path), self.algo),
+            ).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime_ns and row[2] == inode:
+                self.hits += count
+                self._touch("file_hash", path, row[4])
+                return row[3]
+            self.misses += count
+            return None
+
+    def _touch(self, table: str, path: PathLike, checked_at: float) -> None:
+        """ヒットしたエントリの最終確認時刻を更新する（ロック保持中に呼ぶ）"""
+        now = time.time()
+        if now - checked_at < TOUCH_AFTER_SEC:
+            return
+        self._conn.execute(f"UPDATE {table} SET checked_at = ? WHERE path = ? AND algo = ?",
+                           (now, os.fspath(path), self.algo))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._conn.commit()
+            self._pending = 0
+
+    def store(self, path: PathLike, size: int, mtime_ns: int, inode: int, digest: str) -> None:
+        if not digest:
+            return  # 読み出し失敗は記録しない
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hash VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.fspath(path), self.algo, size, mtime_ns, inode, digest, time.time()),
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def get_or_compute(self, path: PathLike, compute: Callable[[Path], str]) -> str:
+        """stat → キャッシュ照合 → ミス時のみ compute(path) で内容を読む。"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return compute(Path(path))  # 従来どおり compute 側のエラー処理に任せる
+        return self.get_or_compute_stat(path, st.st_size, st.st_mtime_ns, st.st_ino, compute)
+
+    def get_or_compute_stat(self, path: PathLike, size: int, mtime_ns: int, inode: int,
+                            compute: Callable[[Path], str]) -> str:
+        """取得済みの stat 情報（スナップショット等）で照合する版。stat を発行しない。"""
+        cached = self.lookup(path, size, mtime_ns, inode)
+        if cached is not None:
+            return cached
+        digest = compute(Path(path))
+        self.store(path, size, mtime_ns, inode, digest)
+        return digest
+
+    # --- フォルダダイジェスト ---
+    def lookup_folder(self, path: PathLike, listing: str) -> Optional[str]:
+        """一覧署名が一致するフォルダダイジェストを返す（不一致・未登録は None）。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT listing, digest, checked_at FROM folder_digest WHERE path = ? AND algo = ?",
+                (os.fspath(path), self.algo),
+            ).fetchone()
+            if row is not None and row[0] == listing:
+                self.folder_hits += 1
+                self._touch("folder_digest", path, row[2])
+                return row[1]
+            self.folder_misses += 1
+            return None
+
+    def store_folder(self, path: PathLike, listing: str, digest: str) -> None:
+        if not digest:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO folder_digest VALUES (?, ?, ?, ?, ?)",
+                (os.fspath(path), self.algo, listing, digest, time.time()),
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    # --- 保守 ---
+    def invalidate(self, prefix: Optional[PathLike] = None) -> int:
+        """prefix 配下（None なら全件）のエントリを削除し、削除件数を返す。"""
+        with self._lock:
+            if prefix is None:
+                self._conn.execute("DELETE FROM folder_digest WHERE algo = ?", (self.algo,))
+                cur = self._conn.execute("DELETE FROM file_hash WHERE algo = ?", (self.algo,))
+            else:
+                p = os.fspath(prefix)
+                like = p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                self._conn.execute(
+                    "DELETE FROM folder_digest WHERE algo = ? AND path LIKE ? ESCAPE '\\'",
+                    (self.algo, like),
+                )
+                cur = self._conn.execute(
+                    "DELETE FROM file_hash WHERE algo = ? AND path LIKE ? ESCAPE '\\'",
+                    (self.algo, like),
+                )
+            self._conn.commit()
+            return cur.rowcount
+
+    def prune(self, older_than_days: Optional[float] = None, drop_missing: bool = True) -> int:
+        """
+        不要エントリを削除する。
+        - older_than_days：最終確認（ヒットも含む。TOUCH_AFTER_SEC 単位）からこの日数を超えたもの
+        - drop_missing：ファイルが存在しない / stat が変わったもの（stat を1回ずつ発行）
+        """
+        removed = 0
+        with self._lock:
+            if older_than_days is not None:
+                limit = time.time() - older_than_days * 86400
+                cur = self._conn.execute("DELETE FROM file_hash WHERE checked_at < ?", (limit,))
+                removed += cur.rowcount
+                cur = self._conn.execute("DELETE FROM folder_digest WHERE checked_at < ?", (limit,))
+                removed += cur.rowcount
+            if drop_missing:
+                stale = []
+                for path, algo, size, mtime_ns, inode in self._conn.execute(
+                        "SELECT path, algo, size, mtime_ns, inode FROM file_hash"):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        stale.append((path, algo))
+                        continue
+                    if (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, inode):
+                        stale.append((path, algo))
+                self._conn.executemany("DELETE FROM file_hash WHERE path = ? AND algo = ?", stale)
+                removed += len(stale)
+            self._conn.commit()
+        return removed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM file_hash").fetchone()[0]
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"hit={self.hits} miss={self.misses} ({rate:.1f}% hit)"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_cache(db_path: Optional[PathLike], algo: str = "md5") -> Optional[HashCache]:
+    """db_path が空/None のときはキャッシュ無効（None）を返す。"""
+    if not db_path:
+        return None
+    return HashCache(db_path, algo=algo)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="ハッシュキャッシュ（SQLite）の保守")
+    p.add_argument("command", choices=["stats", "prune", "invalidate"])
+    p.add_argument("--db", default="hash_cache.sqlite", help="キャッシュDBファイル")
+    p.add_argument("--algo", default="md5", help="対象アルゴリズム")
+    p.add_argument("--older-than-days", type=float, default=None,
+                   help="prune：最終確認からこの日数を超えたエントリを削除")
+    p.add_argument("--keep-missing", action="store_true",
+                   help="prune：存在しないファイルのエントリを残す（stat を発行しない）")
+    p.add_argument("--prefix", default=None, help="invalidate：このパス配下のみ削除（省略時は全件）")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not Path(args.db).exists():
+        print(f"[ERROR] キャッシュDBが存在しません: {args.db}")
+        sys.exit(1)
+
+    with HashCache(args.db, algo=args.algo) as cache:
+        if args.command == "stats":
+            print(f"[INFO] {args.db}: {cache.count()} entries")
+        elif args.command == "prune":
+            n = cache.prune(older_than_days=args.older_than_days, drop_missing=not args.keep_missing)
+            print(f"[INFO] prune: {n} entries removed")
+        else:
+            n = cache.invalidate(args.prefix)
+            print(f"[INFO] invalidate: {n} entries removed")
+
+
+if __name__ == "__main__":
+    main()
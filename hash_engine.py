@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+ファイルハッシュ計算エンジン
+
+- 読み込みバッファはスレッドごとに1つだけ確保し、readinto + memoryview で使い回す
+  （従来の iter(lambda: f.read(...)) はチャンクごとに bytes を新規確保していた）
+- アルゴリズム選択：md5 / sha1 / sha256 / blake2b / blake2s（xxhash があれば xxh3_64 / xxh3_128 も）
+- ローカルの大きなファイルは mmap で一括 update（SMB 等のリモートでは使わない）
+
+結果の比較可能性のため、使用アルゴリズム名（HashEngine.algo）を必ず出力に記録すること。
+"""
+
+import mmap
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Tuple, Union
+
+try:
+    import xxhash  # 任意（pip install xxhash）
+except ImportError:
+    xxhash = None
+
+PathLike = Union[str, Path]
+
+ALGORITHMS: Dict[str, Callable] = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+    "blake2s": hashlib.blake2s,
+}
+if xxhash is not None:
+    ALGORITHMS["xxh3_64"] = xxhash.xxh3_64
+    ALGORITHMS["xxh3_128"] = xxhash.xxh3_128
+
+DEFAULT_CHUNK = 1024 * 1024
+DEFAULT_MMAP_THRESHOLD = 32 * 1024 * 1024
+
+
+class HashEngine:
+    """スレッドセーフ（バッファはスレッドローカル）。"""
+
+    def __init__(self, algo: str = "md5", chunk_size: int = DEFAULT_CHUNK,
+                 mmap_threshold: int = DEFAULT_MMAP_THRESHOLD):
+        if algo not in ALGORITHMS:
+            raise ValueError(f"未対応のハッシュアルゴリズム: {algo}（対応: {', '.join(ALGORITHMS)}）")
+        self.algo = algo
+        self.chunk_size = chunk_size
+        self.mmap_threshold = mmap_threshold
+        self._new = ALGORITHMS[algo]
+        self._local = threading.local()
+
+    def _buffer(self) -> memoryview:
+        mv = getattr(self._local, "mv", None)
+        if mv is None:
+            mv = self._local.mv = memoryview(bytearray(self.chunk_size))
+        return mv
+
+    def hash_path(self, path: PathLike, allow_mmap: bool = False) -> Tuple[str, int]:
+        """(hexdigest, 読んだバイト数) を返す。読み出し不可時は ("", 読めた分)。"""
+        h = self._new()
+        nread = 0
+        try:
+            with open(path, "rb", buffering=0) as f:
+                if allow_mmap:
+                    size = f.seek(0, 2)
+                    f.seek(0)
+                    if size >= self.mmap_threshold:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                            h.update(m)
+                        return h.hexdigest(), size
+                mv = self._buffer()
+                while True:
+                    n = f.readinto(mv)
+                    if not n:
+                        break
+                    h.update(mv[:n])
+                    nread += n
+            return h.hexdigest(), nread
+        except Exception:
+            return "", nread
+
+    def hexdigest(self, path: PathLike, allow_mmap: bool = False) -> str:
+        return self.hash_path(path, allow_mmap)[0]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+ハッシュ計算用スレッドプール（ローカル/リモートで別々の同時読み込み上限）
+
+- 比較ジョブはプール上で並列実行し、結果は投入順で返す（Excel の並びが毎回同じになる）
+- 実際の読み込みは gate("local") / gate("remote") の内側で行う
+  → NAS には多数並列、ローカル SSD は少数並列、のように個別に制限できる
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, ContextManager, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+SIDES = ("local", "remote")
+
+
+class HashPool:
+    def __init__(self, local_workers: int = 4, remote_workers: int = 8):
+        if local_workers < 1 or remote_workers < 1:
+            raise ValueError("local_workers / remote_workers は 1 以上を指定してください")
+        self._gates = {
+            "local": threading.BoundedSemaphore(local_workers),
+            "remote": threading.BoundedSemaphore(remote_workers),
+        }
+        # 片側の読み込み待ちでもう片側が止まらないよう、合計数のスレッドを用意
+        self._executor = ThreadPoolExecutor(max_workers=local_workers + remote_workers,
+                                            thread_name_prefix="hash")
+
+    def gate(self, side: str) -> ContextManager:
+        """side 側の読み込み枠（with で使う）。"""
+        return self._gates[side]
+
+    def map_ordered(self, fn: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+        """fn を並列実行し、items の順序どおりに結果を返す。"""
+        return self._executor.map(fn, items)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
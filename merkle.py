@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+フォルダダイジェスト（Merkle 風）による未変更サブツリーの判定
+
+- フォルダダイジェスト：直下の画像の (名前, size, ハッシュ) を名前順に並べたもののハッシュ。
+  名前はファイルの突き合わせ（DirSnapshot.index）と同じく小文字にそろえる
+  （大文字小文字を区別しない SMB 共有で、大小の違いだけで不一致にしない）
+- サブツリーの一致：子フォルダ名の集合とフォルダダイジェストが一致し、子フォルダも全て一致
+  （子の (名前, ダイジェスト) を親に積む Merkle ツリーのダイジェスト比較と同じ判定）
+- フォルダダイジェストは一覧署名（名前・size・mtime_ns・inode）をキーに HashCache に保存し、
+  次回は一覧が変わっていなければ配下のファイルを1件ずつ照合せずに再利用する
+- マニフェスト由来の側はファイルのハッシュが既知なので、その場で計算する（キャッシュ不要）
+
+比較は上から行い、サブツリーが一致するフォルダの配下には降りない。
+両側のダイジェストを全部作ってから比べるのではなく、子フォルダ名の集合 → 名前・サイズ →
+フォルダダイジェスト → 子フォルダ の順に比べ、不一致が分かった時点で打ち切る
+（片側にしか無いフォルダの画像は読まない）。
+読めなかったファイルを含むフォルダはダイジェスト無し（常に不一致）として扱う。
+"""
+
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from hash_cache import HashCache
+from hash_engine import ALGORITHMS
+from tree_snapshot import DirSnapshot, FileMeta, TreeSnapshot
+
+# (側, 画像一覧) → 各画像のハッシュ（読めなければ空文字）
+HashFiles = Callable[[str, List[FileMeta]], List[str]]
+
+# キャッシュのキーに付ける形式名（ダイジェストの作り方を変えたら更新し、古いキャッシュを使わない）
+_DIGEST_FORMAT = "ci1"
+
+
+def name_key(m: FileMeta) -> str:
+    """突き合わせ用の名前（DirSnapshot.index と同じ小文字化）"""
+    return m.name.lower()
+
+
+def listing_signature(d: DirSnapshot) -> str:
+    """フォルダ直下の一覧署名（内容は読まない。stat 情報のみ）"""
+    h = hashlib.sha1()
+    for m in d.images:
+        h.update(f"{m.name}\0{m.size}\0{m.mtime_ns}\0{m.inode}\n".encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+class FolderDigests:
+    """側ごとのフォルダダイジェスト（実行中はメモ化、実行間は HashCache に保存）。スレッドセーフ。"""
+
+    def __init__(self, algo: str, hash_files: HashFiles, cache: Optional[HashCache] = None):
+        self._new = ALGORITHMS[algo]
+        self.hash_files = hash_files
+        self.cache = cache
+        self.computed = 0   # 画像のハッシュから組み立てたフォルダ数
+        self.reused = 0     # キャッシュ・マニフェストから得たフォルダ数
+        self._memo: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def _combine(self, images: List[FileMeta], digests: List[str]) -> str:
+        if any(not x for x in digests):
+            return ""
+        h = self._new()
+        for m, x in sorted(zip(images, digests), key=lambda p: name_key(p[0])):
+            h.update(f"{name_key(m)}\0{m.size}\0{x}\n".encode("utf-8", "surrogatepass"))
+        return h.hexdigest()
+
+    def _compute(self, side: str, d: DirSnapshot) -> str:
+        if all(m.digest for m in d.images):  # マニフェスト等で全件既知
+            self.reused += 1
+            return self._combine(d.images, [m.digest for m in d.images])
+        listing = f"{_DIGEST_FORMAT}:{listing_signature(d)}"
+        if self.cache is not None:
+            cached = self.cache.lookup_folder(d.path, listing)
+            if cached is not None:
+                self.reused += 1
+                return cached
+        digest = self._combine(d.images, self.hash_files(side, d.images))
+        self.computed += 1
+        if self.cache is not None:
+            self.cache.store_folder(d.path, listing, digest)
+        return digest
+
+    def digest(self, side: str, d: DirSnapshot) -> str:
+        key = (side, d.rel)
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+        digest = self._compute(side, d)
+        with self._lock:
+            self._memo[key] = digest
+        return digest
+
+
+class MerkleCompare:
+    """ローカル・リモートのスナップショットを上から比べ、一致するフォルダ/サブツリーを判定する。"""
+
+    def __init__(self, local: TreeSnapshot, remote: TreeSnapshot, digests: FolderDigests):
+        self.local = local
+        self.remote = remote
+        self.digests = digests
+        self._l_children = local.children_index()
+        self._r_children = remote.children_index()
+        self._tree_memo: Dict[str, bool] = {}
+
+    def folder_equal(self, rel: str) -> bool:
+        """直下の画像が両側で一致するか（子フォルダは見ない）"""
+        l_dir, r_dir = self.local.get(rel), self.remote.get(rel)
+        if l_dir is None or r_dir is None:
+            return False
+        if (sorted((name_key(m), m.size) for m in l_dir.images)
+                != sorted((name_key(m), m.size) for m in r_dir.images)):
+            return False  # 名前・サイズが違えば読むまでもない
+        ld = self.digests.digest("local", l_dir)
+        return bool(ld) and ld == self.digests.digest("remote", r_dir)
+
+    def tree_equal(self, rel: str) -> bool:
+        """rel 配下のツリー全体が両側で一致するか（途中で不一致が分かれば打ち切る）"""
+        if rel in self._tree_memo:
+            return self._tree_memo[rel]
+        l_sub = self._l_children.get(rel, [])
+        equal = (l_sub == self._r_children.get(rel, [])
+                 and self.folder_equal(rel)
+                 and all(self.tree_equal(c) for c in l_sub))
+        self._tree_memo[rel] = equal
+        return equal
+
+    def subtree_size(self, rel: str) -> Tuple[int, int]:
+        """rel 配下（rel を除く）のフォルダ数と画像数（ローカル側）"""
+        folders = files = 0
+        stack = list(self._l_children.get(rel, []))
+        while stack:
+            c = stack.pop()
+            folders += 1
+            d = self.local.get(c)
+            files += len(d.images) if d else 0
+            stack.extend(self._l_children.get(c, []))
+        return folders, files
+
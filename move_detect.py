@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+計画内の移動・改名の検出（内容ハッシュで突合）
+
+リモート側でクラスフォルダを改名すると、比較上は
+  旧名フォルダ：LocalOnly（ローカルにだけある画像 → 削除候補）
+  新名フォルダ：RemoteOnly（リモートにだけある画像 → コピー）
+となり、手元にある画像をネットワーク越しに取り直してしまう。
+ここではコピー計画（取り込み先）とローカルにだけある画像（取り込み元）を
+サイズ → 内容ハッシュで突き合わせ、ローカル内の操作に置き換える。
+
+- MOVE_LOCAL：取り込み元が削除予定（--delete-local-only / --delete-missing-on-remote）なら移動
+- COPY_LOCAL：取り込み元を残す設定ならローカル内でコピー
+- RENAME_LOCAL_FOLDER：LocalOnly フォルダの画像がすべて1つの RemoteOnly フォルダへ移動し、
+  両方とも末端フォルダ（子フォルダ無し）ならフォルダごと改名
+
+リモートのハッシュは読み込まずに分かるものだけを使う
+（比較で計算済み・マニフェスト・ハッシュキャッシュの旧パスのエントリ）。
+旧パスのエントリは stat（size / mtime_ns / inode）が一致した場合のみ採用する
+（改名ではファイルの stat が変わらないため）。分からないものは従来どおりコピーする。
+"""
+
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from tree_snapshot import FileMeta
+
+# 取り込み元のハッシュ（ローカルを読む。読めなければ空文字）
+LocalHash = Callable[[FileMeta], str]
+# (取り込み先のリモート画像, 取り込み元のリモート相当パス) → 既知のハッシュ（無ければ空文字）
+KnownRemoteHash = Callable[[FileMeta, str], str]
+
+
+class _Source:
+    __slots__ = ("meta", "rel", "folder", "delete_row", "local_hash", "used")
+
+    def __init__(self, meta: FileMeta, rel: str, folder: str, delete_row: Optional[dict], local_hash: str):
+        self.meta = meta
+        self.rel = rel
+        self.folder = folder
+        self.delete_row = delete_row
+        self.local_hash = local_hash
+        self.used = False
+
+
+class _Target:
+    __slots__ = ("meta", "folder", "row")
+
+    def __init__(self, meta: FileMeta, folder: str, row: dict):
+        self.meta = meta
+        self.folder = folder
+        self.row = row
+
+
+def _folder_of(rel: str) -> str:
+    return rel.rsplit("/", 1)[0] if "/" in rel else "."
+
+
+class MoveDetector:
+    """
+    走査中に取り込み先（コピー計画）と取り込み元（ローカルだけの画像）を預かり、
+    走査後に resolve() で置き換え後の計画を返す。預かるのは差分の行だけ。
+    """
+
+    def __init__(self, local_hash: LocalHash, known_remote_hash: KnownRemoteHash):
+        self.local_hash = local_hash
+        self.known_remote_hash = known_remote_hash
+        self.moves = 0
+        self.local_copies = 0
+        self.folder_renames = 0
+        self.bytes_saved = 0
+        self._sources: Dict[int, List[_Source]] = {}
+        self._targets: List[_Target] = []
+        self._folders: Dict[str, tuple] = {}   # rel → (status, local_img_count, remote_img_count)
+        self._local_rels: Set[str] = set()
+        self._remote_rels: Set[str] = set()
+
+    def note_folder(self, folder_row: dict) -> None:
+        rel, status = folder_row["rel_folder"], folder_row["folder_status"]
+        self._folders[rel] = (status, folder_row["local_img_count"], folder_row["remote_img_count"])
+        if status != "RemoteOnly":
+            self._local_rels.add(rel)
+        if status != "LocalOnly":
+            self._remote_rels.add(rel)
+
+    def add_target(self, rm: FileMeta, row: dict) -> None:
+        """COPY_REMOTE_TO_LOCAL の計画行（expected_hash が既知なら使う）"""
+        self._targets.append(_Target(rm, _folder_of(row["rel_path"]), row))
+
+    def add_source(self, lm: FileMeta, rel: str, delete_row: Optional[dict] = None, local_hash: str = "") -> None:
+        """ローカルにだけある画像。delete_row は置き換えが無い場合に出す削除計画（削除しない設定なら None）"""
+        self._sources.setdefault(lm.size, []).append(_Source(lm, rel, _folder_of(rel), delete_row, local_hash))
+
+    def _is_leaf(self, rel: str, rels: Set[str]) -> bool:
+        prefix = "" if rel == "." else rel + "/"
+        return not any(r != rel and r.startswith(prefix) for r in rels)
+
+    def _match(self, t: _Target) -> Optional[_Source]:
+        # 移動する取り込み元は1回だけ。残す取り込み元（ローカルコピー）は何度でも使える
+        cands = [s for s in self._sources.get(t.meta.size, []) if not s.used or s.delete_row is None]
+        if not cands:
+            return None
+        cands.sort(key=lambda s: s.meta.name != t.meta.name)  # 同名を優先
+        for s in cands:
+            rh = t.row.get("expected_hash") or self.known_remote_hash(t.meta, s.rel)
+            if not rh:
+                continue
+            if not s.local_hash:
+                s.local_hash = self.local_hash(s.meta)
+            if s.local_hash == rh:
+                s.used = True
+                if not t.row.get("expected_hash"):
+                    t.row["expected_hash"] = rh
+                return s
+        return None
+
+    def resolve(self) -> Iterator[dict]:
+        """置き換え後の計画：フォルダ改名 → 移動/ローカルコピー → 残りのコピー → 残りの削除"""
+        matched = [(t, self._match(t)) for t in self._targets]
+
+        # フォルダ単位：LocalOnly → RemoteOnly の全件移動なら改名にまとめる
+        pairs: Dict[tuple, int] = {}
+        for t, s in matched:
+            if s is not None and s.delete_row is not None:
+                pairs[(s.folder, t.folder)] = pairs.get((s.folder, t.folder), 0) + 1
+        renamed: Dict[str, str] = {}
+        for (src, dst), n in pairs.items():
+            s_info, d_info = self._folders.get(src), self._folders.get(dst)
+            if not s_info or not d_info or s_info[0] != "LocalOnly" or d_info[0] != "RemoteOnly":
+                continue
+            if src in renamed or dst in renamed.values():
+                continue
+            if n == s_info[1] == d_info[2] and self._is_leaf(src, self._local_rels) \
+                    and self._is_leaf(dst, self._remote_rels):
+                renamed[src] = dst
+
+        for src, dst in renamed.items():
+            t, s = next((t, s) for t, s in matched if s is not None and s.folder == src and t.folder == dst)
+            self.folder_renames += 1
+            yield {
+                "action": "RENAME_LOCAL_FOLDER",
+                "reason": "リモートでフォルダ改名（全画像の内容ハッシュ一致）",
+                "local_path": os.path.dirname(t.row["local_path"]),
+                "remote_path": os.path.dirname(t.row["remote_path"]),
+                "rel_path": dst,
+                "expected_hash": "",
+                "local_src": os.path.dirname(s.meta.path),
+            }
+
+        rest = []
+        for t, s in matched:
+            if s is None:
+                rest.append(t.row)
+                continue
+            self.bytes_saved += t.meta.size
+            move = s.delete_row is not None
+            if move:
+                self.moves += 1
+            else:
+                self.local_copies += 1
+            if renamed.get(s.folder) == t.folder:
+                continue  # フォルダ改名に含まれる
+            yield {
+                **t.row,
+                "action": "MOVE_LOCAL" if move else "COPY_LOCAL",
+                "reason": ("リモートで移動/改名（内容ハッシュ一致）" if move
+                           else "ローカルに同一内容あり（内容ハッシュ一致）"),
+                "local_src": s.meta.path,
+            }
+        yield from rest
+
+        for group in self._sources.values():
+            for s in group:
+                if not s.used and s.delete_row is not None:
+                    yield s.delete_row
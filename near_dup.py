@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+知覚ハッシュ（dHash / pHash）による近似重複画像の検出（split 間のリーク確認用）
+
+完全一致のハッシュ（dup_index.py）では、再エンコード・リサイズ・軽いトリミングをした
+同じ料理写真を見つけられない。ここでは各画像の 64bit 知覚ハッシュを作り、
+ハミング距離が --max-distance 以下の組を train/val/test をまたいで列挙する。
+
+- ハッシュ計算はプロセスプール（デコードが CPU 律速のため）。JPEG は draft で縮小デコード
+- 結果はハッシュキャッシュ（hash_cache.py の SQLite。アルゴリズム名 dhash64 / phash64）に保存し、
+  size/mtime/inode が同じ画像は次回デコードしない
+- 検索は multi-index hashing：64bit を m 個の区間に分け、距離 r 以内なら
+  少なくとも1区間は距離 r//m 以内（鳩の巣原理）。区間ごとのバケットを引いた候補だけを、
+  uint64 配列の XOR + popcount でまとめて距離計算する（全組み合わせは比較しない）
+
+Excel出力
+- NearDupPairs：距離・種別・両画像の split/class/パス/ハッシュ（距離の小さい順）
+- SplitLeaks：split の組ごとの組数
+
+前提
+    pip install pillow numpy openpyxl
+
+例:
+    python near_dup.py --base /srv/datasets --excel-out near_dup.xlsx --max-distance 6
+"""
+
+import sys
+import argparse
+from pathlib import Path
+from datetime import datetime
+from math import comb
+from itertools import combinations
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from dup_index import Entry, collect_entries
+from hash_cache import open_cache
+from report_writer import SIDECAR_FORMATS, ReportWriter
+from tree_snapshot import TreeSnapshot
+
+PHASH_ALGOS = ("dhash", "phash")
+SCOPES = ("cross-split", "cross-class", "all")
+PAIR_COLUMNS = ["distance", "kind", "split_a", "class_a", "rel_path_a", "split_b", "class_b", "rel_path_b",
+                "path_a", "path_b", "hash_a", "hash_b"]
+
+DENSE_BUCKET_BITS = 24   # これ以下の区間幅はバケット表（2^幅 要素）で引く
+
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_DCT32 = np.cos(np.pi * np.outer(np.arange(32), 2 * np.arange(32) + 1) / 64)
+
+
+# --- 知覚ハッシュ（ワーカープロセスで実行）---
+def _gray(path: str, size: Tuple[int, int]) -> np.ndarray:
+    with Image.open(path) as im:
+        im.draft("L", (size[0] * 4, size[1] * 4))  # JPEG は縮小デコード（大きな写真で数倍速い）
+        im = im.convert("L").resize(size, Image.Resampling.LANCZOS)
+        return np.asarray(im, dtype=np.float32)
+
+
+def perceptual_hash(path: str, algo: str = "dhash") -> str:
+    """64bit の知覚ハッシュを16桁の16進文字列で返す。読めない画像は空文字。"""
+    try:
+        if algo == "dhash":
+            px = _gray(path, (9, 8))
+            bits = px[:, 1:] > px[:, :-1]   # 横方向の明暗差
+        else:
+            px = _gray(path, (32, 32))
+            low = (_DCT32 @ px @ _DCT32.T)[:8, :8].flatten()
+            bits = low > np.median(low[1:])  # 直流成分を除いた中央値で二値化
+    except Exception:
+        return ""
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+
+def _hash_job(job: Tuple[str, str]) -> str:
+    return perceptual_hash(*job)
+
+
+# --- 検索 ---
+def popcount64(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy 2.0+
+        return np.bitwise_count(x)
+    return _POP8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _chunk_layout(n: int, max_dist: int) -> List[Tuple[int, int]]:
+    """
+    (shift, 幅) の一覧。区間数 m は「探索パターン数 × (1 + 期待バケット件数)」が最小になるものを選ぶ
+    （区間を増やすと半径 r//m が下がりパターンは減るが、幅が狭くなりバケットが太る）。
+    """
+    def cost(m: int) -> float:
+        w = 64 // m
+        probes = m * sum(comb(w, k) for k in range(max_dist // m + 1))
+        return probes * (1 + n / 2.0 ** w)
+
+    m = min(range(1, max_dist + 2), key=cost)
+    base, extra = divmod(64, m)
+    layout, shift = [], 0
+    for k in range(m):
+        w = base + (1 if k < extra else 0)
+        layout.append((shift, w))
+        shift += w
+    return layout
+
+
+def near_pairs(codes: np.ndarray, max_dist: int, block: int = 65536,
+               group: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ハミング距離 max_dist 以下の組 (i, j, 距離)（i < j）を返す。
+    group 指定時は group[i] != group[j] の組だけ（例：split 番号で split 間のみ）。
+    """
+    n = len(codes)
+    found_i, found_j = [], []
+    layout = _chunk_layout(n, max_dist)
+    radius = max_dist // len(layout)
+    for shift, width in layout:
+        mask = np.uint64((1 << width) - 1)
+        keys = ((codes >> np.uint64(shift)) & mask).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # 区間が狭ければバケット先頭位置の表を作り、二分探索せず直接引く
+        starts = (np.searchsorted(sorted_keys, np.arange((1 << width) + 1))
+                  if width <= DENSE_BUCKET_BITS else None)
+        flips = [sum(1 << b for b in bs) for r in range(radius + 1) for bs in combinations(range(width), r)]
+        for start in range(0, n, block):
+            q = np.arange(start, min(n, start + block))
+            for f in flips:
+                probe = keys[q] ^ f
+                if starts is not None:
+                    lo = starts[probe]
+                    cnt = starts[probe + 1] - lo
+                else:
+                    lo = np.searchsorted(sorted_keys, probe, "left")
+                    cnt = np.searchsorted(sorted_keys, probe, "right") - lo
+                total = int(cnt.sum())
+                if total == 0:
+                    continue
+                qi = np.repeat(q, cnt)
+                pos = np.arange(total) - np.repeat(np.cumsum(cnt) - cnt, cnt) + np.repeat(lo, cnt)
+                j = order[pos]
+                keep = qi < j
+                if group is not None:
+                    keep &= group[qi] != group[j]
+                qi, j = qi[keep], j[keep]
+                d = popcount64(codes[qi] ^ codes[j])
+                ok = d <= max_dist
+                found_i.append(qi[ok])
+                found_j.append(j[ok])
+    if not found_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    pair_key = np.unique(np.concatenate(found_i).astype(np.int64) * n + np.concatenate(found_j))
+    i, j = pair_key // n, pair_key % n
+    return i, j, popcount64(codes[i] ^ codes[j]).astype(np.int64)
+
+
+# --- 本体 ---
+def parse_args():
+    p = argparse.ArgumentParser(description="知覚ハッシュによる近似重複画像の検出（split 間リーク）")
+    p.add_argument("--base", required=True, help="データセットのベース（<base>/<split>/<class>/...）")
+    p.add_argument("--subsets", nargs="*", default=["train", "val", "test"], help="対象の split フォルダ名")
+    p.add_argument("--excel-out", default="near_dup.xlsx", help="Excel出力先")
+    p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
+                   help="対象拡張子（小文字・カンマ区切り）")
+    p.add_argument("--algo", choices=PHASH_ALGOS, default="dhash",
+                   help="dhash: 隣接画素の明暗差（高速） / phash: DCT 低周波（リサイズ・圧縮に強い）")
+    p.add_argument("--max-distance", type=int, default=6, help="近似とみなすハミング距離（64bit 中）")
+    p.add_argument("--scope", choices=SCOPES, default="cross-split",
+                   help="cross-split: split をまたぐ組のみ / cross-class: クラスか split が異なる組 / all: すべて")
+    p.add_argument("--hash-cache", default="hash_cache.sqlite",
+                   help="ハッシュキャッシュ（SQLite）。size/mtime/inode 一致時は再計算しない")
+    p.add_argument("--no-hash-cache", dest="hash_cache", action="store_const", const=None,
+                   help="ハッシュキャッシュを使わない")
+    p.add_argument("--workers", type=int, default=None, help="ハッシュ計算のプロセス数（既定：CPU数）")
+    p.add_argument("--report-sidecar", choices=SIDECAR_FORMATS, default="none",
+                   help="各シートを CSV/Parquet にも出力")
+    return p.parse_args()
+
+
+def hash_all(entries: List[Entry], algo: str, cache, workers: Optional[int]) -> List[str]:
+    """キャッシュを引き、ミスした画像だけプロセスプールで計算する。"""
+    hashes = [""] * len(entries)
+    todo = []
+    for k, e in enumerate(entries):
+        m = e.meta
+        cached = cache.lookup(m.path, m.size, m.mtime_ns, m.inode) if cache is not None else None
+        if cached is not None:
+            hashes[k] = cached
+        else:
+            todo.append(k)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            jobs = ((entries[k].meta.path, algo) for k in todo)
+            for k, h in zip(todo, ex.map(_hash_job, jobs, chunksize=32)):
+                hashes[k] = h
+                if cache is not None:
+                    m = entries[k].meta
+                    cache.store(m.path, m.size, m.mtime_ns, m.inode, h)
+    return hashes
+
+
+def pair_kind(a: Entry, b: Entry) -> str:
+    if a.split != b.split:
+        return "cross_split"
+    return "cross_class" if a.class_name != b.class_name else "same_class"
+
+
+def main():
+    args = parse_args()
+    base = Path(args.base)
+    image_exts = {e.strip().lower() for e in args.image_exts.split(",") if e.strip()}
+    if not base.exists():
+        print(f"[ERROR] ベースが存在しません: {base}")
+        sys.exit(1)
+    if not 0 <= args.max_distance < 32:
+        print("[ERROR] --max-distance は 0〜31 で指定してください")
+        sys.exit(1)
+
+    t0 = datetime.now()
+    entries = collect_entries(TreeSnapshot.build(base, image_exts), args.subsets)
+    print(f"[INFO] 走査: {len(entries)} files（{', '.join(args.subsets)}）")
+
+    cache = open_cache(args.hash_cache, algo=f"{args.algo}64")
+    hashes = hash_all(entries, args.algo, cache, args.workers)
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        cache.close()
+    print(f"[INFO] {args.algo} 計算完了: {datetime.now() - t0}")
+
+    valid = [k for k, h in enumerate(hashes) if h]
+    if len(valid) < len(entries):
+        print(f"[WARN] 読み込めなかった画像: {len(entries) - len(valid)} files（検索から除外）")
+    entries = [entries[k] for k in valid]
+    hashes = [hashes[k] for k in valid]
+    codes = np.array([int(h, 16) for h in hashes], dtype=np.uint64)
+
+    # scope に応じた「別グループ」の定義（同じ番号同士の組は探さない）
+    if args.scope == "cross-split":
+        labels = [e.split for e in entries]
+    elif args.scope == "cross-class":
+        labels = [(e.split, e.class_name) for e in entries]
+    else:
+        labels = None
+    group = None
+    if labels is not None:
+        ids = {x: i for i, x in enumerate(dict.fromkeys(labels))}
+        group = np.array([ids[x] for x in labels], dtype=np.int32)
+
+    t1 = datetime.now()
+    pi, pj, pdist = near_pairs(codes, args.max_distance, group=group)
+    print(f"[INFO] 近似重複の組: {len(pi)} 件（距離 ≤ {args.max_distance}、検索 {datetime.now() - t1}）")
+
+    split_order = {sb: k for k, sb in enumerate(args.subsets)}
+    rows = []
+    leaks: Counter = Counter()
+    for i, j, d in zip(pi.tolist(), pj.tolist(), pdist.tolist()):
+        a, b = entries[i], entries[j]
+        if (split_order[a.split], a.rel_path) > (split_order[b.split], b.rel_path):
+            a, b, i, j = b, a, j, i
+        kind = pair_kind(a, b)
+        if a.split != b.split:
+            leaks[(a.split, b.split)] += 1
+        rows.append({
+            "distance": d,
+            "kind": kind,
+            "split_a": a.split, "class_a": a.class_name, "rel_path_a": a.rel_path,
+            "split_b": b.split, "class_b": b.class_name, "rel_path_b": b.rel_path,
+            "path_a": a.meta.path, "path_b": b.meta.path,
+            "hash_a": hashes[i], "hash_b": hashes[j],
+        })
+    rows.sort(key=lambda r: (r["distance"], split_order[r["split_a"]], r["rel_path_a"], r["rel_path_b"]))
+
+    with ReportWriter(args.excel_out, sidecar=args.report_sidecar) as report:
+        report.write_sheet("NearDupPairs", PAIR_COLUMNS, rows)
+        report.write_sheet("SplitLeaks", ["split_a", "split_b", "pairs"],
+                           [[a, b, n] for (a, b), n in leaks.most_common()])
+
+    for (a, b), n in leaks.most_common():
+        print(f"[WARN] {a} × {b} に近似重複: {n} pairs")
+    print(f"[INFO] Excel 出力: {args.excel_out}")
+    print(f"[DONE] 終了。処理時間: {datetime.now() - t0}")
+
+
+if __name__ == "__main__":
+    main()
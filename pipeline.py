@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+走査 → 比較 → 計画 → レポート/適用 をつなぐジェネレータ部品
+
+- walk_pairs：ローカル・リモートを同時に深さ優先で歩き、相対フォルダごとに
+  (rel, ローカル DirSnapshot, リモート DirSnapshot) を1件ずつ返す。
+  保持するのは未訪問フォルダのスタックだけなので、メモリはフォルダの分岐数で決まる
+  （ファイル総数に比例しない）
+  （prefetch 指定時は一覧取得を asyncio で先読みし、複数フォルダを同時に scandir する）
+- bounded：ジェネレータを別スレッドで回し、上限付きキューで受け渡す。
+  走査・比較を進めながら、下流（計画・適用）が先頭から処理を始められる
+
+フォルダは名前順の深さ優先（"a" → "a/b" → "a b"）で返す。
+全件を並べ替えたい場合は呼び出し側で行うこと。
+"""
+
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar, Union
+
+from crawler import AsyncPrefetcher, Job
+from tree_snapshot import DirSnapshot, TreeSnapshot, scan_dir
+
+PathLike = Union[str, Path]
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class FolderPair(NamedTuple):
+    rel: str
+    local: Optional[DirSnapshot]
+    remote: Optional[DirSnapshot]
+
+
+class FolderResult(NamedTuple):
+    """比較段の出力（1フォルダ分）"""
+    folder_row: dict
+    local: Optional[DirSnapshot]
+    remote: Optional[DirSnapshot]
+    file_rows: List[dict]
+
+
+def _scan_side(root_s: str, rel: str, image_exts: set, snap: Optional[TreeSnapshot],
+               children: Optional[Dict[str, List[str]]]) -> Tuple[Optional[DirSnapshot], List[str]]:
+    if snap is not None:
+        return snap.get(rel), children.get(rel, [])
+    path = root_s if rel == "." else os.path.join(root_s, *rel.split("/"))
+    res = scan_dir(path, rel, image_exts)
+    if res is None:
+        return None, []
+    d, subdirs = res
+    return d, [r for r, _ in subdirs]
+
+
+def walk_pairs(local_root: PathLike, remote_root: PathLike, image_exts: set,
+               remote_snap: Optional[TreeSnapshot] = None,
+               local_only: bool = False,
+               local_snap: Optional[TreeSnapshot] = None,
+               descend: Optional[Callable[[FolderPair], bool]] = None,
+               prefetch: int = 0,
+               stats: Optional[dict] = None) -> Iterator[FolderPair]:
+    """
+    ローカル・リモートの相対フォルダを突き合わせながら歩く。
+    - remote_snap / local_snap 指定時はその側を走査せずスナップショット（マニフェスト等）を参照
+    - local_only=True のときはローカルに存在するフォルダだけを返す（リモートは対応フォルダのみ scandir）
+    - 片側にしか無いフォルダの配下は、もう片側を scandir しない
+    - descend 指定時、返したフォルダについて False を返すとその配下には降りない
+      （呼び出し側が返されたフォルダを処理し終えてから評価する）
+    - prefetch > 0 のときは crawler.AsyncPrefetcher で最大 prefetch 件の一覧取得を同時に走らせる
+      （返す順序は逐次の場合と同じ）。stats を渡すと先読みの件数・最大同時数を書き込む
+    """
+    local_s, remote_s = str(local_root), str(remote_root)
+    r_children = remote_snap.children_index() if remote_snap is not None else None
+    l_children = local_snap.children_index() if local_snap is not None else None
+
+    def scan(rel: str, on_local: bool, on_remote: bool) -> tuple:
+        l_dir, l_sub = (_scan_side(local_s, rel, image_exts, local_snap, l_children)
+                        if on_local else (None, []))
+        r_dir, r_sub = (_scan_side(remote_s, rel, image_exts, remote_snap, r_children)
+                        if on_remote else (None, []))
+        return l_dir, l_sub, r_dir, r_sub
+
+    def child_jobs(job: Job, res: tuple) -> List[Job]:
+        l_dir, l_sub, r_dir, r_sub = res
+        if l_dir is None and (local_only or r_dir is None):
+            return []
+        l_set, r_set = set(l_sub), set(r_sub)
+        subs = l_set if local_only else (l_set | r_set)
+        return [(s, s in l_set, s in r_set) for s in sorted(subs)]
+
+    root: Job = (".", True, True)
+    crawler = AsyncPrefetcher(scan, child_jobs, root, inflight=prefetch) if prefetch > 0 else None
+    stack: List[Job] = [root]
+    try:
+        while stack:
+            job = stack.pop()
+            rel = job[0]
+            res = crawler.get(rel) if crawler is not None else scan(*job)
+            l_dir, _, r_dir, _ = res
+            if l_dir is None and (local_only or r_dir is None):
+                continue
+            pair = FolderPair(rel, l_dir, r_dir)
+            yield pair
+            if descend is not None and not descend(pair):
+                if crawler is not None:
+                    crawler.prune(rel)
+                continue
+            stack.extend(reversed(child_jobs(job, res)))
+    finally:
+        if crawler is not None:
+            crawler.close()
+            if stats is not None:
+                stats.update(prefetch_scanned=crawler.scanned, prefetch_peak=crawler.peak)
+
+
+def bounded(items: Iterable[T], maxsize: int = 64) -> Iterator[T]:
+    """
+    items を別スレッドで生成し、最大 maxsize 件のキュー経由で返す。
+    生成側の例外は受け取り側で再送出する。受け取り側が途中でやめた場合も生成スレッドは止まる。
+    """
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+    error: List[BaseException] = []
+
+    def produce():
+        try:
+            for it in items:
+                while not stop.is_set():
+                    try:
+                        q.put(it, timeout=0.2)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:  # 受け取り側へ渡す
+            error.append(e)
+        finally:
+            q.put(_DONE)
+
+    t = threading.Thread(target=produce, daemon=True, name="pipeline")
+    t.start()
+    try:
+        while True:
+            it = q.get()
+            if it is _DONE:
+                break
+            yield it
+    finally:
+        stop.set()
+        while t.is_alive():  # 生成側が put で詰まらないよう空ける
+            try:
+                q.get(timeout=0.2)
+            except queue.Empty:
+                pass
+        t.join()
+    if error:
+        raise error[0]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+比較結果（実行計画）の保存と、適用前の再検証
+
+1回目の比較（--first-pass-only 等）で計画をファイルに保存しておき、後の適用では
+ツリー全体を走査・ハッシュし直さずに、その計画が触るファイルだけを確かめてから実行する。
+
+形式：gzip 圧縮 JSON Lines
+    1行目  {"format": "sync-plan", "version": 1, "created": ..., "local_root": ..., "remote_root": ...,
+            "hash_algo": ..., "image_exts": [...], "delete_local_extra": ..., "clean": true/false,
+            "reasons": [...], "actions": <件数>}
+    2行目~ {"action": ..., "reason": ..., "rel_path": ..., "file_name": ..., "local_path": ..., "remote_path": ...,
+            "local": [size, mtime_ns, hash] | null, "remote": [size, mtime_ns, hash] | null}
+
+local / remote は計画時点のファイルの指紋（null は「無かった」）。再検証は1ファイル stat 1回で、
+size と mtime_ns が一致すれば計画どおりとみなす（ハッシュキャッシュと同じ前提）。
+size が同じで mtime だけ違う場合のみ読み直してハッシュを比べる（touch やコピーで mtime が変わった等）。
+"""
+
+import os
+import gzip
+import json
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from tree_snapshot import FileMeta
+
+PathLike = Union[str, Path]
+
+PLAN_FORMAT = "sync-plan"
+PLAN_VERSION = 1
+
+
+def fingerprint(m: Optional[FileMeta], digest: str) -> Optional[list]:
+    return None if m is None else [m.size, m.mtime_ns, digest]
+
+
+def write_plan(out_path: PathLike, header: dict, actions: Iterable[dict]) -> int:
+    """計画を書き出し（一時ファイル → 置き換え）、件数を返す。"""
+    actions = list(actions)
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "format": PLAN_FORMAT,
+            "version": PLAN_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            **header,
+            "actions": len(actions),
+        }, ensure_ascii=False) + "\n")
+        for a in actions:
+            f.write(json.dumps(a, ensure_ascii=False) + "\n")
+    os.replace(tmp, out_path)
+    return len(actions)
+
+
+def load_plan(path: PathLike) -> Tuple[dict, List[dict]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != PLAN_FORMAT:
+            raise ValueError(f"計画ファイルではありません: {path}")
+        if header.get("version") != PLAN_VERSION:
+            raise ValueError(f"未対応の計画ファイルのバージョンです（{header.get('version')}）: {path}")
+        actions = [json.loads(line) for line in f]
+    if len(actions) != header.get("actions"):
+        raise ValueError(f"計画ファイルが途中で切れています（{len(actions)}/{header.get('actions')} 件）: {path}")
+    return header, actions
+
+
+def check_fingerprint(path: str, fp: Optional[list], rehash: Callable[[str], str]) -> str:
+    """現在の状態が計画時と同じなら空文字、違えば理由を返す。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "" if fp is None else "ファイルが無くなっています"
+    except OSError as e:
+        return f"stat できません（{e}）"
+    if fp is None:
+        return "計画時には無かったファイルがあります"
+    size, mtime_ns, digest = fp
+    if st.st_size != size:
+        return f"サイズが変わっています（{size} → {st.st_size}）"
+    if st.st_mtime_ns == mtime_ns:
+        return ""
+    if digest and rehash(path) == digest:
+        return ""  # mtime だけ変わった（内容は同じ）
+    return "内容が変わっています"
+
+
+def revalidate(action: dict, rehash: Callable[[str], str]) -> str:
+    """アクションが触るファイル（コピー元・コピー先/削除対象）を確かめる。問題なければ空文字。"""
+    reasons = []
+    if action["remote_path"]:
+        r = check_fingerprint(action["remote_path"], action["remote"], rehash)
+        if r:
+            reasons.append(f"remote: {r}")
+    if action["local_path"]:
+        r = check_fingerprint(action["local_path"], action["local"], rehash)
+        if r:
+            reasons.append(f"local: {r}")
+    return " / ".join(reasons)
+
+
+def revalidate_all(actions: List[dict], rehash: Callable[[str], str], workers: int = 8) -> List[str]:
+    """全アクションを並列に再検証し、各アクションの理由（問題なしは空文字）を計画順で返す。"""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        return list(ex.map(lambda a: revalidate(a, rehash), actions))
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+ストリーミング型のレポート出力（Excel 行数上限対応）
+
+- xlsx は openpyxl の write_only モードで1行ずつ書き出す（メモリ一定。DataFrame を作らない）
+- Excel の上限（1,048,576 行）を超えるシートは自動で "<シート名>_2", "_3", ... に分割
+- sheet(..., skip_empty=True) のシートは、1行も書かれなければ保存時に取り除く（サイドカーも作らない）
+- 同じ行を CSV / Parquet のサイドカーにも書ける（<xlsx名>.<シート名>.csv / .parquet）
+  CSV は行ごとに書くので、xlsx の保存前（適用中など）でも内容を確認できる
+- xlsx は close() 時に一度だけ保存する。適用結果（Applied/Errors）も同じライターに
+  書き足してから閉じるので、ブックを読み直して追記する必要はない
+- RollingCsvReport：常駐実行（--watch）用。ブックを毎回作らず、サイクルごとの行を
+  日付別の CSV に追記する（古い日付のファイルは keep_days 日で削除）
+
+Parquet は pyarrow が必要（pip install pyarrow）。
+"""
+
+import csv
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Union
+
+from openpyxl import Workbook
+
+try:
+    import pyarrow as pa  # 任意（pip install pyarrow）
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PathLike = Union[str, Path]
+Row = Union[dict, Sequence]
+
+EXCEL_MAX_ROWS = 1_048_576
+SIDECAR_FORMATS = ("none", "csv", "parquet")
+PARQUET_BATCH = 65536
+
+
+class _CsvSidecar:
+    def __init__(self, path: Path, columns: List[str]):
+        self._f = path.open("w", encoding="utf-8-sig", newline="")  # Excel で開けるよう BOM 付き
+        self._w = csv.writer(self._f)
+        self._w.writerow(columns)
+
+    def write(self, values: list) -> None:
+        self._w.writerow(["" if v is None else v for v in values])
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class _ParquetSidecar:
+    """行をバッチにまとめて row group 単位で書く。列の型は最初のバッチから決める。"""
+
+    def __init__(self, path: Path, columns: List[str]):
+        if pa is None:
+            raise RuntimeError("Parquet 出力には pyarrow が必要です（pip install pyarrow）")
+        self.path = path
+        self.columns = columns
+        self._buf: List[list] = []
+        self._schema = None
+        self._w = None
+
+    def write(self, values: list) -> None:
+        self._buf.append(values)
+        if len(self._buf) >= PARQUET_BATCH:
+            self._flush()
+
+    @staticmethod
+    def _infer(col: list):
+        for v in col:
+            if v is None:
+                continue
+            if isinstance(v, bool):
+                return pa.bool_()
+            if isinstance(v, int):
+                return pa.int64()
+            if isinstance(v, float):
+                return pa.float64()
+            if isinstance(v, datetime):
+                return pa.timestamp("us")
+            return pa.string()
+        return pa.string()  # 全て None の列は文字列扱い
+
+    @staticmethod
+    def _coerce(v, typ):
+        if v is None:
+            return None
+        try:
+            if typ == pa.string():
+                return str(v)
+            if typ == pa.int64():
+                return int(v)
+            if typ == pa.float64():
+                return float(v)
+        except (TypeError, ValueError):
+            return None
+        return v
+
+    def _flush(self) -> None:
+        if not self._buf:
+            return
+        cols = [list(c) for c in zip(*self._buf)]
+        if self._schema is None:
+            self._schema = pa.schema([(name, self._infer(c)) for name, c in zip(self.columns, cols)])
+            self._w = pq.ParquetWriter(str(self.path), self._schema)
+        arrays = [pa.array([self._coerce(v, f.type) for v in c], type=f.type)
+                  for c, f in zip(cols, self._schema)]
+        self._w.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._buf = []
+
+    def close(self) -> None:
+        self._flush()
+        if self._w is None:  # 0 行：列だけのファイルを作る
+            self._schema = pa.schema([(name, pa.string()) for name in self.columns])
+            self._w = pq.ParquetWriter(str(self.path), self._schema)
+        self._w.close()
+
+
+class SheetStream:
+    """1シート分の書き込み口（ReportWriter.sheet() で取得）。"""
+
+    def __init__(self, report: "ReportWriter", name: str, columns: Sequence[str], skip_empty: bool = False):
+        self.report = report
+        self.name = name
+        self.columns = list(columns)
+        self.skip_empty = skip_empty
+        self.rows = 0
+        self._part = 0
+        self._ws = None
+        self._ws_rows = 0
+        self._sidecar = report._open_sidecar(name, self.columns)
+        self._new_part()
+
+    def _new_part(self) -> None:
+        self._part += 1
+        title = self.name if self._part == 1 else f"{self.name[:27]}_{self._part}"  # シート名は31文字まで
+        self._ws = self.report._wb.create_sheet(title=title)
+        self._ws.append(self.columns)
+        self._ws_rows = 1
+        if self._part == 2:
+            print(f"[INFO] シート {self.name} が Excel の行数上限を超えるため分割します")
+
+    def write(self, row: Row) -> None:
+        values = [row.get(c) for c in self.columns] if isinstance(row, dict) else list(row)
+        if self._ws_rows >= self.report.max_rows:
+            self._new_part()
+        self._ws.append(values)
+        self._ws_rows += 1
+        self.rows += 1
+        if self._sidecar is not None:
+            self._sidecar.write(values)
+
+    def write_many(self, rows: Iterable[Row]) -> None:
+        for r in rows:
+            self.write(r)
+
+
+class ReportWriter:
+    def __init__(self, xlsx_path: PathLike, sidecar: str = "none", max_rows: int = EXCEL_MAX_ROWS):
+        if sidecar not in SIDECAR_FORMATS:
+            raise ValueError(f"未対応のサイドカー形式: {sidecar}")
+        self.path = Path(xlsx_path)
+        self.sidecar = sidecar
+        self.max_rows = max_rows
+        self.sidecar_paths: List[Path] = []
+        self._wb = Workbook(write_only=True)
+        self._sheets: Dict[str, SheetStream] = {}
+
+    def _sidecar_path(self, name: str) -> Path:
+        return self.path.with_name(f"{self.path.stem}.{name}.{self.sidecar}")
+
+    def _open_sidecar(self, name: str, columns: List[str]):
+        if self.sidecar == "none":
+            return None
+        p = self._sidecar_path(name)
+        self.sidecar_paths.append(p)
+        return _CsvSidecar(p, columns) if self.sidecar == "csv" else _ParquetSidecar(p, columns)
+
+    def sheet(self, name: str, columns: Sequence[str], skip_empty: bool = False) -> SheetStream:
+        s = SheetStream(self, name, columns, skip_empty)
+        self._sheets[name] = s
+        return s
+
+    def write_sheet(self, name: str, columns: Sequence[str], rows: Iterable[Row]) -> int:
+        """シートを作成して rows を全件書き、行数を返す。"""
+        s = self.sheet(name, columns)
+        s.write_many(rows)
+        return s.rows
+
+    def write_records(self, name: str, records: List[dict]) -> int:
+        """
+        dict の行リストを書く。列は全行のキーの出現順（DataFrame.from_records と同じ）。
+        空のときはシートを作らない（従来の df.empty 判定と同じ）。
+        """
+        if not records:
+            return 0
+        columns: Dict[str, None] = {}
+        for r in records:
+            for k in r:
+                columns.setdefault(k, None)
+        return self.write_sheet(name, list(columns), records)
+
+    def close(self) -> None:
+        if self._wb is None:
+            return
+        for name, s in list(self._sheets.items()):
+            if s.skip_empty and s.rows == 0:  # 行が無ければシートごと出さない
+                s._ws.close()
+                self._wb.remove(s._ws)
+                if s._sidecar is not None:
+                    s._sidecar.close()
+                    s._sidecar = None
+                    p = self._sidecar_path(name)
+                    p.unlink(missing_ok=True)
+                    self.sidecar_paths.remove(p)
+                del self._sheets[name]
+        if not self._sheets:  # シート0枚のブックは保存できない
+            self.write_sheet("Info", ["info"], [["No rows"]])
+        for s in self._sheets.values():
+            if s._sidecar is not None:
+                s._sidecar.close()
+        self._wb.save(self.path)
+        self._wb = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _RollingSheet:
+    """RollingCsvReport の1シート分。書き込み先は書いた時点の日付のファイル。"""
+
+    def __init__(self, report: "RollingCsvReport", name: str, columns: Sequence[str]):
+        self.report = report
+        self.name = name
+        self.columns = list(columns)
+        self.rows = 0
+        self._day = ""
+        self._f = None
+        self._w = None
+
+    def _ensure_open(self) -> None:
+        day = self.report.day
+        if self._f is not None and self._day == day:
+            return
+        if self._f is not None:
+            self._f.close()
+        p = self.report.path_for(day, self.name)
+        new = not p.exists() or p.stat().st_size == 0
+        self._f = p.open("a", encoding="utf-8-sig" if new else "utf-8", newline="")
+        self._w = csv.writer(self._f)
+        if new:
+            self._w.writerow(RollingCsvReport.PREFIX + self.columns)
+        self._day = day
+
+    def write(self, row: Row) -> None:
+        values = [row.get(c) for c in self.columns] if isinstance(row, dict) else list(row)
+        self._ensure_open()
+        self._w.writerow([self.report.cycle, self.report.stamp] + ["" if v is None else v for v in values])
+        self.rows += 1
+
+    def write_many(self, rows: Iterable[Row]) -> None:
+        for r in rows:
+            self.write(r)
+
+    def flush(self) -> None:
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class RollingCsvReport:
+    """
+    --watch 用のローリングレポート（ReportWriter と同じ sheet / write_sheet で書ける）。
+    行は <stem>.<YYYYMMDD>.<シート名>.csv に追記し、先頭に cycle（サイクル番号）と
+    logged_at（サイクル開始時刻）を付ける。begin() でサイクルを始め、end() でディスクに書き出す。
+    """
+
+    PREFIX = ["cycle", "logged_at"]
+
+    def __init__(self, base_path: PathLike, keep_days: int = 7):
+        self.base = Path(base_path)
+        self.keep_days = keep_days
+        self.cycle = 0
+        self.stamp = ""
+        self.day = ""
+        self._sheets: Dict[str, _RollingSheet] = {}
+
+    def path_for(self, day: str, name: str) -> Path:
+        return self.base.with_name(f"{self.base.stem}.{day}.{name}.csv")
+
+    def begin(self, cycle: int) -> None:
+        now = datetime.now()
+        day = now.strftime("%Y%m%d")
+        self.cycle = cycle
+        self.stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        if day != self.day:
+            self.day = day
+            self._prune(now)
+
+    def _prune(self, now: datetime) -> None:
+        """keep_days 日より古い日付のファイルを消す（0 以下なら消さない）"""
+        if self.keep_days <= 0:
+            return
+        cutoff = (now - timedelta(days=self.keep_days)).strftime("%Y%m%d")
+        for p in self.base.parent.glob(f"{self.base.stem}.*.*.csv"):
+            day = p.name[len(self.base.stem) + 1:].split(".", 1)[0]
+            if len(day) == 8 and day.isdigit() and day < cutoff:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+
+    def sheet(self, name: str, columns: Sequence[str]) -> _RollingSheet:
+        s = self._sheets.get(name)
+        if s is None or s.columns != list(columns):
+            if s is not None:
+                s.close()
+            s = self._sheets[name] = _RollingSheet(self, name, columns)
+        return s
+
+    def write_sheet(self, name: str, columns: Sequence[str], rows: Iterable[Row]) -> int:
+        s = self.sheet(name, columns)
+        before = s.rows
+        s.write_many(rows)
+        return s.rows - before
+
+    def paths(self) -> List[Path]:
+        return [self.path_for(self.day, name) for name in self._sheets]
+
+    def end(self) -> None:
+        for s in self._sheets.values():
+            s.flush()
+
+    def close(self) -> None:
+        for s in self._sheets.values():
+            s.close()
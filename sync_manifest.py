@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+リモート側マニフェストの作成・読み込み
+
+リモート（またはその近く）で1回だけ実行し、全画像の 相対パス/サイズ/mtime/ハッシュ を
+コンパクトなファイルに書き出す。比較ツールは --remote-manifest でこれを読み込み、
+UNC/SMB 越しにリモートを走査せずに同じ Folder/File/Plan シートを出力する。
+（ネットワーク越しに読むのは実際にコピーするファイルだけになる）
+
+形式：gzip 圧縮 JSON Lines
+    1行目  {"format": "image-manifest", "version": 1, "algo": ..., "created": ..., "root": ..., "image_exts": [...]}
+    2行目~ {"dir": "<相対フォルダ>", "files": [[name, size, mtime_ns, hash], ...]}
+
+例:
+    python sync_manifest.py --root "\\\\SERVER\\Share\\remote folder" --out remote_manifest.jsonl.gz
+    python check_oper_remote.py --local "D:\\local folder" --remote "\\\\SERVER\\Share\\remote folder" ^
+        --remote-manifest remote_manifest.jsonl.gz
+"""
+
+import os
+import sys
+import gzip
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+
+from hash_cache import open_cache
+from hash_engine import ALGORITHMS, HashEngine
+from tree_snapshot import DirSnapshot, FileMeta, TreeSnapshot
+
+PathLike = Union[str, Path]
+
+MANIFEST_FORMAT = "image-manifest"
+MANIFEST_VERSION = 1
+
+
+def write_manifest(snap: TreeSnapshot, out_path: PathLike, engine: HashEngine,
+                   image_exts: set, cache=None, workers: int = 8) -> int:
+    """snap の全画像をハッシュしてマニフェストを書き出し、ファイル数を返す。"""
+    def digest_of(m: FileMeta) -> str:
+        if cache is None:
+            return engine.hexdigest(m.path, allow_mmap=True)
+        return cache.get_or_compute_stat(m.path, m.size, m.mtime_ns, m.inode,
+                                         lambda p: engine.hexdigest(p, allow_mmap=True))
+
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    n = 0
+    with ThreadPoolExecutor(max_workers=workers) as ex, gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "algo": engine.algo,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "root": str(snap.root),
+            "image_exts": sorted(image_exts),
+        }, ensure_ascii=False) + "\n")
+        for rel in sorted(snap.dirs):
+            d = snap.dirs[rel]
+            digests = ex.map(digest_of, d.images)  # 順序は d.images のまま
+            files = [[m.name, m.size, m.mtime_ns, h] for m, h in zip(d.images, digests)]
+            f.write(json.dumps({"dir": rel, "files": files}, ensure_ascii=False) + "\n")
+            n += len(files)
+    os.replace(tmp, out_path)
+    return n
+
+
+def load_manifest(manifest_path: PathLike, remote_root: PathLike) -> Tuple[TreeSnapshot, dict]:
+    """
+    マニフェストを TreeSnapshot として読み込む（FileMeta.digest にハッシュ値が入る）。
+    path は remote_root 基準で組み立てるので、コピー時はそのまま実ファイルを参照できる。
+    戻り値の header で algo 等を確認すること。
+    """
+    root_s = str(remote_root)
+    snap = TreeSnapshot(remote_root)
+    with gzip.open(manifest_path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != MANIFEST_FORMAT or header.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"マニフェスト形式が不正です: {manifest_path}")
+        for line in f:
+            rec = json.loads(line)
+            rel = rec["dir"]
+            dpath = root_s if rel == "." else os.path.join(root_s, *rel.split("/"))
+            images = [FileMeta(name, os.path.join(dpath, name), size, mtime_ns, 0, digest)
+                      for name, size, mtime_ns, digest in rec["files"]]
+            snap.dirs[rel] = DirSnapshot(rel, dpath, images)
+    return snap, header
+
+
+def remote_snapshot(remote_root: Path, image_exts: set, manifest: Optional[str],
+                    algo: str, rels=None) -> TreeSnapshot:
+    """
+    比較ツール用：manifest 指定時はそれを読み込み（リモートを走査しない）、
+    無ければ従来どおり scandir で走査する。アルゴリズム不一致はエラー終了。
+    """
+    if not manifest:
+        if rels is not None:
+            return TreeSnapshot.build(remote_root, image_exts, rels=rels)
+        return TreeSnapshot.build(remote_root, image_exts) if remote_root.exists() else TreeSnapshot(remote_root)
+
+    snap, header = load_manifest(manifest, remote_root)
+    if header["algo"] != algo:
+        print(f"[ERROR] マニフェストのハッシュ（{header['algo']}）と比較ハッシュ（{algo}）が異なります")
+        sys.exit(1)
+    missing_exts = set(image_exts) - set(header.get("image_exts", []))
+    if missing_exts:
+        print(f"[WARN] マニフェストに含まれない拡張子があります: {sorted(missing_exts)}")
+    print(f"[INFO] リモートマニフェスト読込: {manifest}（{header['created']} 作成, "
+          f"{len(snap.dirs)} folders, {snap.file_count()} files）")
+    return snap
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="リモート画像ツリーのマニフェスト作成")
+    p.add_argument("--root", required=True, help="マニフェスト化するルート（リモート側）")
+    p.add_argument("--out", default="remote_manifest.jsonl.gz", help="出力ファイル")
+    p.add_argument("--image-exts", default=".jpg,.jpeg,.png,.gif,.bmp,.tif,.tiff,.webp",
+                   help="対象拡張子（小文字・カンマ区切り）")
+    p.add_argument("--hash-algo", choices=sorted(ALGORITHMS), default="md5",
+                   help="比較ツール側の --hash-algo と揃えること")
+    p.add_argument("--hash-cache", default=None, help="ハッシュキャッシュ（SQLite）。前回から未変更なら読まない")
+    p.add_argument("--workers", type=int, default=8, help="ハッシュ計算の並列数")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    root = Path(args.root)
+    image_exts = {e.strip().lower() for e in args.image_exts.split(",") if e.strip()}
+    if not root.exists():
+        print(f"[ERROR] ROOT が存在しません: {root}")
+        sys.exit(1)
+
+    t0 = datetime.now()
+    engine = HashEngine(args.hash_algo)
+    cache = open_cache(args.hash_cache, algo=engine.algo)
+    snap = TreeSnapshot.build(root, image_exts)
+    n = write_manifest(snap, args.out, engine, image_exts, cache=cache, workers=args.workers)
+    if cache is not None:
+        print(f"[INFO] ハッシュキャッシュ: {cache.summary()}")
+        cache.close()
+    print(f"[DONE] {args.out}: {len(snap.dirs)} folders, {n} files（{engine.algo}）。処理時間: {datetime.now() - t0}")
+
+
+if __name__ == "__main__":
+    main()
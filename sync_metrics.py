@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+同期ツールのフェーズ別計測（時間・カウンタ・スループット）
+
+- phase(name)：with ブロックの経過時間をフェーズに加算（スレッドセーフ）
+- timed(name, iterable)：ジェネレータの next() にかかった時間だけを加算
+  （走査ジェネレータなど、下流の処理時間を含めたくない場合）
+- add(name, n)：カウンタ加算。rate(name, counter, phase) で「counter / phase秒」を出力に含める
+- write_json(path)：1回分の計測を JSON で保存（回ごとの比較・監視用）
+- rows()：Excel の Metrics シート用の行
+
+パイプライン化しているためフェーズは時間的に重なる。各フェーズの秒数は
+「そのフェーズが動いていた時間」で、合計は wall_sec を超えることがある。
+ワーカー内で計る hash 等はスレッド合計（並列数ぶん大きくなる）。
+"""
+
+import json
+import time
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple, TypeVar, Union
+
+PathLike = Union[str, Path]
+T = TypeVar("T")
+
+METRICS_VERSION = 1
+
+
+class Metrics:
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.started = datetime.now()
+        self._t0 = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self.info: Dict[str, object] = {}
+        self._rates: List[Tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+
+    # --- 記録 ---
+    def add_time(self, name: str, sec: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + sec
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t)
+
+    def timed(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        it = iter(items)
+        while True:
+            t = time.perf_counter()
+            try:
+                x = next(it)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - t)
+                return
+            self.add_time(name, time.perf_counter() - t)
+            yield x
+
+    def add(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, value) -> None:
+        """カウンタ以外の付帯情報（設定値など）"""
+        self.info[name] = value
+
+    def rate(self, name: str, counter: str, phase: str) -> None:
+        """出力時に counters[counter] / phases[phase] を name として計算する。"""
+        self._rates.append((name, counter, phase))
+
+    # --- 出力 ---
+    def wall_sec(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            phases = dict(self.phases)
+            counters = dict(self.counters)
+        rates = {}
+        for name, counter, phase in self._rates:
+            sec = phases.get(phase, 0.0)
+            rates[name] = round(counters.get(counter, 0) / sec, 3) if sec > 0 else None
+        return {
+            "version": METRICS_VERSION,
+            "tool": self.tool,
+            "started": self.started.isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "wall_sec": round(self.wall_sec(), 3),
+            "phases_sec": {k: round(v, 3) for k, v in phases.items()},
+            "counters": counters,
+            "rates": rates,
+            "info": self.info,
+        }
+
+    def write_json(self, path: PathLike) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def rows(self) -> List[list]:
+        """Metrics シート用：[区分, 名前, 値]"""
+        d = self.to_dict()
+        rows = [["run", k, d[k]] for k in ("tool", "started", "finished", "wall_sec")]
+        rows += [["phase_sec", k, v] for k, v in d["phases_sec"].items()]
+        rows += [["counter", k, v] for k, v in d["counters"].items()]
+        rows += [["rate", k, v] for k, v in d["rates"].items()]
+        rows += [["info", k, str(v)] for k, v in d["info"].items()]
+        return rows
+
+    def summary(self) -> str:
+        d = self.to_dict()
+        return " ".join(f"{k}={v:.2f}s" for k, v in d["phases_sec"].items()) + f" (wall {d['wall_sec']:.2f}s)"
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import json
+
+from apply_journal import ApplyJournal
+from check_oper_remote import resume_apply
+
+
+def copy_row(src, dst):
+    return {"action": "COPY_REMOTE_TO_LOCAL", "local_path": str(dst), "remote_path": str(src), "rel_path": dst.name}
+
+
+def test_load_ignores_torn_last_line(tmp_path):
+    path = tmp_path / "j.jsonl"
+    j = ApplyJournal(path)
+    j.start([{"action": "DELETE_LOCAL_FILE", "local_path": "a"}, {"action": "DELETE_LOCAL_FILE", "local_path": "b"}],
+            meta={"hash_algo": "md5"})
+    j.begin(0)
+    j.done(0)
+    j.begin(1)
+    j.close()
+    with path.open("a", encoding="utf-8") as f:
+        f.write('{"t": "done", "i": 1, "o')  # 書きかけで落ちた
+
+    state = ApplyJournal.load(path)
+    assert [r["local_path"] for r in state.plan] == ["a", "b"]
+    assert state.plan_complete and not state.finished
+    assert state.done == {0}
+    assert state.in_flight == {1}
+    assert state.failed == set()
+    assert state.meta == {"hash_algo": "md5"}
+
+
+def test_failed_op_is_not_done_until_retried(tmp_path):
+    path = tmp_path / "j.jsonl"
+    j = ApplyJournal(path)
+    j.start([{"action": "DELETE_LOCAL_FILE", "local_path": "a"}])
+    j.begin(0)
+    j.done(0, ok=False, error="OSError()")
+    j.end()
+    state = ApplyJournal.load(path)
+    assert state.done == set() and state.failed == {0} and state.in_flight == set()
+
+    j.reopen()
+    j.begin(0)
+    j.done(0)
+    j.close()
+    state = ApplyJournal.load(path)
+    assert state.done == {0} and state.failed == set()
+
+
+def test_resume_retries_failed_and_in_flight(tmp_path):
+    remote, local = tmp_path / "remote", tmp_path / "local"
+    remote.mkdir()
+    local.mkdir()
+    (remote / "a.jpg").write_bytes(b"remote-a")
+    (remote / "b.jpg").write_bytes(b"remote-b")
+    (local / "a.jpg").write_bytes(b"local-a")   # 成功済み（やり直したら上書きされる）
+    (local / "x.jpg").write_bytes(b"x")
+
+    path = tmp_path / "j.jsonl"
+    j = ApplyJournal(path)
+    j.start([copy_row(remote / "a.jpg", local / "a.jpg"),
+             copy_row(remote / "b.jpg", local / "b.jpg"),
+             {"action": "DELETE_LOCAL_FILE", "local_path": str(local / "x.jpg"), "rel_path": "x.jpg"}],
+            meta={"hash_algo": "md5"})
+    j.begin(0)
+    j.done(0)
+    j.begin(1)
+    j.done(1, ok=False, error="OSError('share disconnected')")  # 切断中に失敗
+    j.begin(2)                                                 # 実行中に落ちた
+    j.end()
+
+    resume_apply(str(path), str(tmp_path / "out.xlsx"), workers=2, verify=False, sidecar="none")
+
+    assert (local / "a.jpg").read_bytes() == b"local-a"
+    assert (local / "b.jpg").read_bytes() == b"remote-b"
+    assert not (local / "x.jpg").exists()
+    state = ApplyJournal.load(path)
+    assert state.done == {0, 1, 2} and state.failed == set() and state.finished
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [r["i"] for r in records if r["t"] == "begin"].count(0) == 1  # 成功済みはやり直さない
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+SCRIPT = Path(__file__).resolve().parents[1] / "find_dataset_paths_update.py"
+
+
+def run(cwd: Path, *args: str) -> str:
+    res = subprocess.run([sys.executable, str(SCRIPT), *args], cwd=cwd, capture_output=True, text=True)
+    assert res.returncode == 0, res.stderr
+    return res.stdout
+
+
+def test_chained_rename_then_undo(tmp_path):
+    # A_12_b で x_12_y -> A_12_b、続く C_12_d で同じフォルダを A_12_b -> C_12_d（連鎖）
+    work = tmp_path / "work"
+    (work / "ds" / "train" / "x_12_y").mkdir(parents=True)
+    (work / "ds" / "train" / "x_12_y" / "a.jpg").write_bytes(b"x")
+    pd.DataFrame({"c": ["A_12_b", "C_12_d"]}).to_excel(work / "w.xlsx", sheet_name="sheet1", index=False, header=False)
+
+    run(work, "--excel", "w.xlsx", "--base", "ds", "--subsets", "train", "--apply")
+    train = work / "ds" / "train"
+    assert sorted(p.name for p in train.iterdir()) == ["C_12_d"]
+
+    # 別の場所から戻す（ジャーナルは絶対パス）
+    other = tmp_path / "other"
+    other.mkdir()
+    out = run(other, "--undo", str(work / "w.fsops.jsonl"))
+    assert sorted(p.name for p in train.iterdir()) == ["x_12_y"]
+    assert (train / "x_12_y" / "a.jpg").exists()
+    assert "2/2" in out
+
+    # 2回目は何もしない
+    out = run(other, "--undo", str(work / "w.fsops.jsonl"))
+    assert sorted(p.name for p in train.iterdir()) == ["x_12_y"]
+    assert "戻す操作はありません" in out
+
+
+def test_failed_rename_keeps_report_on_real_paths(tmp_path, monkeypatch):
+    # x_12_y -> A_12_b が失敗したら、その名前で見つけた行・続く A_12_b -> C_12_d の行も元の場所を指す
+    import find_dataset_paths_update as fdp
+
+    (tmp_path / "ds" / "train" / "x_12_y").mkdir(parents=True)
+    pd.DataFrame({"c": ["A_12_b", "A_12_b", "C_12_d"]}).to_excel(tmp_path / "w.xlsx", sheet_name="sheet1",
+                                                                  index=False, header=False)
+    real_rename = Path.rename
+
+    def rename(self, target):
+        if self.name == "x_12_y":
+            raise PermissionError("locked")
+        return real_rename(self, target)
+
+    monkeypatch.setattr(Path, "rename", rename)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", [str(SCRIPT), "--excel", "w.xlsx", "--base", "ds", "--subsets", "train", "--apply"])
+    fdp.main()
+
+    assert sorted(p.name for p in (tmp_path / "ds" / "train").iterdir()) == ["x_12_y"]
+    out = pd.read_excel(tmp_path / "w.xlsx", sheet_name="out").fillna("")
+    assert out["train_path"].tolist() == [str(Path("ds/train/x_12_y"))] * 3  # 指定どおりの相対パスのまま
+    assert all("error" in n for n in out["note"])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from near_dup import near_pairs, popcount64
+
+
+def brute_force(codes, max_dist, group=None):
+    n = len(codes)
+    pairs = set()
+    for i in range(n):
+        d = popcount64(codes[i] ^ codes[i + 1:])
+        for j in np.nonzero(d <= max_dist)[0] + i + 1:
+            if group is None or group[i] != group[j]:
+                pairs.add((i, int(j), int(d[j - i - 1])))
+    return pairs
+
+
+def random_codes(rng, n, planted):
+    # 一様乱数だけでは近い組がほぼ無いので、既存のコードのビットを数個反転した近似重複を混ぜる
+    codes = rng.integers(0, 2**64, size=n, dtype=np.uint64)
+    src = rng.integers(0, n, size=planted)
+    dst = rng.integers(0, n, size=planted)
+    for s, d in zip(src, dst):
+        flips = rng.choice(64, size=rng.integers(0, 9), replace=False)
+        codes[d] = codes[s] ^ np.uint64(sum(1 << int(b) for b in flips))
+    return codes
+
+
+@pytest.mark.parametrize("max_dist", [0, 1, 3, 6, 10])
+def test_near_pairs_matches_brute_force(max_dist):
+    rng = np.random.default_rng(max_dist)
+    codes = random_codes(rng, 700, 300)
+    i, j, d = near_pairs(codes, max_dist, block=97)  # ブロックの境目もまたぐ
+    got = set(zip(i.tolist(), j.tolist(), d.tolist()))
+    assert len(got) == len(i)  # 重複なし
+    assert got == brute_force(codes, max_dist)
+
+
+def test_near_pairs_group_filter():
+    rng = np.random.default_rng(1)
+    codes = random_codes(rng, 500, 250)
+    group = rng.integers(0, 3, size=len(codes))
+    i, j, d = near_pairs(codes, 6, group=group)
+    assert set(zip(i.tolist(), j.tolist(), d.tolist())) == brute_force(codes, 6, group)
+    assert (group[i] != group[j]).all()
+
+
+def test_near_pairs_empty():
+    i, j, d = near_pairs(np.array([0, 2**64 - 1], dtype=np.uint64), 3)
+    assert len(i) == len(j) == len(d) == 0
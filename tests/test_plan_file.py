@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+from plan_file import check_fingerprint, load_plan, revalidate, revalidate_all, write_plan
+
+
+def md5(path):
+    return hashlib.md5(open(path, "rb").read()).hexdigest()
+
+
+def fp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, md5(path)]
+
+
+def action(local, remote, kind="OVERWRITE_LOCAL"):
+    return {"action": kind, "reason": "", "rel_path": "a.jpg", "file_name": "a.jpg",
+            "local_path": str(local), "remote_path": str(remote),
+            "local": fp(local) if local.exists() else None,
+            "remote": fp(remote) if remote.exists() else None}
+
+
+def test_unchanged_and_touched_with_same_content(tmp_path):
+    local, remote = tmp_path / "l.jpg", tmp_path / "r.jpg"
+    local.write_bytes(b"old")
+    remote.write_bytes(b"new")
+    a = action(local, remote)
+    assert revalidate(a, md5) == ""
+
+    st = os.stat(remote)
+    os.utime(remote, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))  # mtime だけ変わった
+    reads = []
+    assert revalidate(a, lambda p: reads.append(p) or md5(p)) == ""
+    assert reads == [str(remote)]  # mtime が違うものだけ読み直す
+
+
+def test_stale_files(tmp_path):
+    local, remote = tmp_path / "l.jpg", tmp_path / "r.jpg"
+    local.write_bytes(b"old")
+    remote.write_bytes(b"new")
+    a = action(local, remote)
+
+    remote.write_bytes(b"newer")  # サイズが変わった
+    assert revalidate(a, md5).startswith("remote: サイズが変わっています")
+    remote.write_bytes(b"NEW")    # 同じサイズで内容が変わった
+    st = os.stat(remote)
+    os.utime(remote, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert revalidate(a, md5) == "remote: 内容が変わっています"
+
+    local.unlink()
+    assert "local: ファイルが無くなっています" in revalidate(a, md5)
+
+
+def test_copy_target_appeared(tmp_path):
+    local, remote = tmp_path / "l.jpg", tmp_path / "r.jpg"
+    remote.write_bytes(b"new")
+    a = action(local, remote, "COPY_REMOTE_TO_LOCAL")
+    assert a["local"] is None and revalidate(a, md5) == ""
+    local.write_bytes(b"someone else")
+    assert revalidate(a, md5) == "local: 計画時には無かったファイルがあります"
+    assert check_fingerprint(str(tmp_path / "none.jpg"), None, md5) == ""
+
+
+def test_revalidate_all_keeps_order_and_roundtrips(tmp_path):
+    actions = []
+    for k in range(20):
+        local, remote = tmp_path / f"l{k}.jpg", tmp_path / f"r{k}.jpg"
+        local.write_bytes(b"l%d" % k)
+        remote.write_bytes(b"r%d" % k)
+        actions.append(action(local, remote))
+    out = tmp_path / "p.plan.jsonl.gz"
+    assert write_plan(out, {"clean": True, "reasons": []}, actions) == 20
+    header, loaded = load_plan(out)
+    assert header["clean"] and loaded == actions
+
+    (tmp_path / "r7.jpg").unlink()
+    stale = revalidate_all(loaded, md5, workers=4)
+    assert [k for k, why in enumerate(stale) if why] == [7]
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+転送の帯域・IOPS 制限（トークンバケット）
+
+日中に大量コピーすると共有回線を占有してしまうため、適用フェーズのコピーに上限をかける。
+
+- TokenBucket：毎秒 rate 個のトークンが溜まる（上限 burst 個）。acquire(n) で n 個を消費し、
+  足りなければ溜まるまで待つ。burst を超える要求も借り越して通し、その分だけ後続を待たせる
+  （大きいファイル1つで止まらない。コピーは 1 MiB ごとに消費するので瞬間的な占有も抑えられる）
+- TransferThrottle：バイト/秒とファイル/秒の2つのバケット。制御ファイルを数秒ごとに確認し、
+  書き換えられていれば実行中でも上限を差し替える（無ければ起動時の値で作成する）
+- DirListing：同じフォルダへの存在確認が list_after 回を超えたら、そのフォルダの一覧を1回の scandir で取り、
+  以降はまとめて答える（ファイルごとの stat 往復を減らす。一覧に無い名前だけは stat で確かめる）。
+  数件しか確かめないフォルダは stat だけで済ませ、大きなフォルダを丸ごと一覧しない
+
+制御ファイル（key = value。# 以降はコメント。0 で無制限）:
+    max_mbps = 40            # MiB/秒
+    max_files_per_sec = 200
+    paused = 0               # 1 で新しいコピーの開始を止める（実行中のものは最後まで）
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Union
+
+PathLike = Union[str, Path]
+
+MIB = 1024 * 1024
+PACE_CHUNK = MIB   # fast_copy がトークンを消費する単位
+
+_CONTROL_KEYS = ("max_mbps", "max_files_per_sec", "paused")
+
+
+class TokenBucket:
+    def __init__(self, rate: float = 0.0, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        """rate <= 0 で無制限。burst の既定は1秒分"""
+        with self._lock:
+            self.rate = max(0.0, float(rate))
+            self.burst = float(burst) if burst is not None else self.rate
+            self._tokens = min(self._tokens, self.burst) if self.rate > 0 else 0.0
+            self._t = time.monotonic()
+
+    def acquire(self, n: float = 1.0) -> float:
+        """n 個を消費する（足りなければ待つ）。待った秒数を返す。"""
+        with self._lock:
+            if self.rate <= 0 or n <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+            self._t = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def read_control(path: PathLike) -> Dict[str, float]:
+    """制御ファイルを読む（未知のキー・数値でない値は無視）"""
+    values: Dict[str, float] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if "=" not in line:
+                continue
+            key, val = (x.strip() for x in line.split("=", 1))
+            if key in _CONTROL_KEYS:
+                try:
+                    values[key] = float(val)
+                except ValueError:
+                    print(f"[WARN] 制御ファイルの値を読めません: {key} = {val}")
+    return values
+
+
+class TransferThrottle:
+    def __init__(self, max_mbps: float = 0.0, max_files_per_sec: float = 0.0,
+                 control_path: Optional[PathLike] = None, check_interval: float = 2.0):
+        self.bytes = TokenBucket(max_mbps * MIB)
+        self.files = TokenBucket(max_files_per_sec)
+        self.max_mbps = max_mbps
+        self.max_files_per_sec = max_files_per_sec
+        self.paused = False
+        self.waited = 0.0            # 制限で待った合計秒数（全ワーカー合計）
+        self.control_path = Path(control_path) if control_path else None
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._mtime_ns: Optional[int] = None
+        if self.control_path is not None:
+            if not self.control_path.exists():
+                self._write_control()
+            self._check_control(force=True)
+
+    @property
+    def limited(self) -> bool:
+        """コピーをチャンク単位で刻む必要があるか（制御ファイルがあれば途中で絞られ得る）"""
+        return self.control_path is not None or self.bytes.rate > 0
+
+    def describe(self) -> str:
+        mbps = f"{self.max_mbps:g} MiB/s" if self.max_mbps > 0 else "無制限"
+        fps = f"{self.max_files_per_sec:g} files/s" if self.max_files_per_sec > 0 else "無制限"
+        return f"帯域 {mbps} / ファイル数 {fps}" + ("（一時停止中）" if self.paused else "")
+
+    def _write_control(self) -> None:
+        self.control_path.write_text(
+            "# 転送制限（実行中に書き換えると数秒以内に反映。0 で無制限）\n"
+            f"max_mbps = {self.max_mbps:g}\n"
+            f"max_files_per_sec = {self.max_files_per_sec:g}\n"
+            "paused = 0\n", encoding="utf-8")
+
+    def _check_control(self, force: bool = False) -> None:
+        if self.control_path is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                mtime_ns = self.control_path.stat().st_mtime_ns
+                if mtime_ns == self._mtime_ns:
+                    return
+                values = read_control(self.control_path)
+            except OSError:
+                return  # 消えた・書き込み途中などは前の値のまま
+            self._mtime_ns = mtime_ns
+            self.max_mbps = values.get("max_mbps", self.max_mbps)
+            self.max_files_per_sec = values.get("max_files_per_sec", self.max_files_per_sec)
+            self.paused = bool(values.get("paused", 0))
+            self.bytes.set_rate(self.max_mbps * MIB)
+            self.files.set_rate(self.max_files_per_sec)
+        print(f"[INFO] 転送制限: {self.describe()}（{self.control_path}）")
+
+    def before_file(self) -> None:
+        """ファイル1つのコピーを始める前に呼ぶ（一時停止中・ファイル数上限なら待つ）"""
+        self._check_control()
+        while self.paused:
+            time.sleep(self.check_interval)
+            self._add_wait(self.check_interval)
+            self._check_control()
+        self._add_wait(self.files.acquire(1))
+
+    def on_bytes(self, n: int) -> None:
+        """コピーしたバイト数を通知する（帯域上限なら待つ）"""
+        self._check_control()
+        self._add_wait(self.bytes.acquire(n))
+
+    def _add_wait(self, sec: float) -> None:
+        if sec > 0:
+            with self._lock:  # 複数のコピースレッドから呼ばれる
+                self.waited += sec
+
+    @property
+    def pace(self) -> Optional[Callable[[int], None]]:
+        """fast_copy に渡す進捗コールバック（制限が無ければ None で一括コピー）"""
+        return self.on_bytes if self.limited else None
+
+
+class DirListing:
+    """フォルダごとの名前一覧を覚えて存在確認に答える（直近 max_dirs フォルダ分）"""
+
+    def __init__(self, max_dirs: int = 256, list_after: int = 4):
+        self.max_dirs = max_dirs
+        self.list_after = list_after
+        self.listed = 0
+        self.stats = 0
+        self.hits = 0
+        self._dirs: "OrderedDict[str, Set[str]]" = OrderedDict()
+        self._asked: "OrderedDict[str, int]" = OrderedDict()  # 一覧前のフォルダごとの問い合わせ数
+        self._lock = threading.Lock()
+
+    def exists(self, path: PathLike) -> bool:
+        p = os.fspath(path)
+        parent, name = os.path.split(p)
+        with self._lock:
+            names = self._dirs.get(parent)
+            if names is not None:
+                self._dirs.move_to_end(parent)
+            else:
+                asked = self._asked.pop(parent, 0) + 1
+                if asked <= self.list_after:
+                    self._asked[parent] = asked
+                    self.stats += 1
+                    while len(self._asked) > self.max_dirs * 4:
+                        self._asked.popitem(last=False)
+        if names is None and asked <= self.list_after:
+            return os.path.exists(p)  # 数件ならフォルダを一覧せず stat 1回
+        if names is None:
+            try:
+                with os.scandir(parent) as it:
+                    names = {e.name for e in it}
+            except OSError:
+                names = set()
+            with self._lock:
+                self.listed += 1
+                self._dirs[parent] = names
+                while len(self._dirs) > self.max_dirs:
+                    self._dirs.popitem(last=False)
+        if name in names:
+            with self._lock:
+                self.hits += 1
+            return True
+        return os.path.exists(p)  # 一覧取得後にできた・大文字小文字違いなど
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+フォルダツリーのスナップショット（os.scandir 1パス）
+
+- 各フォルダを1回だけ scandir し、画像ファイルの size / mtime / inode を保持
+- 以降のフォルダ突合・画像列挙・メタデータ参照はすべてスナップショットから行う
+  （SMB では stat/exists/iterdir がそれぞれ往復になるため、再問い合わせしない）
+- rel は "/" 区切りの相対パス（ルートは "."。従来の to_rel(...).as_posix() と同じ表記）
+
+注意
+- Windows の DirEntry.stat() は st_ino が常に 0（追加の往復を避けるためそのまま使う）
+- シンボリックリンクのフォルダは os.walk 既定と同様に辿らない
+"""
+
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+
+PathLike = Union[str, Path]
+
+
+class FileMeta(NamedTuple):
+    name: str
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    digest: str = ""   # マニフェスト由来など、既知のハッシュ値（無ければ空）
+
+    @property
+    def mtime(self) -> datetime:
+        return datetime.fromtimestamp(self.mtime_ns / 1e9)
+
+
+class DirSnapshot(NamedTuple):
+    rel: str
+    path: str
+    images: List[FileMeta]   # 直下の画像のみ（名前順）
+
+    def index(self) -> Dict[str, FileMeta]:
+        """小文字ファイル名 → FileMeta"""
+        return {m.name.lower(): m for m in self.images}
+
+
+def join_rel(rel: str, name: str) -> str:
+    return name if rel == "." else f"{rel}/{name}"
+
+
+def scan_dir(path: str, rel: str, image_exts: set) -> Optional[tuple]:
+    """1フォルダを scandir し (DirSnapshot, [(子rel, 子path), ...]) を返す。読めなければ None。"""
+    images: List[FileMeta] = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append((join_rel(rel, e.name), e.path))
+                    elif e.is_file() and os.path.splitext(e.name)[1].lower() in image_exts:
+                        st = e.stat()
+                        images.append(FileMeta(e.name, e.path, st.st_size, st.st_mtime_ns, st.st_ino))
+                except OSError:
+                    continue  # 列挙中に消えた等
+    except OSError:
+        return None
+    images.sort(key=lambda m: m.name)
+    subdirs.sort()
+    return DirSnapshot(rel, path, images), subdirs
+
+
+class TreeSnapshot:
+    def __init__(self, root: PathLike, dirs: Optional[Dict[str, DirSnapshot]] = None):
+        self.root = Path(root)
+        self.dirs: Dict[str, DirSnapshot] = dirs if dirs is not None else {}
+
+    @classmethod
+    def build(cls, root: PathLike, image_exts: set,
+              rels: Optional[Iterable[str]] = None) -> "TreeSnapshot":
+        """
+        rels 省略時：root 配下を再帰的に走査（root 自身を含む）
+        rels 指定時：その相対フォルダだけを非再帰で走査（存在しないものは載らない）
+        """
+        snap = cls(root)
+        root_s = str(root)
+        if rels is not None:
+            for rel in rels:
+                path = root_s if rel == "." else os.path.join(root_s, *rel.split("/"))
+                res = scan_dir(path, rel, image_exts)
+                if res is not None:
+                    snap.dirs[rel] = res[0]
+            return snap
+
+        stack = [(".", root_s)]
+        while stack:
+            rel, path = stack.pop()
+            res = scan_dir(path, rel, image_exts)
+            if res is None:
+                continue
+            d, subdirs = res
+            snap.dirs[rel] = d
+            stack.extend(reversed(subdirs))
+        return snap
+
+    def get(self, rel: str) -> Optional[DirSnapshot]:
+        return self.dirs.get(rel)
+
+    def children_index(self) -> Dict[str, List[str]]:
+        """親rel → 子rel 一覧（名前順）"""
+        children: Dict[str, List[str]] = {}
+        for rel in sorted(self.dirs):
+            if rel == ".":
+                continue
+            parent = rel.rsplit("/", 1)[0] if "/" in rel else "."
+            children.setdefault(parent, []).append(rel)
+        return children
+
+    def rel_set(self) -> set:
+        return set(self.dirs)
+
+    def file_count(self) -> int:
+        return sum(len(d.images) for d in self.dirs.values())
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+常駐同期（--watch）用の変更検出
+
+- ローカル：Linux は inotify（ctypes で libc を直接呼ぶ。追加依存なし）。
+  使えない環境（Windows 等・監視数上限）は一定間隔でローカルを scandir し、
+  フォルダごとの一覧署名（merkle.listing_signature）の差分で検出する
+- リモート：既知フォルダの mtime を定期的に stat するだけ（1フォルダ1往復）。
+  SMB/NTFS ではファイルの追加・削除・改名でフォルダの mtime が変わる。
+  同名での上書き（内容だけの変更）はフォルダ mtime に出ないため、
+  定期的な全体比較（--full-rescan-minutes）で拾う
+- dirty_pairs：変更のあったフォルダだけを両側 scandir して FolderPair を返す
+  （新しくできた子フォルダは配下ごと含める）
+
+いずれも「変更のあった相対フォルダ（"/" 区切り、ルートは "."）の集合」を返す。
+集合に FULL_RESCAN が入っていたら全体を比較し直すこと（inotify のキュー溢れ等）。
+"""
+
+import os
+import sys
+import time
+import errno
+import heapq
+import select
+import struct
+import ctypes
+import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from crawler import order_key
+from merkle import listing_signature
+from pipeline import FolderPair
+from tree_snapshot import TreeSnapshot, join_rel, scan_dir
+
+PathLike = Union[str, Path]
+
+FULL_RESCAN = "*"
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+               | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+
+def _abs(root_s: str, rel: str) -> str:
+    return root_s if rel == "." else os.path.join(root_s, *rel.split("/"))
+
+
+def _parent(rel: str) -> str:
+    return rel.rsplit("/", 1)[0] if "/" in rel else "."
+
+
+class InotifyWatcher:
+    """ローカルツリーの全フォルダを inotify で監視する（Linux のみ）。"""
+
+    def __init__(self, root: PathLike, rels: Iterable[str]):
+        name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        self.root_s = str(root)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wd: Dict[int, str] = {}
+        for rel in rels:
+            self.add(rel)
+
+    def add(self, rel: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(_abs(self.root_s, rel)), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return  # 監視前に消えた
+            raise OSError(err, f"inotify_add_watch failed: {rel}")
+        self._wd[wd] = rel
+
+    def _add_tree(self, rel: str, changed: Set[str]) -> None:
+        """新しくできたフォルダ（移動で入ってきたものを含む）を配下ごと監視に加える"""
+        stack = [rel]
+        while stack:
+            r = stack.pop()
+            self.add(r)
+            changed.add(r)
+            try:
+                with os.scandir(_abs(self.root_s, r)) as it:
+                    stack.extend(join_rel(r, e.name) for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def changes(self, timeout: float) -> Set[str]:
+        """timeout 秒まで待ち、その間に変更のあったフォルダを返す。"""
+        changed: Set[str] = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changed
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buf, pos)
+                name = buf[pos + _EVENT.size: pos + _EVENT.size + length].split(b"\0", 1)[0]
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed.add(FULL_RESCAN)
+                    continue
+                rel = self._wd.get(wd)
+                if rel is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._wd[wd]
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.add(_parent(rel) if rel != "." else rel)
+                    continue
+                changed.add(rel)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(join_rel(rel, os.fsdecode(name)), changed)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class LocalPoller:
+    """inotify が使えない場合：interval ごとにローカルを走査し、一覧署名の変わったフォルダを返す。"""
+
+    def __init__(self, root: PathLike, image_exts: set):
+        self.root = Path(root)
+        self.image_exts = image_exts
+        self._sigs = self._scan()
+
+    def _scan(self) -> Dict[str, str]:
+        snap = TreeSnapshot.build(self.root, self.image_exts)
+        return {rel: listing_signature(d) for rel, d in snap.dirs.items()}
+
+    def changes(self, timeout: float) -> Set[str]:
+        time.sleep(timeout)
+        old, sigs = self._sigs, self._scan()
+        self._sigs = sigs
+        changed = {rel for rel in sigs.keys() | old.keys() if sigs.get(rel) != old.get(rel)}
+        # 消えた・増えたフォルダは親の一覧も見直す
+        changed |= {_parent(rel) for rel in changed if rel != "." and (rel not in sigs or rel not in old)}
+        return changed
+
+    def add(self, rel: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def local_watcher(root: PathLike, rels: Iterable[str], image_exts: set):
+    """inotify が使えればそれを、無理ならポーリングを返す。"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, rels)
+        except (OSError, AttributeError) as e:
+            print(f"[WARN] inotify が使えないためローカルはポーリングで監視します（{e}）")
+    return LocalPoller(root, image_exts)
+
+
+class RemoteDirPoller:
+    """既知のリモートフォルダの mtime を stat で見張る（最大 inflight 件を同時に問い合わせ）。"""
+
+    def __init__(self, root: PathLike, rels: Iterable[str], inflight: int = 16):
+        self.root_s = str(root)
+        self._ex = ThreadPoolExecutor(max_workers=max(1, inflight), thread_name_prefix="rpoll")
+        self._mtimes: Dict[str, Optional[int]] = {}
+        self.update(rels)
+
+    def _stat(self, rel: str) -> Optional[int]:
+        try:
+            return os.stat(_abs(self.root_s, rel)).st_mtime_ns
+        except OSError:
+            return None
+
+    def update(self, rels: Iterable[str]) -> None:
+        """監視対象に加える・記録し直す（見つからないものは対象から外す）"""
+        rels = list(rels)
+        for rel, m in zip(rels, self._ex.map(self._stat, rels)):
+            if m is None:
+                self._mtimes.pop(rel, None)
+            else:
+                self._mtimes[rel] = m
+
+    def forget(self, rel: str) -> None:
+        """rel と配下を監視対象から外す"""
+        prefix = rel + "/"
+        for r in [r for r in self._mtimes if r == rel or r.startswith(prefix)]:
+            del self._mtimes[r]
+
+    def changes(self) -> Set[str]:
+        """mtime の変わったフォルダを返す。新しい mtime はこの時点で記録する
+        （この後の走査より前の値なので、走査中の変更は次回に拾える）"""
+        rels = list(self._mtimes)
+        changed: Set[str] = set()
+        for rel, m in zip(rels, self._ex.map(self._stat, rels)):
+            if m == self._mtimes[rel]:
+                continue
+            changed.add(rel)
+            if m is None:
+                changed.add(_parent(rel))
+                del self._mtimes[rel]
+            else:
+                self._mtimes[rel] = m
+        return changed
+
+    def __contains__(self, rel: str) -> bool:
+        return rel in self._mtimes
+
+    def __len__(self) -> int:
+        return len(self._mtimes)
+
+    def close(self) -> None:
+        self._ex.shutdown(wait=False)
+
+
+def dirty_pairs(local_root: PathLike, remote_root: PathLike, image_exts: set,
+                rels: Iterable[str], known: Set[str]) -> Iterator[FolderPair]:
+    """
+    変更のあったフォルダだけを両側 scandir して返す（walk_pairs と同じ深さ優先・名前順）。
+    known に無い子フォルダ（新しくできたもの）は配下ごと含める。両側とも無いフォルダは返さない。
+    """
+    local_s, remote_s = str(local_root), str(remote_root)
+    todo: List[tuple] = [(order_key(r), r) for r in set(rels) if r != FULL_RESCAN]
+    heapq.heapify(todo)
+    seen: Set[str] = set()
+    while todo:
+        _, rel = heapq.heappop(todo)
+        if rel in seen:
+            continue
+        seen.add(rel)
+        l_res = scan_dir(_abs(local_s, rel), rel, image_exts)
+        r_res = scan_dir(_abs(remote_s, rel), rel, image_exts)
+        if l_res is None and r_res is None:
+            continue
+        yield FolderPair(rel, l_res[0] if l_res else None, r_res[0] if r_res else None)
+        subs = {c for c, _ in (l_res[1] if l_res else [])} | {c for c, _ in (r_res[1] if r_res else [])}
+        for c in subs:
+            if c not in known and c not in seen:
+                heapq.heappush(todo, (order_key(c), c))